@@ -1,7 +1,8 @@
 from fastapi import APIRouter
-from .endpoints import files, batches, keywords
+from .endpoints import files, batches, keywords, fleet
 
 api_router = APIRouter()
 api_router.include_router(files.router, prefix="/files", tags=["files"])
 api_router.include_router(batches.router, prefix="/batches", tags=["batches"])
 api_router.include_router(keywords.router, prefix="/keywords", tags=["keywords"])  # 新增
+api_router.include_router(fleet.router, prefix="/fleet", tags=["fleet"])
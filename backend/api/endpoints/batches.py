@@ -1,71 +1,53 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+import fnmatch
+import json
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, defer
 from ... import crud, schemas
 from ...database import get_db
+from ...services.admission_service import AdmissionRejected, admit_stage
+from ...services.export_service import EXPORT_FORMATS, EXPORT_STAGES, collect_export_entries, iter_archive
 from ...services.file_service import perform_second_cleaning
-from typing import List
+from ...services.grep_service import (
+    GREP_MAX_RESULTS,
+    GREP_STAGES,
+    GREP_TIMEOUT,
+    GrepBusy,
+    GrepPatternError,
+    compile_grep_pattern,
+    grep_busy,
+    stream_grep,
+)
+from ...services.retention_service import run_gc
+from ...services.summary_service import materialize_batch_summary
+from ...services.watch_service import WATCH_DIRS, run_watch_scan
+from typing import List, Optional
 from ...models import Batch, OriginalFile, CleanedFile1, CleanedFile2, KeywordMatchResult
 
 
 router = APIRouter()
 
-@router.get("/", response_model=List[schemas.BatchWithFiles])
-def read_batches(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    batches = crud.get_batches(db, skip=skip, limit=limit)
-    # 为每个批次补充关联数据
-    result_batches = []
-    for batch in batches:
-        # 1. 查询该批次的原始文件
-        original_files = db.query(OriginalFile).filter(
-            OriginalFile.batch_id == batch.id
-        ).all()
-
-        # 2. 查询该批次的初次清洗文件
-        cleaned_files_1 = db.query(CleanedFile1).filter(
-            CleanedFile1.batch_id == batch.id
-        ).all()
-
-        # 3. 查询该批次的二次清洗文件（按需求保留，可能为空）
-        cleaned_files_2 = db.query(CleanedFile2).filter(
-            CleanedFile2.batch_id == batch.id
-        ).all()
-
-        # 4. 查询该批次的关键词匹配结果（关联原始文件名）
-        keyword_matches = []
-        if original_files:
-            # 先获取该批次所有原始文件的id和文件名映射
-            file_id_to_name = {f.id: f.filename for f in original_files}
-
-            # 查询该批次的关键词结果
-            matches = db.query(KeywordMatchResult).filter(
-                KeywordMatchResult.batch_id == batch.id
-            ).all()
-
-            # 补充原始文件名（前端表格需要显示）
-            for match in matches:
-                keyword_matches.append({
-                    "id": match.id,
-                    "file_id": match.file_id,
-                    "batch_id": batch.id,
-                    "filename": match.filename,
-                    "file_path": match.file_path[match.file_path.find("/static"):] if match.file_path else None,# 将/static字符前面路径部分删除
-                    "keyword_set_id": match.keyword_set_id,
-                    "created_at": match.created_at
-                })
-
-        # 组装批次数据（转换为Pydantic模型可识别的格式）
-        result_batches.append({
-            "id": batch.id,
-            "timestamp": batch.timestamp,  # 假设批次模型用created_at存储创建时间
-            "description": batch.description,
-            "status": batch.status,
-            "original_files": original_files,
-            "cleaned_files_1": cleaned_files_1,
-            "cleaned_files_2": cleaned_files_2,
-            "keyword_matches": keyword_matches
-        })
-
-    return result_batches
+@router.get("/", response_model=List[schemas.BatchListItem])
+def read_batches(skip: int = 0, limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_db)):
+    """批次列表：统计信息读取 batch_summaries，不加载文件记录和匹配结果（文件列表见批次详情接口）"""
+    return [
+        schemas.BatchListItem(
+            id=batch.id,
+            timestamp=batch.timestamp,
+            description=batch.description,
+            pinned=bool(batch.pinned),
+            status=batch.status,
+            summary=schemas.BatchSummary.model_validate(summary, from_attributes=True) if summary is not None else None,
+        )
+        for batch, summary in crud.get_batches_with_summaries(db, skip=skip, limit=limit)
+    ]
+
+
+@router.get("/summaries", response_model=List[schemas.BatchSummary])
+def read_batch_summaries(skip: int = 0, limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_db)):
+    """已物化的批次统计（按批次ID倒序），不加载文件记录和匹配结果"""
+    return crud.get_batch_summaries(db, skip=skip, limit=limit)
 
 
 @router.get("/{batch_id}", response_model=schemas.BatchResponse)
@@ -85,7 +67,10 @@ def read_batch(
 
     # 关键词结果补充原始文件名
     #file_id_to_name = {f.id: f.filename for f in original_files} if original_files else {}
-    matches = db.query(KeywordMatchResult).filter(KeywordMatchResult.batch_id == batch_id).all()
+    # 只需结果的元数据，不加载 match_data
+    matches = db.query(KeywordMatchResult).options(defer(KeywordMatchResult.match_data)).filter(
+        KeywordMatchResult.batch_id == batch_id
+    ).all()
 
     keyword_matches = [{
         "id": m.id,
@@ -100,7 +85,7 @@ def read_batch(
 
     return {
         "id": batch.id,
-        "timestamp": batch.created_at,
+        "timestamp": batch.timestamp,
         "description": batch.description,
         "status": batch.status,
         "original_files": original_files,
@@ -122,6 +107,132 @@ def clean_batch_second_time(batch_id: int, db: Session = Depends(get_db)):
     if batch is None:
         raise HTTPException(status_code=404, detail="Batch not found")
 
-    # 执行二次清洗
-    perform_second_cleaning(batch_id, db)
-    return crud.get_batch(db, batch_id=batch_id)
\ No newline at end of file
+    # 执行二次清洗（与后台任务共用准入预算，排队已满时返回 429）
+    try:
+        with admit_stage(db, batch_id, "clean_2", reject_when_full=True):
+            perform_second_cleaning(batch_id, db)
+    except AdmissionRejected as e:
+        raise e.to_http_exception()
+    return crud.get_batch(db, batch_id=batch_id)
+
+
+@router.get("/{batch_id}/tasks", response_model=List[schemas.BatchTask])
+def read_batch_tasks(batch_id: int, db: Session = Depends(get_db)):
+    """批次的处理任务（状态、已完成阶段、重试次数、租约持有者）"""
+    if crud.get_batch(db, batch_id=batch_id) is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return crud.get_batch_tasks_by_batch(db, batch_id)
+
+
+@router.post("/{batch_id}/tasks/{task_id}/retry", response_model=schemas.BatchTask)
+def retry_batch_task(batch_id: int, task_id: int, db: Session = Depends(get_db)):
+    """重新排队失败的任务，从最后完成的阶段继续"""
+    task = crud.get_batch_task(db, task_id)
+    if task is None or task.batch_id != batch_id:
+        raise HTTPException(status_code=404, detail="Task not found")
+    task = crud.retry_batch_task(db, task_id)
+    if task is None:
+        raise HTTPException(status_code=400, detail="只能重试失败的任务")
+    return task
+
+
+@router.get("/{batch_id}/export")
+def export_batch(
+    batch_id: int,
+    format: str = Query("zip", pattern=r"^(zip|tar\.gz)$"),
+    stages: Optional[str] = Query(None, description="逗号分隔的阶段：original,cleaned_1,cleaned_2,match（默认全部）"),
+    glob: Optional[str] = Query(None, description="只导出文件名匹配该通配符的文件，如 *.cfg*"),
+    db: Session = Depends(get_db)
+):
+    """将批次文件打包为 zip / tar.gz，边压缩边返回（不生成临时文件）"""
+    if crud.get_batch(db, batch_id=batch_id) is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    stage_list = [s.strip() for s in stages.split(",") if s.strip()] if stages else None
+    unknown = set(stage_list or []) - set(EXPORT_STAGES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"未知的阶段: {sorted(unknown)}")
+
+    entries = collect_export_entries(db, batch_id, stages=stage_list, pattern=glob)
+    if not entries:
+        raise HTTPException(status_code=404, detail="没有可导出的文件")
+    return StreamingResponse(
+        iter_archive(entries, format),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="batch_{batch_id}.{format}"'},
+    )
+
+
+@router.get("/{batch_id}/summary", response_model=schemas.BatchSummary)
+def read_batch_summary(batch_id: int, refresh: bool = False, db: Session = Depends(get_db)):
+    """批次统计；尚未物化（如批次在统计功能之前完成）或 refresh=true 时重新计算"""
+    summary = None if refresh else crud.get_batch_summary(db, batch_id)
+    if summary is None:
+        summary = materialize_batch_summary(db, batch_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return summary
+
+
+@router.get("/{batch_id}/grep")
+async def grep_batch(
+    batch_id: int,
+    request: Request,
+    pattern: str = Query(..., min_length=1, description="正则表达式（逐行匹配）"),
+    stage: str = Query("original", pattern=f"^({"|".join(GREP_STAGES)})$"),
+    glob: Optional[str] = Query(None, description="只搜索文件名匹配该通配符的文件，如 *.cfg*"),
+    ignore_case: bool = False,
+    max_results: int = Query(GREP_MAX_RESULTS, ge=1, le=GREP_MAX_RESULTS),
+    timeout: float = Query(GREP_TIMEOUT, gt=0, le=GREP_TIMEOUT, description="最长搜索时间（秒）"),
+    db: Session = Depends(get_db)
+):
+    """
+    临时正则搜索：并行扫描批次文件，以 NDJSON 逐行返回命中（每扫完一个文件返回一次），
+    最后一行为统计（type=summary）；客户端断开后停止扫描
+    """
+    if crud.get_batch(db, batch_id=batch_id) is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    try:
+        compile_grep_pattern(pattern, ignore_case)
+    except GrepPatternError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if grep_busy():
+        raise HTTPException(status_code=429, detail="同时进行的搜索过多，请稍后重试", headers={"Retry-After": "5"})
+
+    files = [(s, path) for s, path in crud.get_batch_file_paths(db, batch_id)
+             if s == stage and (not glob or fnmatch.fnmatch(os.path.basename(path), glob))]
+
+    async def ndjson():
+        try:
+            async for record in stream_grep(files, pattern, ignore_case=ignore_case, max_results=max_results,
+                                            timeout=timeout, is_disconnected=request.is_disconnected):
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+        except GrepBusy as e:
+            yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@router.put("/{batch_id}/pin", response_model=schemas.Batch)
+def pin_batch(batch_id: int, pinned: bool = True, db: Session = Depends(get_db)):
+    """固定（或取消固定）批次：固定的批次不受保留策略清理"""
+    if crud.get_batch(db, batch_id=batch_id) is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return crud.set_batch_pinned(db, batch_id, pinned)
+
+
+@router.post("/gc")
+def collect_garbage(
+    keep_per_device: Optional[int] = Query(None, ge=0, description="每台设备保留的最近批次数（默认 KY_RETAIN_PER_DEVICE）"),
+    keep_days: Optional[int] = Query(None, ge=0, description="保留最近多少天内的批次（默认 KY_RETAIN_DAYS）"),
+    dry_run: bool = Query(True, description="只返回将要删除的批次"),
+):
+    """按保留策略立即执行一次清理（默认只预览）"""
+    return run_gc(keep_per_device=keep_per_device, keep_days=keep_days, dry_run=dry_run)
+
+
+@router.post("/watch/scan")
+def scan_watch_dirs(keyword_set_id: Optional[int] = None):
+    """立即扫描监视目录（KY_WATCH_DIRS），把新增或变化的文件导入为批次"""
+    if not WATCH_DIRS:
+        raise HTTPException(status_code=400, detail="未配置监视目录（KY_WATCH_DIRS）")
+    return run_watch_scan(keyword_set_id=keyword_set_id)
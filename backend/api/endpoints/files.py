@@ -1,9 +1,18 @@
-from fastapi import APIRouter, Form, UploadFile, File, Depends, HTTPException, Query
-from fastapi.responses import FileResponse, PlainTextResponse
+import os
+from fastapi import APIRouter, Form, UploadFile, File, Depends, HTTPException, Query, Request
+from fastapi.responses import FileResponse, PlainTextResponse, Response
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
 from sqlalchemy.orm import Session
 from ... import crud, schemas, models
 from ...database import get_db
+from ...services.admission_service import AdmissionRejected
+from ...services.cache_service import cache_stats
+from ...services.cleaned2_service import is_sections_file, list_sections, read_document_bytes, read_section_bytes
 from ...services.file_service import process_uploaded_files, get_file_content
+from ...services.retention_service import delete_batches_with_files
+from ...services.upload_service import UploadConflict, UploadError, create_upload, finalize_upload, write_chunk
+from ...services.snapshot_service import get_config_drift
 from typing import List, Optional
 
 router = APIRouter()
@@ -16,9 +25,79 @@ async def upload_files(
     keyword_set_id: int = Form(...),
     db: Session = Depends(get_db)
 ):
-    batch = await process_uploaded_files(files, description, db, keyword_set_id)
+    # 处理过程是同步的（文件读写、解析、匹配），放到线程池中执行，避免阻塞事件循环
+    try:
+        batch = await run_in_threadpool(process_uploaded_files, files, description, db, keyword_set_id)
+    except AdmissionRejected as e:
+        raise e.to_http_exception()
     return batch
 
+# 可续传的分块上传：创建会话 -> 按偏移 PUT 分块（可查询已接收范围后续传）-> 完成并入队处理
+@router.post("/uploads", response_model=schemas.UploadSession)
+def create_upload_session(request: schemas.UploadSessionCreate, db: Session = Depends(get_db)):
+    try:
+        return create_upload(db, request)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _open_upload_session(db: Session, session_id: int):
+    session = crud.get_upload_session(db, session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return session
+
+@router.get("/uploads/{session_id}", response_model=schemas.UploadSession)
+def read_upload_session(session_id: int, db: Session = Depends(get_db)):
+    """会话状态及各文件已接收的字节范围"""
+    return _open_upload_session(db, session_id)
+
+@router.put("/uploads/{session_id}/files/{file_id}", response_model=schemas.UploadSessionFile)
+async def upload_chunk(
+    session_id: int,
+    file_id: int,
+    request: Request,
+    offset: int = Query(..., ge=0, description="分块在文件中的起始位置"),
+    db: Session = Depends(get_db)
+):
+    """写入一个分块（请求体为原始字节）；offset 超出已接收位置时返回 409，Upload-Offset 头为应续传的位置"""
+    session = _open_upload_session(db, session_id)
+    if session.status != "open":
+        raise HTTPException(status_code=409, detail="上传会话已完成")
+    upload_file = crud.get_upload_session_file(db, session_id, file_id)
+    if upload_file is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    try:
+        await write_chunk(db, upload_file, offset, request.stream())
+    except UploadConflict as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Upload-Offset": str(e.received)})
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ClientDisconnect:
+        # 已写入的部分已记录，客户端查询会话后续传
+        pass
+    db.refresh(upload_file)
+    return upload_file
+
+@router.post("/uploads/{session_id}/finalize", response_model=schemas.Batch)
+async def finalize_upload_session(session_id: int, db: Session = Depends(get_db)):
+    """校验文件并创建批次任务（文件已在批次目录中，不再复制）"""
+    session = _open_upload_session(db, session_id)
+    try:
+        return await run_in_threadpool(finalize_upload, db, session)
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except AdmissionRejected as e:
+        raise e.to_http_exception()
+
+@router.delete("/uploads/{session_id}")
+def abort_upload_session(session_id: int, db: Session = Depends(get_db)):
+    """放弃未完成的上传：删除会话、批次及已接收的文件"""
+    session = _open_upload_session(db, session_id)
+    if session.status != "open":
+        raise HTTPException(status_code=409, detail="上传会话已完成")
+    delete_batches_with_files(db, [session.batch_id])
+    return {"message": "上传会话已删除"}
+
 @router.get("/original/{file_id}/content", response_class=PlainTextResponse)
 def get_original_file_content(file_id: int, db: Session = Depends(get_db)):
     file = db.query(models.OriginalFile).filter(models.OriginalFile.id == file_id).first()
@@ -38,4 +117,45 @@ def get_cleaned2_file_content(file_id: int, db: Session = Depends(get_db)):
     file = db.query(models.CleanedFile2).filter(models.CleanedFile2.id == file_id).first()
     if not file:
         raise HTTPException(status_code=404, detail="File not found")
-    return get_file_content(file.file_path)
\ No newline at end of file
+    if os.path.exists(file.file_path) and is_sections_file(file.file_path):
+        # 按区块存储的文件拼接为完整的 JSON 文档返回
+        return read_document_bytes(file.file_path).decode("utf-8")
+    return get_file_content(file.file_path)
+
+def _cleaned2_path(db: Session, file_id: int) -> str:
+    file = db.query(models.CleanedFile2).filter(models.CleanedFile2.id == file_id).first()
+    if not file or not os.path.exists(file.file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    return file.file_path
+
+@router.get("/cleaned2/{file_id}/sections")
+def get_cleaned2_sections(file_id: int, db: Session = Depends(get_db)):
+    """二次清洗结果中的区块及各区块 JSON 的字节数"""
+    path = _cleaned2_path(db, file_id)
+    return {"file_id": file_id, "indexed": is_sections_file(path), "sections": list_sections(path)}
+
+@router.get("/cleaned2/{file_id}/sections/{name}")
+def get_cleaned2_section(file_id: int, name: str, db: Session = Depends(get_db)):
+    """单个区块（如 interfaces、router_bgp）的解析结果，按索引只读取该区块的字节范围"""
+    data = read_section_bytes(_cleaned2_path(db, file_id), name)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Section not found")
+    return Response(content=data, media_type="application/json")
+
+@router.get("/cleaned1/{file_id}/drift")
+def get_cleaned1_drift(
+    file_id: int,
+    context: int = Query(3, ge=0, le=50, description="diff 上下文行数"),
+    db: Session = Depends(get_db)
+):
+    """与同一设备（主机名）上一批次配置相比的变化；previous 为空表示没有更早的快照"""
+    drift = get_config_drift(db, file_id, context=context)
+    if drift is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    return drift
+
+
+@router.get("/cache/stats")
+def get_file_cache_stats():
+    """文件内容 / 解析后文档缓存的占用与命中统计"""
+    return cache_stats()
@@ -0,0 +1,45 @@
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from ... import crud, schemas
+from ...database import get_db
+from ...models import FleetRollup
+
+router = APIRouter()
+
+DAY_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+
+
+@router.get("/rollups", response_model=List[schemas.FleetRollup])
+def read_fleet_rollups(
+    keyword_set_id: Optional[int] = None,
+    hostname: Optional[str] = None,
+    keyword: Optional[str] = None,
+    start: Optional[str] = Query(None, pattern=DAY_PATTERN, description="起始日期（含），YYYY-MM-DD"),
+    end: Optional[str] = Query(None, pattern=DAY_PATTERN, description="结束日期（含），YYYY-MM-DD"),
+    limit: int = Query(1000, ge=1, le=10000),
+    db: Session = Depends(get_db)
+):
+    """设备趋势：按天、关键词组、设备、关键词的命中数（按日期排序）"""
+    query = crud.query_fleet_rollups(db, keyword_set_id, hostname, keyword, start, end)
+    return query.order_by(FleetRollup.day, FleetRollup.hostname, FleetRollup.keyword).limit(limit).all()
+
+
+@router.get("/daily")
+def read_fleet_daily(
+    keyword_set_id: Optional[int] = None,
+    hostname: Optional[str] = None,
+    keyword: Optional[str] = None,
+    start: Optional[str] = Query(None, pattern=DAY_PATTERN),
+    end: Optional[str] = Query(None, pattern=DAY_PATTERN),
+    db: Session = Depends(get_db)
+):
+    """每天的命中总数及涉及的设备数（可按关键词组 / 设备 / 关键词过滤）"""
+    query = crud.query_fleet_rollups(db, keyword_set_id, hostname, keyword, start, end)
+    rows = query.with_entities(
+        FleetRollup.day,
+        func.sum(FleetRollup.hits),
+        func.count(func.distinct(FleetRollup.hostname)),
+    ).group_by(FleetRollup.day).order_by(FleetRollup.day).all()
+    return [{"day": day, "hits": hits, "devices": devices} for day, hits, devices in rows]
@@ -1,18 +1,103 @@
+import csv
+import io
 import json
-from fastapi import APIRouter, Depends, HTTPException
+import re
+from itertools import islice
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Form
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from ... import schemas, crud
-from ...database import get_db
-from ...services.keyword_service import perform_keyword_check
+from ...database import get_db, SessionLocal
+from ...services.admission_service import AdmissionRejected, admit_stage
+from ...services.cache_service import loads_json
+from ...services.keyword_service import (
+    perform_keyword_check,
+    perform_keyword_ranking,
+    perform_multi_keyword_check,
+    estimate_tokens,
+    iter_text_segments,
+    project_match_data,
+    render_match_data,
+    schedule_matcher_compile,
+)
+from ...services.summary_service import refresh_batch_summary
+from ...services.rule_service import (
+    RuleSyntaxError,
+    perform_rule_evaluation,
+    rule_set_references,
+    validate_rule_expression,
+)
 
 router = APIRouter()
 
+# 匹配结果视图：compact 为列式格式，legacy 展开为逐条命中的旧格式
+MATCH_VIEW_QUERY = Query("compact", pattern="^(compact|legacy)$", description="compact 列式格式 / legacy 旧格式")
+
 
 class KeywordCheckRequest(schemas.BaseModel):
     batch_id: int  # 批次ID
     keyword_set_id: int  # 关键词组ID
 
+def _keyword_set_response(db: Session, db_set) -> schemas.KeywordSet:
+    """关键词组响应：只附带前 KEYWORD_PREVIEW_LIMIT 个关键词，完整列表见 /sets/{set_id}/keywords"""
+    return schemas.KeywordSet(
+        id=db_set.id,
+        name=db_set.name,
+        description=db_set.description,
+        created_at=db_set.created_at,
+        version=db_set.version,
+        keyword_count=db_set.keyword_count or 0,
+        scopes=json.loads(db_set.scopes) if db_set.scopes else None,
+        keywords=crud.get_keyword_values(db, db_set.id, limit=crud.KEYWORD_PREVIEW_LIMIT),
+    )
+
+
+def _iter_uploaded_keywords(upload: UploadFile, fmt: str, column: int, header: bool, scope_column: int = None,
+                            severity_column: int = None):
+    """
+    逐行读取上传的关键词文件，不整体载入内存，产出 (关键词, 作用域, 严重程度)
+    - text: 每行一个关键词，# 开头为注释
+    - csv: 取第 column 列，header 为真时跳过首行；scope_column 列为该关键词的区块作用域（以 , ; | 分隔），
+      severity_column 列为严重程度（整数，为空按 0）
+    """
+    text = io.TextIOWrapper(upload.file, encoding="utf-8-sig", errors="replace", newline="")
+    try:
+        rows = csv.reader(text) if fmt == "csv" else ([line] for line in text)
+        for line_no, row in enumerate(rows, 1):
+            if fmt == "csv" and header and line_no == 1:
+                continue
+            if len(row) <= column:
+                continue
+            word = row[column].strip()
+            if not word or (fmt == "text" and word.startswith("#")):
+                continue
+            try:
+                schemas.check_keyword(word)
+            except ValueError as e:
+                raise ValueError(f"第 {line_no} 行: {e}")
+            scope = None
+            if fmt == "csv" and scope_column is not None and len(row) > scope_column:
+                scope = ",".join(part.strip() for part in re.split(r"[,;|]", row[scope_column]) if part.strip())
+            severity = 0
+            if fmt == "csv" and severity_column is not None and len(row) > severity_column and row[severity_column].strip():
+                try:
+                    severity = int(row[severity_column])
+                except ValueError:
+                    raise ValueError(f"第 {line_no} 行: 严重程度必须为整数: {row[severity_column]!r}")
+            yield word, scope, severity
+    finally:
+        text.detach()
+
+
+def _import_format(upload: UploadFile, fmt: str) -> str:
+    if fmt == "auto":
+        return "csv" if (upload.filename or "").lower().endswith(".csv") else "text"
+    return fmt
+
+
 @router.get("/sets/{set_id}", response_model=schemas.KeywordSet)
 def read_keyword_set(
     set_id: int,  # 路径参数：关键词组ID
@@ -22,10 +107,7 @@ def read_keyword_set(
     keyword_set = crud.get_keyword_set(db, set_id=set_id)
     if keyword_set is None:
         raise HTTPException(status_code=404, detail="关键词组不存在")
-
-    # 将数据库中存储的逗号分隔字符串转换为列表（匹配前端预期）
-    keyword_set.keywords = keyword_set.keywords.split(",")
-    return keyword_set
+    return _keyword_set_response(db, keyword_set)
 
 
 # 关键词组管理
@@ -34,7 +116,22 @@ def create_keyword_set(
     keyword_set: schemas.KeywordSetCreate,
     db: Session = Depends(get_db)
 ):
-    return crud.create_keyword_set(db=db, keyword_set=keyword_set)
+    db_set = crud.create_keyword_set(db=db, keyword_set=keyword_set)
+    schedule_matcher_compile(db_set.id, db_set.version)
+    return _keyword_set_response(db, db_set)
+
+@router.put("/sets/{set_id}", response_model=schemas.KeywordSet)
+def update_keyword_set(
+    set_id: int,
+    keyword_set: schemas.KeywordSetCreate,
+    db: Session = Depends(get_db)
+):
+    """更新关键词组（版本号递增，之后的匹配会重新扫描）"""
+    db_set = crud.update_keyword_set(db, set_id=set_id, keyword_set=keyword_set)
+    if db_set is None:
+        raise HTTPException(status_code=404, detail="关键词组不存在")
+    schedule_matcher_compile(db_set.id, db_set.version)
+    return _keyword_set_response(db, db_set)
 
 @router.get("/sets/", response_model=List[schemas.KeywordSet])
 def read_keyword_sets(
@@ -43,23 +140,92 @@ def read_keyword_sets(
     db: Session = Depends(get_db)
 ):
     sets = crud.get_keyword_sets(db, skip=skip, limit=limit)
-    # 转换逗号分隔的关键词为列表
-    for s in sets:
-        s.keywords = s.keywords.split(",")
-    return sets
+    return [_keyword_set_response(db, s) for s in sets]
+
+@router.get("/sets/{set_id}/keywords", response_model=schemas.KeywordPage)
+def read_keywords(
+    set_id: int,
+    cursor: Optional[int] = Query(None, description="上一页返回的 next_cursor"),
+    limit: int = Query(1000, ge=1, le=10000),
+    q: Optional[str] = Query(None, description="关键词包含该字符串"),
+    db: Session = Depends(get_db)
+):
+    """分页获取关键词组中的关键词"""
+    if crud.get_keyword_set(db, set_id=set_id) is None:
+        raise HTTPException(status_code=404, detail="关键词组不存在")
+    items = crud.get_keywords_page(db, set_id, cursor=cursor, limit=limit, q=q)
+    next_cursor = items[-1].position if len(items) >= limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+@router.post("/sets/import", response_model=schemas.KeywordImportResult)
+def import_keyword_set(
+    name: str = Form(...),
+    description: Optional[str] = Form(None),
+    scopes: Optional[str] = Form(None, description="关键词组的区块作用域，逗号分隔"),
+    file: UploadFile = File(...),
+    format: str = Query("auto", pattern="^(auto|text|csv)$"),
+    column: int = Query(0, ge=0, description="CSV 中关键词所在列"),
+    scope_column: Optional[int] = Query(None, ge=0, description="CSV 中关键词作用域所在列"),
+    severity_column: Optional[int] = Query(None, ge=0, description="CSV 中关键词严重程度所在列"),
+    header: bool = Query(False, description="CSV 首行为表头"),
+    db: Session = Depends(get_db)
+):
+    """从上传文件创建关键词组（文本每行一个，或 CSV 的某一列），逐行流式写入"""
+    db_set = crud.create_keyword_set(db, schemas.KeywordSetCreate(
+        name=name, description=description, keywords=[], scopes=scopes.split(",") if scopes else None))
+    try:
+        added, skipped = crud.import_keywords(
+            db, db_set, _iter_uploaded_keywords(file, _import_format(file, format), column, header,
+                                                scope_column, severity_column))
+    except ValueError as e:
+        crud.delete_keyword_set(db, db_set.id)
+        raise HTTPException(status_code=400, detail=str(e))
+    schedule_matcher_compile(db_set.id, db_set.version)
+    return {"keyword_set_id": db_set.id, "added": added, "skipped": skipped,
+            "keyword_count": db_set.keyword_count, "version": db_set.version}
+
+@router.post("/sets/{set_id}/import", response_model=schemas.KeywordImportResult)
+def import_keywords(
+    set_id: int,
+    file: UploadFile = File(...),
+    mode: str = Query("append", pattern="^(append|replace)$"),
+    format: str = Query("auto", pattern="^(auto|text|csv)$"),
+    column: int = Query(0, ge=0, description="CSV 中关键词所在列"),
+    scope_column: Optional[int] = Query(None, ge=0, description="CSV 中关键词作用域所在列"),
+    severity_column: Optional[int] = Query(None, ge=0, description="CSV 中关键词严重程度所在列"),
+    header: bool = Query(False, description="CSV 首行为表头"),
+    db: Session = Depends(get_db)
+):
+    """向已有关键词组追加（去重）或整体替换关键词，版本号递增"""
+    db_set = crud.get_keyword_set(db, set_id=set_id)
+    if db_set is None:
+        raise HTTPException(status_code=404, detail="关键词组不存在")
+    try:
+        added, skipped = crud.import_keywords(
+            db, db_set, _iter_uploaded_keywords(file, _import_format(file, format), column, header,
+                                                scope_column, severity_column),
+            replace=(mode == "replace"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    schedule_matcher_compile(db_set.id, db_set.version)
+    return {"keyword_set_id": db_set.id, "added": added, "skipped": skipped,
+            "keyword_count": db_set.keyword_count, "version": db_set.version}
 
 # 关键词匹配
 @router.post("/match/", response_model=List[schemas.KeywordMatchResult])
 def match_keywords(
     request: schemas.KeywordMatchRequest,
+    view: str = MATCH_VIEW_QUERY,
     db: Session = Depends(get_db)
 ):
     try:
-        results = perform_keyword_check(
-            db=db,
-            batch_id=request.batch_id,
-            keyword_set_id=request.keyword_set_id
-        )
+        with admit_stage(db, request.batch_id, "match", reject_when_full=True):
+            results = perform_keyword_check(
+                db=db,
+                batch_id=request.batch_id,
+                keyword_set_id=request.keyword_set_id
+            )
+        refresh_batch_summary(db, request.batch_id)
 
         # # 接口层最后一次校验：确保所有match_data都是字典
         # for res in results:
@@ -68,17 +234,91 @@ def match_keywords(
         #         res.match_data = json.loads(res.match_data)
         #     if not isinstance(res.match_data, dict):
         #         res.match_data = {"error": "接口层解析失败"}
-        for res in results:
-            if isinstance(res.match_data, str):
-                res.match_data = json.loads(res.match_data)
-        return results
+        return [_match_result_view(res, view) for res in results]
+    except AdmissionRejected as e:
+        raise e.to_http_exception()
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+# 多关键词组一次匹配
+@router.post("/match/multi", response_model=List[schemas.KeywordMatchResult])
+def match_keywords_multi(
+    request: schemas.MultiKeywordMatchRequest,
+    view: str = MATCH_VIEW_QUERY,
+    db: Session = Depends(get_db)
+):
+    try:
+        with admit_stage(db, request.batch_id, "match", reject_when_full=True):
+            results = perform_multi_keyword_check(
+                db=db,
+                batch_id=request.batch_id,
+                keyword_set_ids=request.keyword_set_ids
+            )
+        refresh_batch_summary(db, request.batch_id)
+        return [_match_result_view(res, view) for res in results]
+    except AdmissionRejected as e:
+        raise e.to_http_exception()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# 按严重程度匹配：每个文件 Top-K 或存在性检查，扫描量有上限，结果不落库
+@router.post("/match/top")
+def match_keywords_ranked(request: schemas.KeywordRankRequest, db: Session = Depends(get_db)):
+    try:
+        return perform_keyword_ranking(db, batch_id=request.batch_id, keyword_set_id=request.keyword_set_id,
+                                       mode=request.mode, k=request.k, min_severity=request.min_severity)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+# 关键词规则
+@router.post("/rules/", response_model=schemas.KeywordRule)
+def create_keyword_rule(rule: schemas.KeywordRuleCreate, db: Session = Depends(get_db)):
+    try:
+        validate_rule_expression(rule.expression)
+    except RuleSyntaxError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    for set_id in rule_set_references(rule.expression):
+        if crud.get_keyword_set(db, set_id) is None:
+            raise HTTPException(status_code=400, detail=f"规则引用的关键词组 {set_id} 不存在")
+    return crud.create_keyword_rule(db, rule)
+
+
+@router.get("/rules/", response_model=List[schemas.KeywordRule])
+def read_keyword_rules(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    return crud.get_keyword_rules(db, skip=skip, limit=limit)
+
+
+@router.get("/rules/{rule_id}", response_model=schemas.KeywordRule)
+def read_keyword_rule(rule_id: int, db: Session = Depends(get_db)):
+    db_rule = crud.get_keyword_rule(db, rule_id)
+    if db_rule is None:
+        raise HTTPException(status_code=404, detail="规则不存在")
+    return db_rule
+
+
+@router.delete("/rules/{rule_id}")
+def delete_keyword_rule(rule_id: int, db: Session = Depends(get_db)):
+    if crud.get_keyword_rule(db, rule_id) is None:
+        raise HTTPException(status_code=404, detail="规则不存在")
+    crud.delete_keyword_rule(db, rule_id)
+    return {"message": "规则已删除"}
+
+
+# 规则求值：每个文件一次扫描，返回各规则命中的区块（或行），结果不落库
+@router.post("/rules/evaluate")
+def evaluate_keyword_rules(request: schemas.RuleEvaluateRequest, db: Session = Depends(get_db)):
+    try:
+        return perform_rule_evaluation(db, batch_id=request.batch_id, rule_ids=request.rule_ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 # 获取批次的匹配结果
 @router.get("/match/batch/{batch_id}", response_model=List[schemas.KeywordMatchResult])
-def get_batch_matches(batch_id: int, db: Session = Depends(get_db)):
+def get_batch_matches(batch_id: int, view: str = MATCH_VIEW_QUERY, db: Session = Depends(get_db)):
     results = crud.get_match_results_by_batch(db, batch_id=batch_id)
 
     # 最后一次校验
@@ -88,11 +328,143 @@ def get_batch_matches(batch_id: int, db: Session = Depends(get_db)):
         if not isinstance(res.match_data, dict):
             res.match_data = {"error": "查询接口解析失败"}
 
-    return results
+    return [_match_result_view(res, view) for res in results]
+
+def _match_result_view(result, view: str, match_data=None):
+    """将 ORM 结果的 match_data 解析为字典并转换为请求的视图（只修改内存中的对象，不写回数据库）"""
+    if match_data is None:
+        match_data = result.match_data
+    if isinstance(match_data, str):
+        match_data = json.loads(match_data)
+    return schemas.KeywordMatchResult(
+        id=result.id, batch_id=result.batch_id, file_id=result.file_id, keyword_set_id=result.keyword_set_id,
+        filename=result.filename, file_path=result.file_path, created_at=result.created_at,
+        match_data=render_match_data(match_data, view) if isinstance(match_data, dict) else match_data,
+    )
+
+
+def _load_match_data(result):
+    """
+    单个匹配结果：以数据库中的 JSON 为准（解析结果按结果ID缓存）
+    不读取匹配结果文件：同一文件用不同关键词组匹配时结果文件会被覆盖
+    """
+    if not isinstance(result.match_data, str):
+        return result.match_data
+    return loads_json(f"match_result:{result.id}", result.match_data)
+
+
+def _iter_projected_results(db: Session, batch_id: int, filters: dict, keyword: Optional[str],
+                            section: Optional[str], fields: str, cursor: Optional[int], view: str = "compact"):
+    """逐行读取匹配结果并过滤/投影，不在内存中构建完整列表"""
+    query = crud.query_match_results(db, batch_id, cursor=cursor, keyword=keyword, **filters)
+    for row in query.yield_per(50):
+        try:
+            match_data = json.loads(row.match_data) if row.match_data else {}
+        except json.JSONDecodeError:
+            match_data = {"error": "JSON解析失败"}
+        projected = project_match_data(match_data, keyword=keyword, section=section, fields=fields)
+        if projected is None:
+            continue
+        if fields == "full":
+            projected = render_match_data(projected, view)
+        yield {
+            "id": row.id,
+            "batch_id": row.batch_id,
+            "file_id": row.file_id,
+            "keyword_set_id": row.keyword_set_id,
+            "filename": row.filename,
+            "file_path": row.file_path,
+            "created_at": row.created_at,
+            "match_data": projected,
+        }
+
+
+# 分页/过滤/投影查询批次匹配结果
+@router.get("/match/batch/{batch_id}/results", response_model=schemas.KeywordMatchResultPage)
+def get_batch_matches_page(
+    batch_id: int,
+    cursor: Optional[int] = Query(None, description="上一页返回的 next_cursor"),
+    limit: int = Query(50, ge=1, le=1000),
+    file_id: Optional[int] = None,
+    keyword_set_id: Optional[int] = None,
+    filename: Optional[str] = Query(None, description="文件名包含该字符串"),
+    vendor: Optional[str] = None,
+    keyword: Optional[str] = Query(None, description="只返回该关键词的命中"),
+    section: Optional[str] = Query(None, description="只返回名称以此开头的区块"),
+    fields: str = Query("full", pattern="^(full|counts)$"),
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    view: str = MATCH_VIEW_QUERY,
+    db: Session = Depends(get_db)
+):
+    filters = {"file_id": file_id, "keyword_set_id": keyword_set_id, "filename": filename, "vendor": vendor}
+
+    if format == "ndjson":
+        # 流式模式：逐条输出，最多 limit 条，最后一行为 {"next_cursor": ...}（没有下一页时为 null）；
+        # 使用独立会话，避免依赖注入的会话在响应发送前关闭
+        def stream():
+            stream_db = SessionLocal()
+            try:
+                count = 0
+                last_id = None
+                for item in _iter_projected_results(stream_db, batch_id, filters, keyword, section, fields, cursor, view):
+                    yield json.dumps(jsonable_encoder(item), ensure_ascii=False) + "\n"
+                    count += 1
+                    last_id = item["id"]
+                    if count >= limit:
+                        break
+                yield json.dumps({"next_cursor": last_id if count >= limit else None}) + "\n"
+            finally:
+                stream_db.close()
+
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+    items = []
+    for item in _iter_projected_results(db, batch_id, filters, keyword, section, fields, cursor, view):
+        items.append(item)
+        if len(items) >= limit:
+            break
+
+    next_cursor = items[-1]["id"] if len(items) >= limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
 
 @router.get("/match/match_id/{match_id}", response_model=schemas.KeywordMatchResult)
-def get_match_result(match_id: int, db: Session = Depends(get_db)):
+def get_match_result(match_id: int, view: str = MATCH_VIEW_QUERY, db: Session = Depends(get_db)):
     result = crud.get_match_result_by_id(db, match_id=match_id)
     if result is None:
         raise HTTPException(status_code=404, detail="匹配结果不存在")
-    return result
\ No newline at end of file
+    return _match_result_view(result, view, match_data=_load_match_data(result))
+
+
+# 分段读取单个文件的命中行（如按 LLM 上下文预算），只生成到第 index 段为止
+@router.get("/match/match_id/{match_id}/segments/{index}")
+def get_match_segment(
+    match_id: int,
+    index: int,
+    max_bytes: Optional[int] = Query(None, ge=256, description="每段字节上限，与 max_tokens 都未指定时为 50KB"),
+    max_tokens: Optional[int] = Query(None, ge=16, description="每段估算 token 上限"),
+    db: Session = Depends(get_db)
+):
+    if index < 0:
+        raise HTTPException(status_code=400, detail="分段序号不能为负数")
+    if not crud.match_result_exists(db, match_id):
+        raise HTTPException(status_code=404, detail="匹配结果不存在")
+
+    # 命中行由 SQLite 按行号排序后逐行读取，只生成到第 index + 1 段
+    lines = (content + "\n" for content in crud.iter_match_result_lines(db, match_id))
+    segments = iter_text_segments(lines, max_bytes=max_bytes, max_tokens=max_tokens)
+    try:
+        content = next(islice(segments, index, None), None)
+        has_more = content is not None and next(segments, None) is not None
+    except OperationalError:
+        raise HTTPException(status_code=400, detail="匹配结果解析失败")
+    if content is None:
+        raise HTTPException(status_code=404, detail=f"分段 {index} 不存在")
+    return {
+        "match_id": match_id,
+        "index": index,
+        "content": content,
+        "bytes": len(content.encode("utf-8")),
+        "tokens": estimate_tokens(content),
+        "has_more": has_more,
+    }
@@ -0,0 +1,367 @@
+"""
+ky-match 命令行入口
+
+无需启动 Web 服务和 SQLite，直接对目录树执行：
+初次清洗(clean_1) -> 二次清洗(clean_2) -> 关键词匹配，
+结果以 JSON Lines 流式写出（每个文件一行），支持中断后续跑。
+
+示例：
+    ky-match match /srv/oxidized/configs -k keywords.txt -o results.jsonl -j 8
+
+ky-match worker 启动批次任务工作进程：从数据库任务队列中领取上传批次并执行清洗和匹配，
+可与 API 进程（KY_MATCH_WORKER_MODE=external）分开部署，同一主机上可启动任意多个。
+
+ky-match gc 按保留策略清理过期批次（文件与数据库记录），并回收数据库空闲页。
+
+ky-match watch 扫描配置备份目录，把新增或变化的文件分批导入（不复制文件），由批次任务执行清洗和匹配。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+from .services.clean_1 import clean_config_lines
+from .services.clean_2 import parse_config_lines
+from .services.keyword_service import ConfigKeywordMatcher, LineMatchMemo
+from .services.parallel_service import (
+    PARALLEL_FILE_THRESHOLD,
+    parse_config_lines_parallel,
+    search_config_data_parallel,
+)
+
+DEFAULT_EXTENSIONS = (".cfg", ".conf", ".txt")
+
+# 工作进程内的全局状态（由 _init_worker 初始化，避免每个文件重复构建自动机）
+_ROOT = None
+_MATCHER = None
+_MEMO = None
+_INCLUDE_PARSED = False
+
+
+def load_keywords(keywords_file=None, keywords=None):
+    """读取关键词：文件中每行一个（# 开头为注释），可叠加命令行传入的关键词"""
+    result = []
+    if keywords_file:
+        with open(keywords_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                word = line.strip()
+                if word and not word.startswith('#'):
+                    result.append(word)
+    for word in keywords or []:
+        if word.strip():
+            result.append(word.strip())
+    return result
+
+
+def iter_config_files(root, extensions=DEFAULT_EXTENSIONS):
+    """按稳定顺序遍历目录树，返回相对路径；extensions 为空时不过滤扩展名"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for name in sorted(filenames):
+            if name.startswith('.'):
+                continue
+            if extensions and not name.endswith(tuple(extensions)):
+                continue
+            yield os.path.relpath(os.path.join(dirpath, name), root)
+
+
+def load_progress(output_path):
+    """
+    从已有的输出文件恢复进度，返回已完成的相对路径集合。
+    中断时可能残留半行，这里会把文件截断到最后一个完整行。
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+
+    valid_size = 0
+    with open(output_path, 'rb') as f:
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break
+            try:
+                done.add(json.loads(raw)["path"])
+            except (ValueError, KeyError):
+                break
+            valid_size += len(raw)
+
+    if valid_size != os.path.getsize(output_path):
+        with open(output_path, 'r+b') as f:
+            f.truncate(valid_size)
+    return done
+
+
+def _init_worker(root, keywords, include_parsed):
+    global _ROOT, _MATCHER, _MEMO, _INCLUDE_PARSED
+    _ROOT = root
+    _MATCHER = ConfigKeywordMatcher(keywords)
+    # 每个工作进程持有一份行级缓存，随处理的文件数增长而持续复用
+    _MEMO = LineMatchMemo(_MATCHER)
+    _INCLUDE_PARSED = include_parsed
+
+
+def _build_record(rel_path, parsed, match_result, include_parsed):
+    record = {
+        "path": rel_path,
+        "vendor": parsed["vendor"],
+        "hostname": parsed.get("hostname"),
+        "match_count": sum(len(m) for m in match_result["matches"].values()),
+        "matches": match_result["matches"],
+    }
+    if include_parsed:
+        record["cleaned_2"] = parsed
+    return json.dumps(record, ensure_ascii=False)
+
+
+def _process_path(rel_path):
+    """处理单个文件，返回一行 JSON（不含换行符）"""
+    try:
+        with open(os.path.join(_ROOT, rel_path), 'r', encoding='utf-8', errors='ignore') as f:
+            cleaned_lines = clean_config_lines(f, keep_bang_blocks=True)
+
+        parsed = parse_config_lines(cleaned_lines)
+        match_result = _MATCHER.search_config_data("".join(cleaned_lines), vendor=parsed["vendor"], memo=_MEMO)
+        return _build_record(rel_path, parsed, match_result, _INCLUDE_PARSED)
+    except Exception as e:
+        return json.dumps({"path": rel_path, "error": str(e)}, ensure_ascii=False)
+
+
+def _process_large_path(root, rel_path, matcher, include_parsed, workers):
+    """超大文件在主进程中处理，文件内部按区块并行解析和匹配"""
+    try:
+        with open(os.path.join(root, rel_path), 'r', encoding='utf-8', errors='ignore') as f:
+            cleaned_lines = clean_config_lines(f, keep_bang_blocks=True)
+
+        parsed = parse_config_lines_parallel(cleaned_lines, workers=workers)
+        match_result = search_config_data_parallel(matcher, "".join(cleaned_lines), vendor=parsed["vendor"],
+                                                   workers=workers)
+        return _build_record(rel_path, parsed, match_result, include_parsed)
+    except Exception as e:
+        return json.dumps({"path": rel_path, "error": str(e)}, ensure_ascii=False)
+
+
+def run_match(root, keywords, output_path, workers=1, extensions=DEFAULT_EXTENSIONS,
+              include_parsed=False, resume=True, progress_every=500, large_file_bytes=PARALLEL_FILE_THRESHOLD):
+    """
+    对目录树执行清洗+匹配，返回本次处理的文件数
+    超过 large_file_bytes 的文件不进入按文件并行的进程池，而是在最后逐个做文件内并行
+    """
+    root = os.path.abspath(root)
+    if resume:
+        done = load_progress(output_path)
+    else:
+        done = set()
+        open(output_path, 'w').close()
+
+    large_files = []
+
+    def pending_files():
+        for rel_path in iter_config_files(root, extensions):
+            if rel_path in done:
+                continue
+            if workers > 1 and os.path.getsize(os.path.join(root, rel_path)) >= large_file_bytes:
+                large_files.append(rel_path)
+                continue
+            yield rel_path
+
+    pending = pending_files()
+    if done:
+        print(f"resume: skip {len(done)} finished files", file=sys.stderr)
+
+    processed = 0
+    started = time.monotonic()
+    # 行缓冲：每写完一行即落盘，中断后最多重算正在处理的文件
+    with open(output_path, 'a', encoding='utf-8', buffering=1) as out:
+        if workers <= 1:
+            _init_worker(root, keywords, include_parsed)
+            results = map(_process_path, pending)
+            pool = None
+        else:
+            pool = Pool(processes=workers, initializer=_init_worker,
+                        initargs=(root, keywords, include_parsed))
+            results = pool.imap_unordered(_process_path, pending, chunksize=8)
+        try:
+            for line in results:
+                out.write(line + "\n")
+                processed += 1
+                if progress_every and processed % progress_every == 0:
+                    rate = processed / max(time.monotonic() - started, 1e-6)
+                    print(f"processed {processed} files ({rate:.1f}/s)", file=sys.stderr)
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
+        if large_files:
+            matcher = ConfigKeywordMatcher(keywords)
+            for rel_path in large_files:
+                print(f"large file, parallel within file: {rel_path}", file=sys.stderr)
+                out.write(_process_large_path(root, rel_path, matcher, include_parsed, workers) + "\n")
+                processed += 1
+
+    print(f"done: {processed} files -> {output_path}", file=sys.stderr)
+    return processed
+
+
+def _cmd_match(args):
+    keywords = load_keywords(args.keywords_file, args.keyword)
+    if not keywords:
+        print("error: no keywords given (use -k FILE or --keyword WORD)", file=sys.stderr)
+        return 2
+    if not os.path.isdir(args.root):
+        print(f"error: not a directory: {args.root}", file=sys.stderr)
+        return 2
+
+    extensions = () if args.all_files else tuple(args.ext or DEFAULT_EXTENSIONS)
+    run_match(
+        args.root,
+        keywords,
+        args.output,
+        workers=args.workers,
+        extensions=extensions,
+        include_parsed=args.include_parsed,
+        resume=not args.no_resume,
+        large_file_bytes=int(args.split_large * 1024 * 1024),
+    )
+    return 0
+
+
+def _cmd_worker(args):
+    # 延迟导入：match 子命令不依赖数据库
+    from .database import Base, engine, ensure_columns
+    from .services.task_service import run_worker
+
+    Base.metadata.create_all(bind=engine)
+    ensure_columns(engine)
+    try:
+        processed = run_worker(owner=args.id, poll_interval=args.poll, once=args.once)
+    except KeyboardInterrupt:
+        # 正在执行的任务不再续约，租约到期后由其他工作进程从最后完成的阶段继续
+        return 130
+    print(f"worker exit: {processed} tasks", file=sys.stderr)
+    return 0
+
+
+def _cmd_gc(args):
+    from .database import Base, engine, ensure_columns
+    from .services.retention_service import run_gc
+
+    Base.metadata.create_all(bind=engine)
+    ensure_columns(engine)
+    stats = run_gc(keep_per_device=args.keep_per_device, keep_days=args.keep_days, dry_run=args.dry_run,
+                   vacuum=not args.no_vacuum, full_vacuum=args.full_vacuum)
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+    return 0
+
+
+def _cmd_watch(args):
+    from .database import Base, engine, ensure_columns
+    from .services.task_service import run_worker
+    from .services.watch_service import WATCH_DIRS, WATCH_INTERVAL, run_watch_scan
+
+    roots = args.dirs or WATCH_DIRS
+    if not roots:
+        print("error: no directories given (pass DIR or set KY_WATCH_DIRS)", file=sys.stderr)
+        return 2
+    Base.metadata.create_all(bind=engine)
+    ensure_columns(engine)
+    extensions = () if args.all_files else (tuple(args.ext) if args.ext else None)
+    interval = args.interval or WATCH_INTERVAL or 300
+    try:
+        while True:
+            for stats in run_watch_scan(roots, keyword_set_id=args.keyword_set_id, extensions=extensions,
+                                        batch_files=args.batch_files):
+                print(json.dumps(stats, ensure_ascii=False), file=sys.stderr)
+            if args.process:
+                # 在当前进程中执行已入队的任务（未单独部署 ky-match worker 时）
+                run_worker(once=True)
+            if args.once:
+                return 0
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        return 130
+
+
+def _cmd_summarize(args):
+    from .database import Base, SessionLocal, engine, ensure_columns
+    from .services.summary_service import materialize_batch_summary
+    from . import crud
+
+    Base.metadata.create_all(bind=engine)
+    ensure_columns(engine)
+    db = SessionLocal()
+    try:
+        batch_ids = args.batch_id or [batch.id for batch in crud.get_batches(db, limit=None)]
+        done = 0
+        for batch_id in batch_ids:
+            if not args.all and not args.batch_id and crud.get_batch_summary(db, batch_id) is not None:
+                continue
+            if materialize_batch_summary(db, batch_id) is not None:
+                done += 1
+    finally:
+        db.close()
+    print(f"summarized {done} batches", file=sys.stderr)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="ky-match", description="配置文件清洗与关键词匹配")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_match = sub.add_parser("match", help="对目录树执行清洗+关键词匹配，输出 JSON Lines")
+    p_match.add_argument("root", help="配置文件根目录")
+    p_match.add_argument("-o", "--output", default="ky-match-results.jsonl", help="输出文件（JSON Lines）")
+    p_match.add_argument("-k", "--keywords-file", help="关键词文件，每行一个")
+    p_match.add_argument("--keyword", action="append", help="额外关键词，可重复")
+    p_match.add_argument("-j", "--workers", type=int, default=os.cpu_count() or 1, help="工作进程数")
+    p_match.add_argument("--ext", action="append", help=f"文件扩展名过滤，可重复（默认 {' '.join(DEFAULT_EXTENSIONS)}）")
+    p_match.add_argument("--all-files", action="store_true", help="不按扩展名过滤（如 Oxidized 无扩展名文件）")
+    p_match.add_argument("--include-parsed", action="store_true", help="输出中包含二次清洗结果")
+    p_match.add_argument("--no-resume", action="store_true", help="忽略已有输出，从头开始")
+    p_match.add_argument("--split-large", type=float, default=PARALLEL_FILE_THRESHOLD / 1024 / 1024, metavar="MB",
+                         help="超过该大小的文件在文件内部按区块并行处理")
+    p_match.set_defaults(func=_cmd_match)
+
+    p_worker = sub.add_parser("worker", help="批次任务工作进程：领取数据库队列中的上传批次并执行")
+    p_worker.add_argument("--id", help="工作者标识（默认 主机名:进程号:随机后缀）")
+    p_worker.add_argument("--poll", type=float, default=2.0, metavar="SECONDS", help="队列为空时的轮询间隔")
+    p_worker.add_argument("--once", action="store_true", help="处理完当前可领取的任务后退出")
+    p_worker.set_defaults(func=_cmd_worker)
+
+    p_gc = sub.add_parser("gc", help="按保留策略清理过期批次并回收数据库空间")
+    p_gc.add_argument("--keep-per-device", type=int, metavar="N", help="每台设备保留的最近批次数（默认 KY_RETAIN_PER_DEVICE）")
+    p_gc.add_argument("--keep-days", type=int, metavar="D", help="保留最近 D 天内的批次（默认 KY_RETAIN_DAYS）")
+    p_gc.add_argument("--dry-run", action="store_true", help="只列出将要删除的批次")
+    p_gc.add_argument("--no-vacuum", action="store_true", help="不回收数据库空闲页")
+    p_gc.add_argument("--full-vacuum", action="store_true",
+                      help="转换为增量回收模式并执行一次完整 VACUUM（需独占数据库）")
+    p_gc.set_defaults(func=_cmd_gc)
+
+    p_watch = sub.add_parser("watch", help="监视配置备份目录，导入新增或变化的文件")
+    p_watch.add_argument("dirs", nargs="*", metavar="DIR", help="监视的目录（默认 KY_WATCH_DIRS）")
+    p_watch.add_argument("--interval", type=int, metavar="SECONDS", help="扫描间隔（默认 KY_WATCH_INTERVAL，未设置时 300）")
+    p_watch.add_argument("--once", action="store_true", help="扫描一次后退出")
+    p_watch.add_argument("--keyword-set-id", type=int, help="导入后执行匹配的关键词组（默认 KY_WATCH_KEYWORD_SET_ID）")
+    p_watch.add_argument("--batch-files", type=int, metavar="N", help="每个批次最多包含的文件数")
+    p_watch.add_argument("--ext", action="append", help="文件扩展名过滤，可重复（默认 KY_WATCH_EXTENSIONS）")
+    p_watch.add_argument("--all-files", action="store_true", help="不按扩展名过滤")
+    p_watch.add_argument("--process", action="store_true", help="在当前进程中执行导入的批次任务")
+    p_watch.set_defaults(func=_cmd_watch)
+
+    p_summarize = sub.add_parser("summarize", help="补算批次统计和设备趋势（默认只处理尚未统计的批次）")
+    p_summarize.add_argument("batch_id", type=int, nargs="*", help="只重新统计这些批次")
+    p_summarize.add_argument("--all", action="store_true", help="重新统计全部批次")
+    p_summarize.set_defaults(func=_cmd_summarize)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,7 @@
 import json
+from datetime import timedelta
+from sqlalchemy import and_, func, insert, or_, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import Session
 from . import models, schemas
 from datetime import datetime
@@ -37,6 +40,12 @@ def create_cleaned_file_2(db: Session, file: schemas.CleanedFile2Create):
     db.refresh(db_file)
     return db_file
 
+def get_cleaned_file_1_by_original(db: Session, original_file_id: int):
+    return db.query(models.CleanedFile1).filter(models.CleanedFile1.original_file_id == original_file_id).first()
+
+def get_cleaned_file_2_by_cleaned_file_1(db: Session, cleaned_file_1_id: int):
+    return db.query(models.CleanedFile2).filter(models.CleanedFile2.cleaned_file_1_id == cleaned_file_1_id).first()
+
 def get_original_files_by_batch(db: Session, batch_id: int):
     return db.query(models.OriginalFile).filter(models.OriginalFile.batch_id == batch_id).all()
 
@@ -46,33 +55,231 @@ def get_cleaned_files_1_by_batch(db: Session, batch_id: int):
 def get_cleaned_files_2_by_batch(db: Session, batch_id: int):
     return db.query(models.CleanedFile2).filter(models.CleanedFile2.batch_id == batch_id).all()
 
+def get_batch_file_paths(db: Session, batch_id: int):
+    """批次各阶段文件的路径：[(阶段, 路径)]，阶段为 original / cleaned_1 / cleaned_2 / match（不加载匹配结果内容）"""
+    stages = (
+        ("original", models.OriginalFile),
+        ("cleaned_1", models.CleanedFile1),
+        ("cleaned_2", models.CleanedFile2),
+        ("match", models.KeywordMatchResult),
+    )
+    paths = []
+    for stage, model in stages:
+        rows = db.query(model.file_path).filter(model.batch_id == batch_id).order_by(model.id).all()
+        paths.extend((stage, row.file_path) for row in rows if row.file_path)
+    return paths
+
 
 # 关键词组操作
+# 关键词组详情/列表中附带的关键词数量上限，完整列表通过分页接口获取
+KEYWORD_PREVIEW_LIMIT = 1000
+# 批量写入关键词时每批的行数
+KEYWORD_INSERT_BATCH = 5000
+
+def _insert_keywords(db: Session, set_id: int, values, start_position: int = 0, seen: set = None):
+    """
+    按批写入关键词（跳过空值和重复值），返回 (写入数, 跳过数)
+    values 可以是任意可迭代对象，不需要一次性放入内存
+    """
+    seen = set() if seen is None else seen
+    position = start_position
+    added = skipped = 0
+    rows = []
+    for item in values:
+        # 元素为关键词，或 (关键词, 作用域[, 严重程度]) 元组
+        value, scope, severity = (item + (0,))[:3] if isinstance(item, tuple) else (item, None, 0)
+        value = value.strip()
+        if not value or value in seen:
+            skipped += 1
+            continue
+        seen.add(value)
+        rows.append({"keyword_set_id": set_id, "position": position, "value": value, "scope": scope or None,
+                     "severity": severity or 0})
+        position += 1
+        if len(rows) >= KEYWORD_INSERT_BATCH:
+            db.execute(insert(models.Keyword), rows)
+            added += len(rows)
+            rows = []
+    if rows:
+        db.execute(insert(models.Keyword), rows)
+        added += len(rows)
+    return added, skipped
+
+def _keyword_entries(keyword_set: schemas.KeywordSetCreate):
+    """关键词及其作用域（逗号分隔存储）、严重程度"""
+    keyword_scopes = keyword_set.keyword_scopes or {}
+    severities = keyword_set.keyword_severities or {}
+    for word in keyword_set.keywords:
+        scopes = [scope.strip() for scope in keyword_scopes.get(word, []) if scope.strip()]
+        yield word, ",".join(scopes), severities.get(word, 0)
+
+def _dump_scopes(scopes):
+    scopes = [scope.strip() for scope in scopes or [] if scope.strip()]
+    return json.dumps(scopes, ensure_ascii=False) if scopes else None
+
 def create_keyword_set(db: Session, keyword_set: schemas.KeywordSetCreate):
-    # 将关键词列表转换为逗号分隔的字符串存储
-    keywords_str = ",".join(keyword_set.keywords)
     db_set = models.KeywordSet(
         name=keyword_set.name,
         description=keyword_set.description,
-        keywords=keywords_str
+        scopes=_dump_scopes(keyword_set.scopes),
+        keyword_count=0
     )
     db.add(db_set)
+    db.flush()
+    db_set.keyword_count, _ = _insert_keywords(db, db_set.id, _keyword_entries(keyword_set))
+    db.commit()
+    db.refresh(db_set)
+    return db_set
+
+def migrate_legacy_keywords(db: Session, db_set: models.KeywordSet):
+    """旧版关键词组（逗号分隔字符串）在首次读取时迁移到 keywords 表"""
+    if db_set is None or not db_set.keywords:
+        return db_set
+    db.query(models.Keyword).filter(models.Keyword.keyword_set_id == db_set.id).delete()
+    db_set.keyword_count, _ = _insert_keywords(db, db_set.id, db_set.keywords.split(","))
+    db_set.keywords = None
     db.commit()
     db.refresh(db_set)
     return db_set
 
 def get_keyword_sets(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.KeywordSet).offset(skip).limit(limit).all()
+    sets = db.query(models.KeywordSet).offset(skip).limit(limit).all()
+    return [migrate_legacy_keywords(db, s) for s in sets]
 
 def get_keyword_set(db: Session, set_id: int):
     """根据ID查询关键词组"""
-    return db.query(models.KeywordSet).filter(models.KeywordSet.id == set_id).first()
+    return migrate_legacy_keywords(db, db.query(models.KeywordSet).filter(models.KeywordSet.id == set_id).first())
+
+def update_keyword_set(db: Session, set_id: int, keyword_set: schemas.KeywordSetCreate):
+    """更新关键词组，版本号递增（使已缓存的匹配结果失效）"""
+    db_set = get_keyword_set(db, set_id)
+    if not db_set:
+        return None
+    db_set.name = keyword_set.name
+    db_set.description = keyword_set.description
+    db_set.scopes = _dump_scopes(keyword_set.scopes)
+    db.query(models.Keyword).filter(models.Keyword.keyword_set_id == set_id).delete()
+    db_set.keyword_count, _ = _insert_keywords(db, set_id, _keyword_entries(keyword_set))
+    db_set.version = (db_set.version or 1) + 1
+    db.commit()
+    db.refresh(db_set)
+    return db_set
 
+def delete_keyword_set(db: Session, set_id: int):
+    db.query(models.Keyword).filter(models.Keyword.keyword_set_id == set_id).delete()
+    db.query(models.KeywordSet).filter(models.KeywordSet.id == set_id).delete()
+    db.commit()
+
+def import_keywords(db: Session, db_set: models.KeywordSet, values, replace: bool = False):
+    """
+    流式导入关键词：append 模式下与已有关键词去重并追加到末尾，replace 模式下整体替换
+    整个导入在一个事务中完成，出错时回滚；返回 (写入数, 跳过数)
+    """
+    try:
+        seen, start = set(), 0
+        if replace:
+            db.query(models.Keyword).filter(models.Keyword.keyword_set_id == db_set.id).delete()
+        else:
+            seen = set(iter_keyword_values(db, db_set.id))
+            last_position = db.query(func.max(models.Keyword.position)).filter(
+                models.Keyword.keyword_set_id == db_set.id).scalar()
+            if last_position is not None:
+                start = last_position + 1
+        added, skipped = _insert_keywords(db, db_set.id, values, start_position=start, seen=seen)
+        db_set.keyword_count = len(seen)
+        db_set.version = (db_set.version or 1) + 1
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    db.refresh(db_set)
+    return added, skipped
+
+def iter_keyword_values(db: Session, set_id: int, batch_size: int = 10000):
+    """按顺序逐批读取关键词组的全部关键词"""
+    query = db.query(models.Keyword.value).filter(
+        models.Keyword.keyword_set_id == set_id
+    ).order_by(models.Keyword.position).execution_options(yield_per=batch_size)
+    for (value,) in query:
+        yield value
+
+def iter_keyword_entries(db: Session, set_id: int, batch_size: int = 10000):
+    """按顺序逐批读取关键词组的全部 (关键词, 作用域)"""
+    query = db.query(models.Keyword.value, models.Keyword.scope).filter(
+        models.Keyword.keyword_set_id == set_id
+    ).order_by(models.Keyword.position).execution_options(yield_per=batch_size)
+    for value, scope in query:
+        yield value, scope
+
+def get_keyword_severities(db: Session, set_id: int):
+    """关键词组中严重程度非 0 的关键词：关键词 -> 严重程度"""
+    return dict(db.query(models.Keyword.value, models.Keyword.severity).filter(
+        models.Keyword.keyword_set_id == set_id,
+        models.Keyword.severity != 0
+    ))
+
+def keyword_set_is_scoped(db: Session, db_set: models.KeywordSet) -> bool:
+    """关键词组或其中任一关键词设置了区块作用域"""
+    if db_set.scopes:
+        return True
+    return db.query(models.Keyword.id).filter(
+        models.Keyword.keyword_set_id == db_set.id,
+        models.Keyword.scope.isnot(None)
+    ).first() is not None
+
+def get_keyword_values(db: Session, set_id: int, limit: int = None):
+    query = db.query(models.Keyword.value).filter(
+        models.Keyword.keyword_set_id == set_id
+    ).order_by(models.Keyword.position)
+    if limit is not None:
+        query = query.limit(limit)
+    return [value for (value,) in query]
+
+def get_keywords_page(db: Session, set_id: int, cursor: int = None, limit: int = 1000, q: str = None):
+    """按 position 游标分页查询关键词，q 为子串过滤"""
+    query = db.query(models.Keyword).filter(models.Keyword.keyword_set_id == set_id)
+    if cursor is not None:
+        query = query.filter(models.Keyword.position > cursor)
+    if q:
+        query = query.filter(models.Keyword.value.contains(q, autoescape=True))
+    return query.order_by(models.Keyword.position).limit(limit).all()
+
+
+def create_keyword_rule(db: Session, rule: schemas.KeywordRuleCreate):
+    sections = [scope.strip() for scope in rule.sections or [] if scope.strip()]
+    db_rule = models.KeywordRule(
+        name=rule.name,
+        description=rule.description,
+        expression=rule.expression,
+        level=rule.level,
+        sections=",".join(sections) or None
+    )
+    db.add(db_rule)
+    db.commit()
+    db.refresh(db_rule)
+    return db_rule
+
+def get_keyword_rules(db: Session, skip: int = 0, limit: int = 100):
+    query = db.query(models.KeywordRule).order_by(models.KeywordRule.id).offset(skip)
+    return query.limit(limit).all() if limit else query.all()
+
+def get_keyword_rule(db: Session, rule_id: int):
+    return db.query(models.KeywordRule).filter(models.KeywordRule.id == rule_id).first()
+
+def get_keyword_rules_by_ids(db: Session, rule_ids):
+    return db.query(models.KeywordRule).filter(
+        models.KeywordRule.id.in_(rule_ids)
+    ).order_by(models.KeywordRule.id).all()
+
+def delete_keyword_rule(db: Session, rule_id: int):
+    db.query(models.KeywordRule).filter(models.KeywordRule.id == rule_id).delete()
+    db.commit()
 
 def update_keyword_match_result(
     db: Session,
     result_id: int,
-    new_match_data: dict  # 传入的新匹配数据（字典）
+    new_match_data: dict,  # 传入的新匹配数据（字典）
+    cache_key: str = None
 ):
     """更新关键词匹配结果（确保match_data序列化为JSON字符串）"""
     db_result = db.query(models.KeywordMatchResult).filter(
@@ -85,6 +292,8 @@ def update_keyword_match_result(
     try:
         # 关键修复：将字典转换为JSON字符串后再更新
         db_result.match_data = json.dumps(new_match_data, ensure_ascii=False)
+        if cache_key is not None:
+            db_result.cache_key = cache_key
         db.commit()  # 提交更新
         db.refresh(db_result)
 
@@ -129,7 +338,8 @@ def create_keyword_match_result(db: Session, result: schemas.KeywordMatchResultC
             filename=result.filename,
             file_path=result.file_path,
             keyword_set_id=result.keyword_set_id,
-            match_data=match_data_str  # 数据库字段为字符串类型
+            match_data=match_data_str,  # 数据库字段为字符串类型
+            cache_key=result.cache_key
         )
         db.add(db_result)
         db.commit()
@@ -171,17 +381,495 @@ def get_match_results_by_batch(db: Session, batch_id: int):
 
     return results
 
+def query_match_results(
+    db: Session,
+    batch_id: int,
+    cursor: int = None,
+    file_id: int = None,
+    keyword_set_id: int = None,
+    filename: str = None,
+    vendor: str = None,
+    keyword: str = None,
+):
+    """
+    构建批次匹配结果的查询（按ID倒序，游标为上一页最后一条的ID）
+    keyword 仅做SQL层预过滤（JSON文本包含该字符串），精确过滤由调用方完成
+    """
+    model = models.KeywordMatchResult
+    query = db.query(model).filter(model.batch_id == batch_id)
+    if cursor is not None:
+        query = query.filter(model.id < cursor)
+    if file_id is not None:
+        query = query.filter(model.file_id == file_id)
+    if keyword_set_id is not None:
+        query = query.filter(model.keyword_set_id == keyword_set_id)
+    if filename:
+        query = query.filter(model.filename.contains(filename, autoescape=True))
+    if vendor:
+        query = query.filter(func.json_extract(model.match_data, "$.vendor") == vendor)
+    if keyword:
+        # match_data 以 ensure_ascii=False 序列化；同时匹配转义形式，兼容以默认参数写入的记录
+        needles = {json.dumps(keyword, ensure_ascii=False), json.dumps(keyword)}
+        query = query.filter(or_(*(model.match_data.contains(needle, autoescape=True) for needle in needles)))
+    return query.order_by(model.id.desc())
+
+# 匹配结果中的命中行按行号排序（JSON 由 SQLite 解析，Python 侧逐行读取，不加载整个 match_data）
+_COLUMNAR_MATCH_LINES_SQL = text("""
+    WITH r AS (SELECT match_data FROM keyword_match_results WHERE id = :id),
+    l AS (SELECT j.key, SUM(j.value) OVER (ORDER BY j.key) AS line FROM r, json_each(r.match_data, '$.line') AS j),
+    c AS (SELECT j.key, j.value FROM r, json_each(r.match_data, '$.content') AS j)
+    SELECT l.line, c.value FROM l JOIN c ON c.key = l.key ORDER BY l.line, l.key
+""")
+_LEGACY_MATCH_LINES_SQL = text("""
+    SELECT json_extract(m.value, '$.line') AS line, json_extract(m.value, '$.content') AS content
+    FROM keyword_match_results AS r, json_each(r.match_data, '$.matches') AS s, json_each(s.value) AS m
+    WHERE r.id = :id AND json_type(m.value, '$.keyword') IS NOT NULL
+      AND line IS NOT NULL AND content IS NOT NULL
+    ORDER BY line, s.id, m.id
+""")
+
+def iter_match_result_lines(db: Session, result_id: int, batch_size: int = 1000):
+    """
+    按行号顺序逐行产出匹配结果中命中行的内容（同一行只产出一次，两种存储格式均可）
+    :raises sqlalchemy.exc.OperationalError: match_data 不是合法的 JSON
+    """
+    fmt = db.query(func.json_extract(models.KeywordMatchResult.match_data, "$.format")).filter(
+        models.KeywordMatchResult.id == result_id
+    ).scalar()
+    sql = _COLUMNAR_MATCH_LINES_SQL if fmt == "columnar" else _LEGACY_MATCH_LINES_SQL
+    rows = db.execute(sql, {"id": result_id}, execution_options={"yield_per": batch_size})
+    last_line = None
+    for line, content in rows:
+        if line != last_line:
+            last_line = line
+            yield content
+
+def get_latest_match_result(db: Session, batch_id: int, file_id: int, keyword_set_id: int):
+    """查询某文件在某关键词组下最新的匹配结果"""
+    return db.query(models.KeywordMatchResult).filter(
+        models.KeywordMatchResult.batch_id == batch_id,
+        models.KeywordMatchResult.file_id == file_id,
+        models.KeywordMatchResult.keyword_set_id == keyword_set_id
+    ).order_by(models.KeywordMatchResult.id.desc()).first()
+
+def get_match_result_by_cache_key(db: Session, cache_key: str):
+    """按缓存键查询任意批次中已有的匹配结果"""
+    return db.query(models.KeywordMatchResult).filter(
+        models.KeywordMatchResult.cache_key == cache_key
+    ).order_by(models.KeywordMatchResult.id.desc()).first()
+
 def get_cleaned_file_2(db: Session, file_id: int):
     return db.query(models.CleanedFile2).filter(models.CleanedFile2.id == file_id).first()
 
+def save_device_snapshot(db: Session, snapshot: schemas.DeviceSnapshotCreate):
+    """保存设备快照：同一初次清洗文件重复处理时原地更新"""
+    db_snapshot = get_snapshot_by_cleaned_file_1(db, snapshot.cleaned_file_1_id)
+    if db_snapshot is None:
+        db_snapshot = models.DeviceSnapshot(**snapshot.dict())
+        db.add(db_snapshot)
+    else:
+        for key, value in snapshot.dict().items():
+            setattr(db_snapshot, key, value)
+    db.commit()
+    db.refresh(db_snapshot)
+    return db_snapshot
+
+def get_snapshot_by_cleaned_file_1(db: Session, cleaned_file_1_id: int):
+    return db.query(models.DeviceSnapshot).filter(
+        models.DeviceSnapshot.cleaned_file_1_id == cleaned_file_1_id
+    ).order_by(models.DeviceSnapshot.id.desc()).first()
+
+def get_previous_snapshot(db: Session, hostname: str, batch_id: int):
+    """查询同一设备（主机名）在更早批次中的最新快照"""
+    return db.query(models.DeviceSnapshot).filter(
+        models.DeviceSnapshot.hostname == hostname,
+        models.DeviceSnapshot.batch_id < batch_id
+    ).order_by(models.DeviceSnapshot.batch_id.desc(), models.DeviceSnapshot.id.desc()).first()
+
 def update_batch_status(db: Session, batch_id: int, status: str):
     """更新批次状态"""
     db.query(models.Batch).filter(models.Batch.id == batch_id).update({"status": status})
     db.commit()
 
 
+def set_batch_pinned(db: Session, batch_id: int, pinned: bool):
+    db.query(models.Batch).filter(models.Batch.id == batch_id).update({"pinned": 1 if pinned else 0})
+    db.commit()
+    return get_batch(db, batch_id)
+
+
+# 保留策略 / 清理
+# 删除批次时按此顺序删除关联记录（被引用的表在后）
+BATCH_CHILD_MODELS = (
+    models.UploadSessionFile,
+    models.UploadSession,
+    models.BatchSummary,
+    models.KeywordMatchResult,
+    models.DeviceSnapshot,
+    models.CleanedFile2,
+    models.CleanedFile1,
+    models.OriginalFile,
+    models.BatchTask,
+)
+
+def get_device_batch_ids(db: Session):
+    """[(主机名, 批次ID)]，按主机名分组、批次从新到旧"""
+    return db.query(models.DeviceSnapshot.hostname, models.DeviceSnapshot.batch_id).filter(
+        models.DeviceSnapshot.hostname.isnot(None)
+    ).distinct().order_by(models.DeviceSnapshot.hostname, models.DeviceSnapshot.batch_id.desc()).all()
+
+def get_gc_candidate_batches(db: Session, created_before: datetime = None):
+    """
+    可被保留策略清理的批次 [(ID, 创建时间)]：未固定、没有待执行或执行中的任务、不在上传中
+    （处理中的批次都有任务；没有任务仍为 processing 的是任务队列之前中断的批次，同样按策略清理）
+    :param created_before: 只返回早于该时间的批次（为空表示不限）
+    """
+    active_tasks = db.query(models.BatchTask.batch_id).filter(models.BatchTask.status.in_(("pending", "running")))
+    # 上传中的批次由上传会话的过期规则清理（见 get_expired_upload_batch_ids）
+    open_uploads = db.query(models.UploadSession.batch_id).filter(models.UploadSession.status == "open")
+    query = db.query(models.Batch.id, models.Batch.timestamp).filter(
+        or_(models.Batch.pinned.is_(None), models.Batch.pinned == 0),
+        models.Batch.id.notin_(active_tasks),
+        models.Batch.id.notin_(open_uploads),
+    )
+    if created_before is not None:
+        query = query.filter(models.Batch.timestamp < created_before)
+    return query.order_by(models.Batch.id).all()
+
+def delete_batches(db: Session, batch_ids) -> dict:
+    """在一个事务中删除批次及其关联记录，返回各表删除的行数"""
+    deleted = {}
+    # 先从设备趋势统计中扣除这些批次的贡献（与删除在同一事务中）
+    for summary in db.query(models.BatchSummary).filter(models.BatchSummary.batch_id.in_(batch_ids)):
+        _apply_rollup(db, summary.day, json.loads(summary.rollup or "[]"), -1)
+    _delete_empty_rollups(db)
+    for model in BATCH_CHILD_MODELS:
+        deleted[model.__tablename__] = db.query(model).filter(
+            model.batch_id.in_(batch_ids)
+        ).delete(synchronize_session=False)
+    deleted["batches"] = db.query(models.Batch).filter(models.Batch.id.in_(batch_ids)).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+def delete_superseded_match_results(db: Session, limit: int) -> int:
+    """同一批次、文件、关键词组的重复匹配结果只保留最新一条，每次最多删除 limit 条"""
+    latest = db.query(func.max(models.KeywordMatchResult.id)).group_by(
+        models.KeywordMatchResult.batch_id, models.KeywordMatchResult.file_id, models.KeywordMatchResult.keyword_set_id
+    )
+    ids = [row.id for row in db.query(models.KeywordMatchResult.id).filter(
+        models.KeywordMatchResult.id.notin_(latest)
+    ).limit(limit)]
+    if not ids:
+        return 0
+    count = db.query(models.KeywordMatchResult).filter(
+        models.KeywordMatchResult.id.in_(ids)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return count
+
+def delete_finished_tasks(db: Session, finished_before: datetime, limit: int) -> int:
+    """删除早于指定时间结束的任务记录（每个批次保留最新一条），每次最多删除 limit 条"""
+    latest = db.query(func.max(models.BatchTask.id)).group_by(models.BatchTask.batch_id)
+    ids = [row.id for row in db.query(models.BatchTask.id).filter(
+        models.BatchTask.status.in_(("done", "failed")),
+        models.BatchTask.updated_at < finished_before,
+        models.BatchTask.id.notin_(latest),
+    ).limit(limit)]
+    if not ids:
+        return 0
+    count = db.query(models.BatchTask).filter(models.BatchTask.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+    return count
+
+
+def match_result_exists(db: Session, match_id: int) -> bool:
+    """匹配结果是否存在（不加载 match_data）"""
+    return db.query(models.KeywordMatchResult.id).filter(models.KeywordMatchResult.id == match_id).first() is not None
+
 def get_match_result_by_id(db: Session, match_id: int):
     """查询匹配结果详情（通过ID）"""
     return db.query(models.KeywordMatchResult).filter(
         models.KeywordMatchResult.id == match_id
-    ).first()
\ No newline at end of file
+    ).first()
+
+
+# 批次任务队列
+def create_batch_task(db: Session, batch_id: int, keyword_set_id: int = None, owner: str = None,
+                      lease_seconds: int = 60, max_attempts: int = 3):
+    """创建批次任务；指定 owner 时任务直接由其持有（创建即领取，不与其他工作进程竞争）"""
+    now = datetime.utcnow()
+    db_task = models.BatchTask(
+        batch_id=batch_id,
+        keyword_set_id=keyword_set_id,
+        max_attempts=max_attempts,
+        created_at=now,
+        updated_at=now,
+    )
+    if owner:
+        db_task.status = "running"
+        db_task.attempts = 1
+        db_task.lease_owner = owner
+        db_task.lease_expires_at = now + timedelta(seconds=lease_seconds)
+        db_task.heartbeat_at = now
+    db.add(db_task)
+    db.commit()
+    db.refresh(db_task)
+    return db_task
+
+def get_batch_task(db: Session, task_id: int):
+    return db.query(models.BatchTask).filter(models.BatchTask.id == task_id).first()
+
+def get_batch_tasks_by_batch(db: Session, batch_id: int):
+    return db.query(models.BatchTask).filter(
+        models.BatchTask.batch_id == batch_id
+    ).order_by(models.BatchTask.id.desc()).all()
+
+def count_batch_tasks(db: Session, status: str) -> int:
+    return db.query(func.count(models.BatchTask.id)).filter(models.BatchTask.status == status).scalar()
+
+def _claimable_task(now: datetime):
+    """可领取的任务：已到重试时间的 pending，或租约已过期的 running（持有者已崩溃）"""
+    task = models.BatchTask
+    return and_(
+        task.attempts < task.max_attempts,
+        or_(
+            and_(task.status == "pending", or_(task.lease_expires_at.is_(None), task.lease_expires_at <= now)),
+            and_(task.status == "running", task.lease_expires_at < now),
+        ),
+    )
+
+def fail_exhausted_tasks(db: Session):
+    """租约已过期且重试次数已用完的任务标记为失败，对应批次一并标记"""
+    task = models.BatchTask
+    now = datetime.utcnow()
+    exhausted = db.query(task).filter(
+        task.status == "running", task.lease_expires_at < now, task.attempts >= task.max_attempts
+    ).all()
+    for db_task in exhausted:
+        db_task.status = "failed"
+        db_task.lease_owner = None
+        db_task.last_error = db_task.last_error or "工作进程租约过期且重试次数已用完"
+        db_task.updated_at = now
+        db.query(models.Batch).filter(models.Batch.id == db_task.batch_id).update({"status": "failed"})
+    db.commit()
+    return len(exhausted)
+
+def claim_batch_task(db: Session, owner: str, lease_seconds: int, task_id: int = None):
+    """
+    领取一个任务（条件更新，多个工作进程并发领取时只有一个成功），attempts 加一
+    没有可领取的任务时返回 None
+    """
+    task = models.BatchTask
+    for _ in range(5):
+        now = datetime.utcnow()
+        query = db.query(task.id).filter(_claimable_task(now))
+        if task_id is not None:
+            query = query.filter(task.id == task_id)
+        candidate = query.order_by(task.id).first()
+        if candidate is None:
+            return None
+        claimed = db.query(task).filter(task.id == candidate.id, _claimable_task(now)).update({
+            "status": "running",
+            "attempts": task.attempts + 1,
+            "lease_owner": owner,
+            "lease_expires_at": now + timedelta(seconds=lease_seconds),
+            "heartbeat_at": now,
+            "updated_at": now,
+        }, synchronize_session=False)
+        db.commit()
+        if claimed == 1:
+            return get_batch_task(db, candidate.id)
+    return None
+
+def renew_task_lease(db: Session, task_id: int, owner: str, lease_seconds: int) -> bool:
+    """心跳续约；返回 False 表示租约已被其他工作进程接管"""
+    now = datetime.utcnow()
+    renewed = db.query(models.BatchTask).filter(
+        models.BatchTask.id == task_id,
+        models.BatchTask.status == "running",
+        models.BatchTask.lease_owner == owner,
+    ).update({"lease_expires_at": now + timedelta(seconds=lease_seconds), "heartbeat_at": now},
+             synchronize_session=False)
+    db.commit()
+    return renewed == 1
+
+def checkpoint_batch_task(db: Session, task_id: int, owner: str, stage: str) -> bool:
+    """记录已完成的阶段；返回 False 表示租约已丢失"""
+    updated = db.query(models.BatchTask).filter(
+        models.BatchTask.id == task_id,
+        models.BatchTask.lease_owner == owner,
+    ).update({"stage": stage, "updated_at": datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+def release_batch_task(db: Session, task_id: int, owner: str, status: str, error: str = None,
+                       retry_delay: int = 0) -> bool:
+    """结束持有：status 为 done / failed，或 pending（retry_delay 秒后可重新领取）"""
+    now = datetime.utcnow()
+    updated = db.query(models.BatchTask).filter(
+        models.BatchTask.id == task_id,
+        models.BatchTask.lease_owner == owner,
+    ).update({
+        "status": status,
+        "lease_owner": None,
+        "lease_expires_at": now + timedelta(seconds=retry_delay) if status == "pending" else None,
+        "last_error": error,
+        "updated_at": now,
+    }, synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+def retry_batch_task(db: Session, task_id: int):
+    """手动重试失败的任务：从最后完成的阶段继续，重试次数清零"""
+    db_task = get_batch_task(db, task_id)
+    if db_task is None or db_task.status != "failed":
+        return None
+    db_task.status = "pending"
+    db_task.attempts = 0
+    db_task.lease_owner = None
+    db_task.lease_expires_at = None
+    db_task.updated_at = datetime.utcnow()
+    db.query(models.Batch).filter(models.Batch.id == db_task.batch_id).update({"status": "processing"})
+    db.commit()
+    db.refresh(db_task)
+    return db_task
+
+
+# 批次统计 / 设备趋势
+def get_batch_summary(db: Session, batch_id: int):
+    return db.query(models.BatchSummary).filter(models.BatchSummary.batch_id == batch_id).first()
+
+def get_batch_summaries(db: Session, skip: int = 0, limit: int = 100):
+    return db.query(models.BatchSummary).order_by(
+        models.BatchSummary.batch_id.desc()
+    ).offset(skip).limit(limit).all()
+
+def get_batches_with_summaries(db: Session, skip: int = 0, limit: int = 100):
+    """[(批次, 物化统计或 None)]，按批次ID倒序，一次查询"""
+    return db.query(models.Batch, models.BatchSummary).outerjoin(
+        models.BatchSummary, models.BatchSummary.batch_id == models.Batch.id
+    ).order_by(models.Batch.id.desc()).offset(skip).limit(limit).all()
+
+def get_latest_match_results_by_batch(db: Session, batch_id: int):
+    """批次中每个文件、每个关键词组最新的一条匹配结果（重复执行匹配留下的旧结果不计）"""
+    latest = db.query(func.max(models.KeywordMatchResult.id)).filter(
+        models.KeywordMatchResult.batch_id == batch_id
+    ).group_by(models.KeywordMatchResult.file_id, models.KeywordMatchResult.keyword_set_id)
+    return db.query(models.KeywordMatchResult).filter(models.KeywordMatchResult.id.in_(latest)).all()
+
+def get_snapshots_by_batch(db: Session, batch_id: int):
+    return db.query(models.DeviceSnapshot).filter(models.DeviceSnapshot.batch_id == batch_id).all()
+
+def _apply_rollup(db: Session, day: str, contributions, sign: int):
+    """将 [[关键词组ID, 主机名, 关键词, 命中数]] 累加（sign=1）或扣除（sign=-1）到 fleet_rollups"""
+    for keyword_set_id, hostname, keyword, hits in contributions:
+        stmt = sqlite_insert(models.FleetRollup).values(
+            day=day, keyword_set_id=keyword_set_id, hostname=hostname, keyword=keyword, hits=sign * hits
+        )
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["day", "keyword_set_id", "hostname", "keyword"],
+            set_={"hits": models.FleetRollup.hits + stmt.excluded.hits},
+        ))
+
+def _delete_empty_rollups(db: Session):
+    db.query(models.FleetRollup).filter(models.FleetRollup.hits <= 0).delete(synchronize_session=False)
+
+def save_batch_summary(db: Session, batch_id: int, day: str, values: dict, contributions):
+    """写入批次统计，并在同一事务中把该批次对设备趋势的贡献由旧值替换为新值"""
+    summary = get_batch_summary(db, batch_id)
+    if summary is None:
+        summary = models.BatchSummary(batch_id=batch_id)
+        db.add(summary)
+    else:
+        _apply_rollup(db, summary.day, json.loads(summary.rollup or "[]"), -1)
+    for key, value in values.items():
+        setattr(summary, key, value)
+    summary.day = day
+    summary.rollup = json.dumps(contributions, ensure_ascii=False)
+    summary.updated_at = datetime.utcnow()
+    _apply_rollup(db, day, contributions, 1)
+    _delete_empty_rollups(db)
+    db.commit()
+    db.refresh(summary)
+    return summary
+
+def query_fleet_rollups(db: Session, keyword_set_id: int = None, hostname: str = None, keyword: str = None,
+                        start: str = None, end: str = None):
+    query = db.query(models.FleetRollup)
+    if keyword_set_id is not None:
+        query = query.filter(models.FleetRollup.keyword_set_id == keyword_set_id)
+    if hostname:
+        query = query.filter(models.FleetRollup.hostname == hostname)
+    if keyword:
+        query = query.filter(models.FleetRollup.keyword == keyword)
+    if start:
+        query = query.filter(models.FleetRollup.day >= start)
+    if end:
+        query = query.filter(models.FleetRollup.day <= end)
+    return query
+
+
+# 监视目录
+def get_watched_files(db: Session, root: str):
+    """监视目录下已记录的文件：{相对路径: WatchedFile}"""
+    return {f.rel_path: f for f in db.query(models.WatchedFile).filter(models.WatchedFile.root == root)}
+
+def upsert_watched_file(db: Session, root: str, rel_path: str, size: int, mtime_ns: int,
+                        content_hash: str, batch_id: int = None, existing=None):
+    """记录文件的当前状态（不提交）；batch_id 为空时只更新大小和修改时间（内容未变）"""
+    watched = existing or models.WatchedFile(root=root, rel_path=rel_path)
+    watched.size = size
+    watched.mtime_ns = mtime_ns
+    watched.content_hash = content_hash
+    if batch_id is not None:
+        watched.batch_id = batch_id
+        watched.ingested_at = datetime.utcnow()
+    if existing is None:
+        db.add(watched)
+    return watched
+
+
+# 分块上传
+def create_upload_session(db: Session, batch_id: int, keyword_set_id: int, files):
+    """创建上传会话；files 为 [(文件名, 路径, 大小, sha256)]"""
+    now = datetime.utcnow()
+    session = models.UploadSession(batch_id=batch_id, keyword_set_id=keyword_set_id, created_at=now, updated_at=now)
+    db.add(session)
+    db.flush()
+    for filename, file_path, size, sha256 in files:
+        db.add(models.UploadSessionFile(session_id=session.id, batch_id=batch_id, filename=filename,
+                                        file_path=file_path, size=size, received=0, sha256=sha256))
+    db.commit()
+    db.refresh(session)
+    return session
+
+def get_upload_session(db: Session, session_id: int):
+    return db.query(models.UploadSession).filter(models.UploadSession.id == session_id).first()
+
+def get_upload_session_file(db: Session, session_id: int, file_id: int):
+    return db.query(models.UploadSessionFile).filter(
+        models.UploadSessionFile.id == file_id, models.UploadSessionFile.session_id == session_id
+    ).first()
+
+def set_upload_received(db: Session, upload_file, received: int):
+    upload_file.received = received
+    db.query(models.UploadSession).filter(models.UploadSession.id == upload_file.session_id).update(
+        {"updated_at": datetime.utcnow()}, synchronize_session=False
+    )
+    db.commit()
+
+def finalize_upload_session(db: Session, session):
+    """会话完成：登记原始文件并标记为已完成"""
+    for upload_file in session.files:
+        db.add(models.OriginalFile(filename=upload_file.filename, file_path=upload_file.file_path,
+                                   batch_id=session.batch_id))
+    session.status = "finalized"
+    session.updated_at = datetime.utcnow()
+    db.commit()
+
+def get_expired_upload_batch_ids(db: Session, idle_before: datetime):
+    """超过期限未完成（最后一次写入早于 idle_before）的上传会话对应的批次ID"""
+    rows = db.query(models.UploadSession.batch_id).filter(
+        models.UploadSession.status == "open", models.UploadSession.updated_at < idle_before
+    ).all()
+    return [row.batch_id for row in rows]
@@ -1,15 +1,29 @@
 import sqlite3
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATABASE_URL = f"sqlite:///{os.path.join(BASE_DIR, 'config_cleaner.db')}"
 
+# 多个进程（API + 工作进程）共用同一个 SQLite 文件：WAL 模式读写互不阻塞，写锁冲突时等待而不是立即报错
+SQLITE_BUSY_TIMEOUT = float(os.environ.get("KY_SQLITE_BUSY_TIMEOUT", "30"))
+
 engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
+    DATABASE_URL, connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT}
 )
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # 新建的数据库使用增量回收（已有数据库需执行一次 ky-match gc --full-vacuum 转换）
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -19,4 +33,27 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+def ensure_columns(bind=engine):
+    """
+    为已存在的表补充模型中新增的列（create_all 不会修改已有表）
+    仅处理新增列，标量默认值写入 DEFAULT，带 index 的列同时建索引
+    """
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=bind.dialect)}"
+                if column.default is not None and column.default.is_scalar:
+                    ddl += f" DEFAULT {column.default.arg!r}"
+                conn.execute(text(ddl))
+                for index in table.indexes:
+                    if column.name in index.columns:
+                        index.create(conn, checkfirst=True)
@@ -1,16 +1,37 @@
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 import os
-from .database import engine, Base
+from contextlib import asynccontextmanager
+from .database import engine, Base, ensure_columns
 from .api.api import api_router
+from .services.admission_service import admission
+from .services.retention_service import GC_INTERVAL, start_gc_worker
+from .services.static_service import CachedStaticFiles
+from .services.task_service import WORKER_MODE, start_embedded_worker
+from .services.watch_service import WATCH_DIRS, WATCH_INTERVAL, start_watch_worker
 
-# 创建数据库表
+# 创建数据库表（并为旧库补充新增列）
 Base.metadata.create_all(bind=engine)
+ensure_columns(engine)
 
-app = FastAPI(title="配置文件预处理系统")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # inline 模式下由 API 进程内的工作线程接管崩溃遗留（租约过期）和等待重试的任务
+    stop_worker = start_embedded_worker() if WORKER_MODE == "inline" else None
+    # 按保留策略定期清理过期批次
+    stop_gc = start_gc_worker() if GC_INTERVAL > 0 else None
+    # 定期扫描监视目录，导入新增或变化的配置文件
+    stop_watch = start_watch_worker() if WATCH_DIRS and WATCH_INTERVAL > 0 else None
+    yield
+    for stop_event in (stop_worker, stop_gc, stop_watch):
+        if stop_event is not None:
+            stop_event.set()
+
+
+app = FastAPI(title="配置文件预处理系统", lifespan=lifespan)
 
 # 配置CORS
 app.add_middleware(
@@ -21,9 +42,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# app.mount("/static", StaticFiles(directory="static"), name="static")
-app.mount("/static", StaticFiles(directory="backend/static",
-          html=True), name="static")
+static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+frontend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+# 前端页面与资源：启动时加载，文件修改后重新加载（页面路由与 "/" 挂载共用同一缓存）
+frontend_files = CachedStaticFiles(directory=frontend_dir, html=True)
+page_cache = frontend_files.cache
 
 
 def custom_swagger_ui_html():
@@ -109,41 +132,32 @@ app.get("/redoc_1", response_class=HTMLResponse)(custom_redoc_html)
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "admission": admission.snapshot()}
 
 
 
 
 @app.get("/keyword-manager", response_class=HTMLResponse)
 async def keyword_manager(request: Request):
-    # 直接返回keywords-manager.html内容
-    try:
-        with open(os.path.join(frontend_dir, "keyword-manager.html"), "r", encoding="utf-8") as f:
-            html_content = f.read()
-        return HTMLResponse(content=html_content, status_code=200)
-    except FileNotFoundError:
+    response = page_cache.response("keyword-manager.html", request.headers)
+    if response is None:
         raise HTTPException(status_code=404, detail="keywords manager not found")
-
+    return response
 
 
 @app.get("/file-manager", response_class=HTMLResponse)
 async def file_manager(request: Request):
-    # 直接返回file-manager.html内容
-    try:
-        with open(os.path.join(frontend_dir, "file-manager.html"), "r", encoding="utf-8") as f:
-            html_content = f.read()
-        return HTMLResponse(content=html_content, status_code=200)
-    except FileNotFoundError:
+    response = page_cache.response("file-manager.html", request.headers)
+    if response is None:
         raise HTTPException(status_code=404, detail="File manager not found")
+    return response
 
 # 注册API路由
 app.include_router(api_router, prefix="/api")
 
 
-# 挂载静态文件
-static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
-app.mount("/static", StaticFiles(directory=static_dir), name="static")
+# 挂载静态文件（启动时预压缩；上传目录内容随批次变化，不进入缓存）
+app.mount("/static", CachedStaticFiles(directory=static_dir, exclude=("uploads",)), name="static")
 
 # 挂载前端文件
-frontend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
-app.mount("/", StaticFiles(directory=frontend_dir, html=True), name="templates")
+app.mount("/", frontend_files, name="templates")
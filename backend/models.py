@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -14,6 +14,7 @@ class Batch(Base):
     cleaned_files_1 = relationship("CleanedFile1", back_populates="batch")
     cleaned_files_2 = relationship("CleanedFile2", back_populates="batch")
     status = Column(String, default="processing")
+    pinned = Column(Integer, default=0)  # 1 表示固定保留，不受保留策略清理
 
 class OriginalFile(Base):
     __tablename__ = "original_files"
@@ -35,6 +36,7 @@ class CleanedFile1(Base):
     file_path = Column(String)
     cleaned_time = Column(DateTime, default=datetime.utcnow)
     batch_id = Column(Integer, ForeignKey("batches.id"))
+    content_hash = Column(String, index=True, nullable=True)  # 清洗后内容的 sha256
 
     batch = relationship("Batch", back_populates="cleaned_files_1")
 
@@ -58,7 +60,34 @@ class KeywordSet(Base):
     name = Column(String, index=True, nullable=False)  # 关键词组名称
     description = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    keywords = Column(String)  # 存储逗号分隔的关键词
+    keywords = Column(String, nullable=True)  # 旧版：逗号分隔的关键词，读取时迁移到 keywords 表后清空
+    version = Column(Integer, default=1)  # 关键词变更时递增，用于匹配结果缓存失效
+    keyword_count = Column(Integer, default=0)
+    scopes = Column(String, nullable=True)  # 区块作用域（JSON 列表），为空表示全部区块
+
+class Keyword(Base):
+    """关键词组中的单个关键词（按 position 保持导入顺序）"""
+    __tablename__ = "keywords"
+    __table_args__ = (Index("ix_keywords_set_position", "keyword_set_id", "position"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    keyword_set_id = Column(Integer, ForeignKey("keyword_sets.id"), nullable=False)
+    position = Column(Integer, nullable=False)
+    value = Column(String, nullable=False)
+    scope = Column(String, nullable=True)  # 该关键词的区块作用域（逗号分隔），优先于关键词组的作用域
+    severity = Column(Integer, default=0)  # 严重程度（越大越严重），用于 Top-K 排序和存在性检查
+
+class KeywordRule(Base):
+    """关键词规则：关键词的 AND / OR / NOT 组合，在同一区块（section）或同一行（line）内求值"""
+    __tablename__ = "keyword_rules"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, index=True, nullable=False)
+    description = Column(String, nullable=True)
+    expression = Column(String, nullable=False)  # 如 neighbor AND NOT password
+    level = Column(String, default="section")  # section / line
+    sections = Column(String, nullable=True)  # 区块作用域（逗号分隔），为空表示全部区块
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 class KeywordMatchResult(Base):
     __tablename__ = "keyword_match_results"
@@ -71,8 +100,125 @@ class KeywordMatchResult(Base):
     keyword_set_id = Column(Integer, ForeignKey("keyword_sets.id"))  # 关联关键词组
     match_data = Column(String)  # 存储JSON格式的匹配结果
     created_at = Column(DateTime, default=datetime.utcnow)
+    cache_key = Column(String, index=True, nullable=True)  # 内容哈希+关键词组版本+匹配器版本
 
     # 关联关系
     batch = relationship("Batch")
     file = relationship("CleanedFile2")
-    keyword_set = relationship("KeywordSet")
\ No newline at end of file
+    keyword_set = relationship("KeywordSet")
+class BatchTask(Base):
+    """
+    批次处理任务（持久化任务队列）：工作进程按租约领取并定期续约，
+    每完成一个阶段记录检查点；进程崩溃后租约过期，由其他工作进程从最后完成的阶段继续
+    """
+    __tablename__ = "batch_tasks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(Integer, ForeignKey("batches.id"), index=True)
+    keyword_set_id = Column(Integer, ForeignKey("keyword_sets.id"), nullable=True)
+    status = Column(String, default="pending", index=True)  # pending / running / done / failed
+    stage = Column(String, nullable=True)  # 最后完成的阶段，为空表示尚未开始
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)  # running：租约到期时间；pending：重试的最早时间
+    heartbeat_at = Column(DateTime, nullable=True)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    batch = relationship("Batch")
+
+class DeviceSnapshot(Base):
+    """设备配置快照：按主机名串联各批次，记录区块哈希及其解析结果/关键词命中，用于增量处理和配置漂移"""
+    __tablename__ = "device_snapshots"
+
+    id = Column(Integer, primary_key=True, index=True)
+    hostname = Column(String, index=True, nullable=True)
+    vendor = Column(String)
+    batch_id = Column(Integer, ForeignKey("batches.id"), index=True)
+    cleaned_file_1_id = Column(Integer, ForeignKey("cleaned_files_1.id"), index=True)
+    snapshot_path = Column(String)  # 区块快照 JSON 文件
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    batch = relationship("Batch")
+    cleaned_file_1 = relationship("CleanedFile1")
+
+class BatchSummary(Base):
+    """批次完成时物化的统计，批次列表和仪表盘直接读取，无需加载文件记录和匹配结果"""
+    __tablename__ = "batch_summaries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(Integer, ForeignKey("batches.id"), unique=True, index=True)
+    day = Column(String, index=True)  # 批次日期（UTC，YYYY-MM-DD），对应 fleet_rollups.day
+    original_files = Column(Integer, default=0)
+    cleaned_1_files = Column(Integer, default=0)
+    cleaned_2_files = Column(Integer, default=0)
+    match_results = Column(Integer, default=0)
+    original_bytes = Column(Integer, default=0)
+    cleaned_1_bytes = Column(Integer, default=0)
+    cleaned_2_bytes = Column(Integer, default=0)
+    devices = Column(Integer, default=0)
+    total_hits = Column(Integer, default=0)
+    vendors = Column(String, nullable=True)  # JSON：{厂商: 文件数}
+    keyword_hits = Column(String, nullable=True)  # JSON：{关键词: 命中数}
+    device_hits = Column(String, nullable=True)  # JSON：{主机名: 命中数}
+    rollup = Column(String, nullable=True)  # JSON：计入 fleet_rollups 的 [[关键词组ID, 主机名, 关键词, 命中数]]，重算/删除时扣除
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    batch = relationship("Batch")
+
+class FleetRollup(Base):
+    """按天、关键词组、设备、关键词累计的命中数，随批次统计的物化/删除增量维护"""
+    __tablename__ = "fleet_rollups"
+    __table_args__ = (
+        UniqueConstraint("day", "keyword_set_id", "hostname", "keyword", name="uq_fleet_rollup"),
+        Index("ix_fleet_rollup_keyword_day", "keyword", "day"),
+        Index("ix_fleet_rollup_hostname_day", "hostname", "day"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(String, nullable=False)
+    keyword_set_id = Column(Integer, nullable=False)
+    hostname = Column(String, nullable=False)
+    keyword = Column(String, nullable=False)
+    hits = Column(Integer, default=0)
+
+class WatchedFile(Base):
+    """监视目录中的文件：记录上次导入时的大小、修改时间和内容哈希，未变化的文件在扫描时跳过"""
+    __tablename__ = "watched_files"
+    __table_args__ = (UniqueConstraint("root", "rel_path", name="uq_watched_file"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    root = Column(String, nullable=False, index=True)  # 监视目录（绝对路径）
+    rel_path = Column(String, nullable=False)
+    size = Column(Integer)
+    mtime_ns = Column(Integer)
+    content_hash = Column(String, nullable=True)
+    batch_id = Column(Integer, nullable=True)  # 最近一次导入的批次（批次被清理后不再存在）
+    ingested_at = Column(DateTime, default=datetime.utcnow)
+
+class UploadSession(Base):
+    """可续传的分块上传：创建时即建立批次，各文件按偏移追加写入批次的 original 目录，完成后入队处理"""
+    __tablename__ = "upload_sessions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    batch_id = Column(Integer, ForeignKey("batches.id"), index=True)
+    keyword_set_id = Column(Integer, nullable=True)
+    status = Column(String, default="open", index=True)  # open / finalized
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    files = relationship("UploadSessionFile", order_by="UploadSessionFile.id")
+
+class UploadSessionFile(Base):
+    __tablename__ = "upload_session_files"
+
+    id = Column(Integer, primary_key=True, index=True)
+    session_id = Column(Integer, ForeignKey("upload_sessions.id"), index=True)
+    batch_id = Column(Integer, ForeignKey("batches.id"), index=True)
+    filename = Column(String)
+    file_path = Column(String)
+    size = Column(Integer)  # 声明的文件大小
+    received = Column(Integer, default=0)  # 已连续写入的字节数（从文件开头起）
+    sha256 = Column(String, nullable=True)  # 客户端提供的内容哈希，完成时校验
@@ -1,7 +1,8 @@
 import json
-from pydantic import BaseModel, field_validator
+import re
+from pydantic import BaseModel, Field, computed_field, field_validator
 from datetime import datetime
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 class BatchBase(BaseModel):
     description: Optional[str] = None
@@ -12,6 +13,7 @@ class BatchCreate(BatchBase):
 class Batch(BatchBase):
     id: int
     timestamp: datetime
+    pinned: bool = False
 
     class Config:
         orm_mode = True
@@ -34,6 +36,7 @@ class OriginalFile(FileBase):
 class CleanedFile1Create(FileBase):
     original_file_id: int
     batch_id: int
+    content_hash: Optional[str] = None
 
 class CleanedFile1(FileBase):
     id: int
@@ -57,6 +60,111 @@ class CleanedFile2(FileBase):
     class Config:
         orm_mode = True
 
+class DeviceSnapshotCreate(BaseModel):
+    hostname: Optional[str] = None
+    vendor: str
+    batch_id: int
+    cleaned_file_1_id: int
+    snapshot_path: str
+
+class BatchTask(BaseModel):
+    id: int
+    batch_id: int
+    keyword_set_id: Optional[int] = None
+    status: str
+    stage: Optional[str] = None
+    attempts: int = 0
+    max_attempts: int = 3
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    heartbeat_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+class UploadFileSpec(BaseModel):
+    filename: str
+    size: int = Field(..., ge=0)
+    sha256: Optional[str] = Field(None, pattern="^[0-9a-fA-F]{64}$")
+
+class UploadSessionCreate(BaseModel):
+    description: Optional[str] = None
+    keyword_set_id: Optional[int] = None
+    files: List[UploadFileSpec] = Field(..., min_length=1)
+
+class UploadSessionFile(BaseModel):
+    id: int
+    filename: str
+    size: int
+    received: int = 0
+    sha256: Optional[str] = None
+
+    @computed_field
+    @property
+    def ranges(self) -> List[List[int]]:
+        """已接收的字节范围 [[起, 止)]（按顺序写入，只有从开头起的一段）"""
+        return [[0, self.received]] if self.received else []
+
+    class Config:
+        orm_mode = True
+
+class UploadSession(BaseModel):
+    id: int
+    batch_id: int
+    keyword_set_id: Optional[int] = None
+    status: str
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    files: List[UploadSessionFile] = []
+
+    class Config:
+        orm_mode = True
+
+class BatchSummary(BaseModel):
+    batch_id: int
+    day: str
+    original_files: int = 0
+    cleaned_1_files: int = 0
+    cleaned_2_files: int = 0
+    match_results: int = 0
+    original_bytes: int = 0
+    cleaned_1_bytes: int = 0
+    cleaned_2_bytes: int = 0
+    devices: int = 0
+    total_hits: int = 0
+    vendors: Dict[str, int] = {}
+    keyword_hits: Dict[str, int] = {}
+    device_hits: Dict[str, int] = {}
+    updated_at: Optional[datetime] = None
+
+    @field_validator('vendors', 'keyword_hits', 'device_hits', mode='before')
+    def parse_counts(cls, v):
+        if isinstance(v, str):
+            return json.loads(v)
+        return v or {}
+
+    class Config:
+        orm_mode = True
+
+
+class BatchListItem(Batch):
+    """批次列表项：文件数、命中数等取自物化统计（未统计的批次为 None），文件列表见批次详情接口"""
+    status: Optional[str] = None
+    summary: Optional[BatchSummary] = None
+
+class FleetRollup(BaseModel):
+    day: str
+    keyword_set_id: int
+    hostname: str
+    keyword: str
+    hits: int
+
+    class Config:
+        orm_mode = True
+
 class BatchResponse(Batch):
     original_files: List[OriginalFile] = []
     cleaned_files_1: List[CleanedFile1] = []
@@ -72,13 +180,35 @@ class KeywordSetBase(BaseModel):
     name: str
     description: Optional[str] = None
     keywords: List[str]
+    # 区块作用域（区块名前缀，"_" 视为空格，如 router_bgp、interface、global），为空表示全部区块
+    scopes: Optional[List[str]] = None
+
+def check_keyword(word: str):
+    """以 "re:" 开头的关键词按正则处理，校验语法"""
+    if word.startswith("re:"):
+        try:
+            re.compile(word[3:])
+        except re.error as e:
+            raise ValueError(f"无效的正则关键词 {word!r}: {e}")
 
 class KeywordSetCreate(KeywordSetBase):
-    pass
+    # 单个关键词的作用域：关键词 -> 区块名前缀列表
+    keyword_scopes: Optional[Dict[str, List[str]]] = None
+    # 单个关键词的严重程度（越大越严重，未指定为 0）
+    keyword_severities: Optional[Dict[str, int]] = None
+
+    @field_validator('keywords')
+    def validate_regex_keywords(cls, v):
+        for word in v:
+            check_keyword(word)
+        return v
 
+# keywords 仅包含前 KEYWORD_PREVIEW_LIMIT 个关键词，完整列表通过分页接口获取
 class KeywordSet(KeywordSetBase):
     id: int
     created_at: datetime
+    version: Optional[int] = 1
+    keyword_count: int = 0
 
     class Config:
         orm_mode = True
@@ -88,6 +218,49 @@ class KeywordMatchRequest(BaseModel):
     batch_id: int
     keyword_set_id: int  # 关键词组ID
 
+# 多关键词组匹配请求：每个文件只扫描一次，按关键词组分别保存结果
+class MultiKeywordMatchRequest(BaseModel):
+    batch_id: int
+    keyword_set_ids: List[int]
+
+# 关键词规则：表达式由关键词（含空格时加双引号）与 AND / OR / NOT / 括号组成
+class KeywordRuleBase(BaseModel):
+    name: str
+    description: Optional[str] = None
+    expression: str
+    level: str = Field("section", pattern="^(section|line)$")  # 在同一区块还是同一行内求值
+    sections: Optional[List[str]] = None  # 区块作用域（区块名前缀），为空表示全部区块
+
+class KeywordRuleCreate(KeywordRuleBase):
+    pass
+
+class KeywordRule(KeywordRuleBase):
+    id: int
+    created_at: datetime
+
+    @field_validator('sections', mode='before')
+    def split_sections(cls, v):
+        if isinstance(v, str):
+            return [s for s in v.split(",") if s]
+        return v
+
+    class Config:
+        orm_mode = True
+
+# 规则求值请求：未指定 rule_ids 时使用全部规则
+class RuleEvaluateRequest(BaseModel):
+    batch_id: int
+    rule_ids: Optional[List[int]] = None
+
+# 按严重程度的匹配：top 为每个文件最严重的 k 条命中，exists 只检查是否存在（遇到第一条即停止）
+# min_severity 为参与匹配的最低严重程度
+class KeywordRankRequest(BaseModel):
+    batch_id: int
+    keyword_set_id: int
+    mode: str = Field("top", pattern="^(top|exists)$")
+    k: int = Field(50, ge=1, le=1000)
+    min_severity: Optional[int] = None
+
 # 匹配结果模型
 class KeywordMatchResultBase(BaseModel):
     batch_id: int
@@ -109,7 +282,7 @@ class KeywordMatchResultBase(BaseModel):
         return v  # 已经是字典则直接返回
 
 class KeywordMatchResultCreate(KeywordMatchResultBase):
-    pass
+    cache_key: Optional[str] = None
 
 class KeywordMatchResult(KeywordMatchResultBase):
     id: int
@@ -117,4 +290,31 @@ class KeywordMatchResult(KeywordMatchResultBase):
 
     class Config:
         orm_mode = True
-        arbitrary_types_allowed = True
\ No newline at end of file
+        arbitrary_types_allowed = True
+
+# 分页匹配结果（游标为下一页请求应传入的 cursor，为空表示已无更多数据）
+class KeywordMatchResultPage(BaseModel):
+    items: List[KeywordMatchResult] = []
+    next_cursor: Optional[int] = None
+
+# 关键词分页（cursor 为最后一项的 position）
+class KeywordItem(BaseModel):
+    position: int
+    value: str
+    scope: Optional[str] = None
+    severity: Optional[int] = 0
+
+    class Config:
+        orm_mode = True
+
+class KeywordPage(BaseModel):
+    items: List[KeywordItem] = []
+    next_cursor: Optional[int] = None
+
+# 关键词批量导入结果
+class KeywordImportResult(BaseModel):
+    keyword_set_id: int
+    added: int
+    skipped: int
+    keyword_count: int
+    version: int
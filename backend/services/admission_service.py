@@ -0,0 +1,277 @@
+"""
+批次处理的准入控制：按内存 / CPU 预算限制同时执行的处理阶段
+
+每个阶段开始前按阶段类型和文件大小估算工作集（各阶段逐个文件处理，峰值取决于最大的文件），
+预算内的立即执行，超出的按先后顺序排队（队首未准入前后面的不插队，避免大文件一直等不到）；
+排队数达到上限时，来自请求的处理直接拒绝，由接口返回 429 和建议的重试等待时间。
+
+预算由同一台机器上的所有进程共享（API 进程和各 ky-match worker）：各进程的占用记录在
+文件锁保护的台账（KY_ADMISSION_LEDGER）中，准入时把其他进程的占用一并计入；
+已退出进程的记录在下次读写时清除。排队和 429 判断仍按进程计算。
+不支持 fcntl 的平台上台账不可用，预算退化为按进程计算，此时应按进程数缩小预算。
+"""
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+
+from .. import crud
+from ..database import BASE_DIR
+from .parallel_service import PARALLEL_FILE_THRESHOLD, PARALLEL_WORKERS
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def _default_memory_budget_mb() -> int:
+    """默认使用物理内存的一半"""
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // 2 // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return 2048
+
+
+# 同时执行的阶段可占用的内存预算（MB）
+ADMISSION_MEMORY_MB = int(os.environ.get("KY_ADMISSION_MEMORY_MB", "0")) or _default_memory_budget_mb()
+# CPU 预算（同时执行的阶段数，块内并行的阶段按进程数计）
+ADMISSION_CPU_SLOTS = int(os.environ.get("KY_ADMISSION_CPU_SLOTS", "0")) or os.cpu_count() or 1
+# 排队上限，超过后请求直接返回 429
+ADMISSION_MAX_QUEUE = int(os.environ.get("KY_ADMISSION_MAX_QUEUE", "32"))
+# 各进程共享的占用台账（与数据库放在一起）
+ADMISSION_LEDGER_PATH = os.environ.get("KY_ADMISSION_LEDGER") or os.path.join(BASE_DIR, "admission_ledger.json")
+# 排队时重新检查台账的间隔（秒）：其他进程释放预算时不会唤醒本进程
+LEDGER_POLL_INTERVAL = 0.5
+
+# 各阶段工作集相对文件大小的倍数：初次清洗逐行读写；二次清洗构建解析树并序列化为 JSON；
+# 匹配需要原文、区块划分和结果
+STAGE_MEMORY_FACTORS = {"clean_1": 2, "clean_2": 10, "match": 6}
+# 每个阶段的固定开销（解释器对象、自动机等）
+STAGE_BASE_MEMORY = 16 * 1024 * 1024
+
+
+class AdmissionRejected(Exception):
+    """排队已满"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"处理队列已满，请 {retry_after} 秒后重试")
+        self.retry_after = retry_after
+
+    def to_http_exception(self) -> HTTPException:
+        return HTTPException(status_code=429, detail=str(self), headers={"Retry-After": str(self.retry_after)})
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class AdmissionLedger:
+    """同一台机器上各进程的预算占用：{进程ID: [内存字节数, CPU 槽数]}，读写时持有文件锁"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @contextmanager
+    def _locked(self):
+        with open(self.path, "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    entries = {int(pid): usage for pid, usage in json.loads(f.read() or "{}").items()}
+                except ValueError:
+                    entries = {}
+                pid = os.getpid()
+                entries = {p: usage for p, usage in entries.items() if p == pid or _pid_alive(p)}
+                yield entries
+                f.seek(0)
+                f.truncate()
+                json.dump({str(p): usage for p, usage in entries.items() if p == pid or any(usage)}, f)
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _others(entries: dict):
+        pid = os.getpid()
+        memory = sum(usage[0] for p, usage in entries.items() if p != pid)
+        cpu = sum(usage[1] for p, usage in entries.items() if p != pid)
+        return memory, cpu
+
+    def update(self, memory: int, cpu: int, check=None) -> bool:
+        """
+        记录本进程的占用；给出 check(其他进程内存, 其他进程CPU) 时先检查，不满足则不修改并返回 False
+        检查和记录在同一把锁内完成，多个进程不会同时占用同一份余量
+        """
+        with self._locked() as entries:
+            if check is not None and not check(*self._others(entries)):
+                return False
+            entries[os.getpid()] = [memory, cpu]
+            return True
+
+    def others(self):
+        """其他进程的 (内存字节数, CPU 槽数)"""
+        with self._locked() as entries:
+            return self._others(entries)
+
+
+class AdmissionController:
+    def __init__(self, memory_budget: int, cpu_slots: int, max_queue: int, ledger: AdmissionLedger = None):
+        self.memory_budget = memory_budget
+        self.cpu_slots = cpu_slots
+        self.max_queue = max_queue
+        self.ledger = ledger
+        self.memory_in_use = 0
+        self.cpu_in_use = 0
+        self._cond = threading.Condition()
+        self._queue = deque()
+        # 阶段平均耗时（秒，指数滑动平均），用于估算重试等待时间
+        self._avg_hold = 5.0
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "peak_memory": 0}
+
+    def _fits(self, memory: int, cpu: int, other_memory: int = 0, other_cpu: int = 0) -> bool:
+        # 所有进程都空闲时总是准入，单个超出预算的工作也能执行（独占）
+        if not self.cpu_in_use and not other_cpu:
+            return True
+        return (self.memory_in_use + other_memory + memory <= self.memory_budget
+                and self.cpu_in_use + other_cpu + cpu <= self.cpu_slots)
+
+    def _reserve(self, memory: int, cpu: int) -> bool:
+        """预算足够时在台账中记下本进程占用后的总量"""
+        if self.ledger is None:
+            return self._fits(memory, cpu)
+        try:
+            return self.ledger.update(self.memory_in_use + memory, self.cpu_in_use + cpu,
+                                      check=lambda other_memory, other_cpu: self._fits(memory, cpu, other_memory, other_cpu))
+        except OSError as e:
+            print(f"[准入] 台账不可用，按本进程预算计算: {str(e)}")
+            return self._fits(memory, cpu)
+
+    def _release_ledger(self):
+        if self.ledger is None:
+            return
+        try:
+            self.ledger.update(self.memory_in_use, self.cpu_in_use)
+        except OSError as e:
+            print(f"[准入] 台账不可用: {str(e)}")
+
+    def retry_after(self) -> int:
+        with self._cond:
+            return self._retry_after()
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self._avg_hold * (len(self._queue) + 1) / self.cpu_slots))
+
+    def check_capacity(self):
+        """排队已满时抛出 AdmissionRejected（请求入口在保存上传文件前调用）"""
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise AdmissionRejected(self._retry_after())
+
+    @contextmanager
+    def admit(self, memory: int, cpu: int = 1, reject_when_full: bool = False):
+        """
+        在预算内执行；预算不足时排队等待
+        :param reject_when_full: 排队已满时抛出 AdmissionRejected 而不是继续排队（用于请求）
+        """
+        memory = min(memory, self.memory_budget)
+        cpu = min(max(cpu, 1), self.cpu_slots)
+        with self._cond:
+            if reject_when_full and len(self._queue) >= self.max_queue:
+                self._stats["rejected"] += 1
+                raise AdmissionRejected(self._retry_after())
+            ticket = object()
+            self._queue.append(ticket)
+            try:
+                if self._queue[0] is not ticket or not self._reserve(memory, cpu):
+                    self._stats["queued"] += 1
+                    # 使用台账时定期重新检查：其他进程释放预算不会通知本进程
+                    timeout = LEDGER_POLL_INTERVAL if self.ledger is not None else None
+                    while self._queue[0] is not ticket or not self._reserve(memory, cpu):
+                        self._cond.wait(timeout)
+            finally:
+                self._queue.remove(ticket)
+                # 队首变化后，下一个等待者可能也能准入
+                self._cond.notify_all()
+            self.memory_in_use += memory
+            self.cpu_in_use += cpu
+            self._stats["admitted"] += 1
+            self._stats["peak_memory"] = max(self._stats["peak_memory"], self.memory_in_use)
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.memory_in_use -= memory
+                self.cpu_in_use -= cpu
+                self._release_ledger()
+                self._avg_hold = 0.8 * self._avg_hold + 0.2 * (time.monotonic() - started)
+                self._cond.notify_all()
+
+    def snapshot(self) -> dict:
+        other_memory = other_cpu = 0
+        if self.ledger is not None:
+            try:
+                other_memory, other_cpu = self.ledger.others()
+            except OSError:
+                pass
+        with self._cond:
+            return {
+                "memory_budget": self.memory_budget,
+                "memory_in_use": self.memory_in_use,
+                "cpu_slots": self.cpu_slots,
+                "cpu_in_use": self.cpu_in_use,
+                "shared_ledger": self.ledger is not None,
+                "other_processes_memory": other_memory,
+                "other_processes_cpu": other_cpu,
+                "queue_length": len(self._queue),
+                "max_queue": self.max_queue,
+                "avg_stage_seconds": round(self._avg_hold, 3),
+                **self._stats,
+            }
+
+
+admission = AdmissionController(ADMISSION_MEMORY_MB * 1024 * 1024, ADMISSION_CPU_SLOTS, ADMISSION_MAX_QUEUE,
+                                ledger=AdmissionLedger(ADMISSION_LEDGER_PATH) if fcntl is not None else None)
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def estimate_stage_cost(db: Session, batch_id: int, stage: str):
+    """估算批次某一阶段的 (内存字节数, CPU 槽数)"""
+    if stage == "clean_1":
+        files = crud.get_original_files_by_batch(db, batch_id)
+    else:
+        files = crud.get_cleaned_files_1_by_batch(db, batch_id)
+    largest = max((_file_size(f.file_path) for f in files), default=0)
+    memory = STAGE_BASE_MEMORY + largest * STAGE_MEMORY_FACTORS.get(stage, 1)
+    # 超大文件在二次清洗和匹配阶段启用块内并行，占用多个进程
+    cpu = PARALLEL_WORKERS if stage != "clean_1" and largest >= PARALLEL_FILE_THRESHOLD else 1
+    return memory, cpu
+
+
+@contextmanager
+def admit_stage(db: Session, batch_id: int, stage: str, reject_when_full: bool = False):
+    memory, cpu = estimate_stage_cost(db, batch_id, stage)
+    with admission.admit(memory, cpu, reject_when_full=reject_when_full):
+        yield
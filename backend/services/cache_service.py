@@ -0,0 +1,133 @@
+"""
+热点文件的进程内缓存：按占用字节数限制大小的 LRU
+
+文件内容（原始/清洗文件的文本）和解析后的 JSON 文档（二次清洗结果、匹配结果）分别缓存，
+文件的键为 (路径, 修改时间, 大小)：文件被重写后键随之变化，旧版本在存入新版本时移除；
+数据库中的 JSON 文本（匹配结果）的键为 (名称, 文本哈希, 长度)。
+缓存的文档为共享对象，调用方不得修改。
+"""
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+# 文件内容缓存上限（默认 64MB）
+FILE_CACHE_MB = int(os.environ.get("KY_FILE_CACHE_MB", "64"))
+# 解析后文档缓存上限（默认 128MB），按文件大小乘以 JSON_OBJECT_FACTOR 估算占用
+DOCUMENT_CACHE_MB = int(os.environ.get("KY_DOCUMENT_CACHE_MB", "128"))
+# JSON 解析为 Python 对象后相对文本大小的膨胀倍数（估算值）
+JSON_OBJECT_FACTOR = 4
+
+
+class ByteLRUCache:
+    """按字节数限制的 LRU；单个条目超过上限的不缓存"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # 键 -> (值, 字节数)
+        self._path_keys = {}  # 路径 -> 当前缓存的键
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: tuple):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple, value, size: int):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            # 同一路径的旧版本（文件已修改）直接移除
+            stale = self._path_keys.get(key[0])
+            if stale is not None and stale != key:
+                self._remove(stale)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size)
+            self._path_keys[key[0]] = key
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: tuple):
+        _, size = self._entries.pop(key)
+        self.current_bytes -= size
+        if self._path_keys.get(key[0]) == key:
+            del self._path_keys[key[0]]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._path_keys.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+            }
+
+
+content_cache = ByteLRUCache(FILE_CACHE_MB * 1024 * 1024)
+document_cache = ByteLRUCache(DOCUMENT_CACHE_MB * 1024 * 1024)
+
+
+def _file_key(path: str) -> tuple:
+    """(路径, 修改时间, 大小)，文件不存在时抛出 OSError"""
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_mtime_ns, st.st_size
+
+
+def read_text(path: str) -> str:
+    """读取文本文件（UTF-8），命中缓存时不读磁盘"""
+    key = _file_key(path)
+    content = content_cache.get(key)
+    if content is None:
+        with open(path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        content_cache.put(key, content, sys.getsizeof(content))
+    return content
+
+
+def load_json(path: str):
+    """读取并解析 JSON 文件，命中缓存时不读磁盘也不解析；返回的对象为共享对象，不得修改"""
+    key = _file_key(path)
+    document = document_cache.get(key)
+    if document is None:
+        with open(path, 'r', encoding='utf-8') as f:
+            document = json.load(f)
+        document_cache.put(key, document, key[2] * JSON_OBJECT_FACTOR)
+    return document
+
+
+def loads_json(name: str, text: str):
+    """
+    解析数据库中保存的 JSON 文本（如匹配结果），按 (名称, 文本哈希, 长度) 缓存解析结果；
+    文本变化后键随之变化。返回的对象为共享对象，不得修改
+    """
+    key = (name, hash(text), len(text))
+    document = document_cache.get(key)
+    if document is None:
+        document = json.loads(text)
+        document_cache.put(key, document, len(text) * JSON_OBJECT_FACTOR)
+    return document
+
+
+def cache_stats() -> dict:
+    return {"content": content_cache.stats(), "documents": document_cache.stats()}
@@ -1,18 +1,11 @@
 import os
 import re
 
-def clean_config_file(file_path, keep_bang_blocks=True, output_path=None):
+def clean_config_lines(lines, keep_bang_blocks=True):
     """
-    清理配置文件：
-    - 去掉空行、注释行(#, *)；
-    - 移除行首被[]包裹的内容（如[任意内容]）；
-    - 按需保留或移除 '!'；
-    - 支持另存或原地覆盖。
+    按行清理配置内容（不涉及文件读写），规则同 clean_config_file。
+    返回清理后的行列表（保留行尾换行符）。
     """
-
-    with open(file_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-
     cleaned_lines = []
     # 匹配行首的[任意内容]（非贪婪匹配，避免跨越多行）
     bracket_pattern = r'^\[.*?\]'  # ^表示行首，\[匹配[，.*?匹配任意内容（非贪婪），\]匹配]
@@ -43,6 +36,23 @@ def clean_config_file(file_path, keep_bang_blocks=True, output_path=None):
         else:
             cleaned_lines.append(line)
 
+    return cleaned_lines
+
+
+def clean_config_file(file_path, keep_bang_blocks=True, output_path=None):
+    """
+    清理配置文件：
+    - 去掉空行、注释行(#, *)；
+    - 移除行首被[]包裹的内容（如[任意内容]）；
+    - 按需保留或移除 '!'；
+    - 支持另存或原地覆盖。
+    """
+
+    with open(file_path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+
+    cleaned_lines = clean_config_lines(lines, keep_bang_blocks=keep_bang_blocks)
+
     # 输出文件路径处理
     if not output_path:
         suffix = os.path.splitext(file_path)[1]
@@ -298,41 +298,167 @@ def parse_paloalto(lines):
 
 
 # ------------------ 通用入口 ------------------
-def parse_config_file(file_path):
-    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-        lines = [line.rstrip() for line in f if line.strip()]
+def parse_config_lines(raw_lines):
+    """解析已读入内存的配置行（自动识别厂商），返回结构同 parse_config_file"""
+    lines = [line.rstrip() for line in raw_lines if line.strip()]
 
     vendor = detect_vendor(lines)
+    result = parse_vendor_lines(lines, vendor)
+    result["vendor"] = vendor
+    return result
+
+
+def parse_config_file(file_path):
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        return parse_config_lines(f)
+
+
+# ------------------ 大文件分块 ------------------
+# 各厂商解析器在以下位置的状态可以完全由当前行决定（与之前的内容无关），
+# 在这些位置切分后分别解析再按顺序合并，结果与整体解析一致。
+# 大小写规则与 parse_cisco 一致：interface / mpls 区分大小写，router / vrf 不区分
+_CISCO_BLOCK_START = re.compile(r"^(?:interface\s+\S+|mpls\s+|(?i:router\s+(?:ospf|bgp)\b|(?:ip vrf|address-family)\b))")
+_JUNIPER_INTF = re.compile(r"(\S+)\s*{")
+
+
+def _is_juniper_block_start(line):
+    # 与 parse_juniper 的判断顺序保持一致：version / host-name 行先被处理
+    if line.startswith("version") or "host-name" in line:
+        return False
+    m_intf = _JUNIPER_INTF.match(line)
+    if m_intf and m_intf.group(1).startswith(("ge-", "lo", "xe", "et")):
+        return True
+    return line.startswith(("autonomous-system", "area", "address-family"))
+
+
+def iter_block_boundaries(lines, vendor):
+    """
+    返回可安全切分的行下标（切分点之前的行属于上一块）
+    - cisco: "!"/"end" 之后，或 interface/router/mpls/vrf 等区块起始行
+    - fortinet: "config ..." 行
+    - juniper: 接口/BGP/OSPF/address-family 区块起始行
+    - paloalto: 大括号深度为 0 处的区块起始行
+    - checkpoint / unknown: 逐行无状态，任意行
+    """
+    depth = 0
+    prev = None
+    for idx, raw in enumerate(lines):
+        line = clean_line(raw)
+        if not line:
+            continue
+        if idx:
+            if vendor == "cisco":
+                if prev in ("!", "end") or _CISCO_BLOCK_START.match(line):
+                    yield idx
+            elif vendor == "fortinet":
+                if line.startswith("config "):
+                    yield idx
+            elif vendor == "juniper":
+                if _is_juniper_block_start(line):
+                    yield idx
+            elif vendor == "paloalto":
+                if depth == 0 and line.endswith("{") and "hostname" not in line:
+                    yield idx
+            else:
+                yield idx
+        if vendor == "paloalto" and "hostname" not in line:
+            if line.endswith("{"):
+                depth += 1
+            elif line == "}" and depth:
+                depth -= 1
+        prev = line
+
+
+def split_config_chunks(lines, vendor, max_chunks):
+    """
+    按安全边界将行列表切分为不超过 max_chunks 个大致等长的块
+    :return: [(起始下标, 结束下标), ...]，依次覆盖全部行
+    """
+    if max_chunks <= 1 or not lines:
+        return [(0, len(lines))]
+    target = max(1, len(lines) // max_chunks)
+    chunks = []
+    start = 0
+    for boundary in iter_block_boundaries(lines, vendor):
+        if boundary - start >= target:
+            chunks.append((start, boundary))
+            start = boundary
+    chunks.append((start, len(lines)))
+    return chunks
+
+
+def parse_vendor_lines(lines, vendor):
+    """按已知厂商解析（lines 已去除空行）"""
     if vendor == "cisco":
-        result = parse_cisco(lines)
+        return parse_cisco(lines)
     elif vendor == "fortinet":
-        result = parse_fortinet(lines)
+        return parse_fortinet(lines)
     elif vendor == "checkpoint":
-        result = parse_checkpoint(lines)
+        return parse_checkpoint(lines)
     elif vendor == "juniper":
-        result = parse_juniper(lines)
+        return parse_juniper(lines)
     elif vendor == "paloalto":
-        result = parse_paloalto(lines)
-    else:
-        result = {"unknown_format": True, "global": lines}
-
+        return parse_paloalto(lines)
+    return {"unknown_format": True, "global": list(lines)}
+
+
+def detect_hostname(lines, vendor):
+    """只解析包含主机名的行，快速得到主机名（与完整解析的 hostname 一致）"""
+    host_lines = [line for line in lines if "host" in line]
+    if not host_lines or vendor not in ("cisco", "fortinet", "checkpoint", "juniper", "paloalto"):
+        return None
+    try:
+        return parse_vendor_lines(host_lines, vendor).get("hostname")
+    except Exception:
+        return None
+
+
+def merge_parsed_parts(parts, vendor):
+    """
+    按顺序合并各分块的解析结果：列表拼接，标量以后出现的为准，
+    键的顺序与整体解析时首次出现的顺序一致
+    """
+    result = {}
+    for part in parts:
+        for key, value in part.items():
+            if key == "vendor":
+                continue
+            if isinstance(value, list) and isinstance(result.get(key), list):
+                result[key].extend(value)
+            elif isinstance(value, list):
+                result[key] = list(value)
+            else:
+                result[key] = value
     result["vendor"] = vendor
     return result
 
 
 def parse_multiple_configs(folder_path, output_json="configs_summary.json"):
-    results = {}
-    for root, _, files in os.walk(folder_path):
-        for f in files:
-            if f.endswith((".cfg", ".conf", ".txt")):
-                path = os.path.join(root, f)
-                try:
-                    data = parse_config_file(path)
-                    results[f] = data
-                except Exception as e:
-                    print(f"解析 {f} 失败: {e}")
-
+    """
+    解析目录下所有配置文件，逐个写入 output_json（格式不变）。
+    每个文件解析完即写出，不在内存中累积全部结果。
+    不同子目录中的同名文件只保留先遍历到的一个（结果以文件名为键，不能重复）。
+    """
+    count = 0
+    seen = set()
     with open(output_json, "w", encoding="utf-8") as out:
-        json.dump(results, out, indent=4, ensure_ascii=False)
+        out.write("{")
+        for root, _, files in os.walk(folder_path):
+            for f in files:
+                if f.endswith((".cfg", ".conf", ".txt")):
+                    path = os.path.join(root, f)
+                    if f in seen:
+                        print(f"跳过同名文件 {path}")
+                        continue
+                    try:
+                        data = parse_config_file(path)
+                    except Exception as e:
+                        print(f"解析 {f} 失败: {e}")
+                        continue
+                    body = json.dumps(data, indent=4, ensure_ascii=False).replace("\n", "\n    ")
+                    out.write(("," if count else "") + "\n    " + json.dumps(f, ensure_ascii=False) + ": " + body)
+                    seen.add(f)
+                    count += 1
+        out.write("\n}\n" if count else "}\n")
 
     print(f"已完成解析，结果写入 {output_json}")
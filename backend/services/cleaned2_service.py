@@ -0,0 +1,114 @@
+"""
+二次清洗结果的存储格式
+
+sections 格式（.jsonl）：第一行为索引头，其后每行一个区块：
+    {"format": "sections-jsonl", "version": 1, "sections": {"interfaces": [偏移, 长度], ...}}
+    {"section": "global", "data": [...]}
+    {"section": "interfaces", "data": [...]}
+    ...
+索引中的偏移相对于索引头之后（第二行开头），指向该行 "data" 的值，因此读取单个区块只需
+读一行索引头再按字节范围读取，读到的字节本身就是该区块的 JSON，无需解析整个文件。
+旧的 .json 文件（整个解析结果为一个 JSON 文档）仍可读取。
+"""
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from .cache_service import load_json
+
+CLEANED2_FORMAT_SECTIONS = "sections-jsonl"
+CLEANED2_FORMAT_VERSION = 1
+# 二次清洗结果的存储格式：sections 为带区块索引的 JSON Lines，json 为单个 JSON 文档（旧格式）
+CLEANED2_FORMAT = os.environ.get("KY_CLEANED2_FORMAT", "sections")
+
+
+def cleaned2_extension() -> str:
+    return ".jsonl" if CLEANED2_FORMAT == "sections" else ".json"
+
+
+def write_cleaned2(path: str, parsed_data: dict):
+    """按 CLEANED2_FORMAT 写出二次清洗结果（先写临时文件再替换）"""
+    tmp_path = path + ".tmp"
+    if CLEANED2_FORMAT != "sections":
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(parsed_data, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return
+
+    lines = []
+    index = {}
+    offset = 0
+    for name, value in parsed_data.items():
+        prefix = ('{"section":' + json.dumps(name, ensure_ascii=False) + ',"data":').encode("utf-8")
+        data = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        index[name] = [offset + len(prefix), len(data)]
+        line = prefix + data + b"}\n"
+        lines.append(line)
+        offset += len(line)
+
+    header = {"format": CLEANED2_FORMAT_SECTIONS, "version": CLEANED2_FORMAT_VERSION, "sections": index}
+    with open(tmp_path, 'wb') as f:
+        f.write(json.dumps(header, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+        f.writelines(lines)
+    os.replace(tmp_path, path)
+
+
+def read_index(f) -> Optional[Tuple[int, Dict[str, List[int]]]]:
+    """读取索引头，返回 (数据起始位置, {区块: [偏移, 长度]})；不是 sections 格式时返回 None"""
+    f.seek(0)
+    first_line = f.readline()
+    try:
+        header = json.loads(first_line)
+    except ValueError:
+        return None
+    if not isinstance(header, dict) or header.get("format") != CLEANED2_FORMAT_SECTIONS:
+        return None
+    return len(first_line), header["sections"]
+
+
+def is_sections_file(path: str) -> bool:
+    with open(path, 'rb') as f:
+        return read_index(f) is not None
+
+
+def list_sections(path: str) -> Dict[str, int]:
+    """区块名 -> 该区块 JSON 的字节数（按文件中的顺序）"""
+    with open(path, 'rb') as f:
+        index = read_index(f)
+    if index is None:
+        return {name: len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+                for name, value in load_json(path).items()}
+    return {name: length for name, (_, length) in index[1].items()}
+
+
+def read_section_bytes(path: str, name: str) -> Optional[bytes]:
+    """读取单个区块的 JSON（字节），区块不存在时返回 None；sections 格式只读取该区块的字节范围"""
+    with open(path, 'rb') as f:
+        index = read_index(f)
+        if index is not None:
+            data_start, sections = index
+            if name not in sections:
+                return None
+            offset, length = sections[name]
+            f.seek(data_start + offset)
+            return f.read(length)
+
+    document = load_json(path)
+    if name not in document:
+        return None
+    return json.dumps(document[name], ensure_ascii=False).encode("utf-8")
+
+
+def read_document_bytes(path: str) -> bytes:
+    """完整的解析结果（单个 JSON 文档）；sections 格式由各区块的字节直接拼接，不解析"""
+    with open(path, 'rb') as f:
+        index = read_index(f)
+        if index is None:
+            f.seek(0)
+            return f.read()
+        data_start, sections = index
+        parts = []
+        for name, (offset, length) in sections.items():
+            f.seek(data_start + offset)
+            parts.append(json.dumps(name, ensure_ascii=False).encode("utf-8") + b":" + f.read(length))
+    return b"{" + b",".join(parts) + b"}"
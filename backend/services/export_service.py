@@ -0,0 +1,137 @@
+"""
+批次导出：将批次各阶段的文件打包为 zip 或 tar.gz，边压缩边输出到 HTTP 响应
+
+zipfile / tarfile 只能向文件对象写入，因此由后台线程写归档，写入的数据按块放入有界队列，
+响应从队列中逐块取出发送；队列满时写线程等待，内存占用与批次大小无关，也不在磁盘上生成临时归档。
+客户端断开后写线程在下一次写入时退出。
+"""
+import fnmatch
+import io
+import os
+import queue
+import tarfile
+import threading
+import zipfile
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .. import crud
+
+EXPORT_STAGES = ("original", "cleaned_1", "cleaned_2", "match")
+EXPORT_FORMATS = {"zip": "application/zip", "tar.gz": "application/gzip"}
+# 输出块大小与队列中最多缓存的块数（内存上限约为二者之积）
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_QUEUE_CHUNKS = 16
+EXPORT_COMPRESS_LEVEL = 6
+
+
+class ExportCancelled(Exception):
+    """客户端已断开"""
+
+
+def collect_export_entries(db: Session, batch_id: int, stages: Optional[List[str]] = None,
+                           pattern: Optional[str] = None) -> List[Tuple[str, str]]:
+    """
+    批次中要导出的文件：[(磁盘路径, 归档内路径)]，归档内路径为 batch_<id>/<阶段>/<文件名>
+    :param stages: 只导出这些阶段（默认全部）
+    :param pattern: 只导出文件名匹配该通配符的文件（如 *.cfg*）
+    """
+    entries = []
+    seen = set()
+    for stage, path in crud.get_batch_file_paths(db, batch_id):
+        if stages and stage not in stages:
+            continue
+        name = os.path.basename(path)
+        if pattern and not fnmatch.fnmatch(name, pattern):
+            continue
+        # 同一文件可能被多条记录引用（如不同关键词组的匹配结果写入同一文件）
+        if path in seen or not os.path.isfile(path):
+            continue
+        seen.add(path)
+        entries.append((path, f"batch_{batch_id}/{stage}/{name}"))
+    return entries
+
+
+class _QueueWriter(io.RawIOBase):
+    """只写、不可定位的文件对象：写入的数据攒成块后放入队列"""
+
+    def __init__(self, chunks: queue.Queue, cancel: threading.Event):
+        super().__init__()
+        self._chunks = chunks
+        self._cancel = cancel
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= EXPORT_CHUNK_SIZE:
+            self._put(bytes(self._buffer[:EXPORT_CHUNK_SIZE]))
+            del self._buffer[:EXPORT_CHUNK_SIZE]
+        return len(data)
+
+    def flush_remaining(self):
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def _put(self, item):
+        while True:
+            if self._cancel.is_set():
+                raise ExportCancelled()
+            try:
+                self._chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+
+def _write_archive(entries, fmt: str, writer: _QueueWriter):
+    if fmt == "zip":
+        # 输出不可定位时 zipfile 自动使用数据描述符，逐个文件流式压缩
+        with zipfile.ZipFile(writer, mode="w", compression=zipfile.ZIP_DEFLATED,
+                             compresslevel=EXPORT_COMPRESS_LEVEL) as archive:
+            for path, arcname in entries:
+                archive.write(path, arcname)
+    else:
+        with tarfile.open(fileobj=writer, mode="w|gz", compresslevel=EXPORT_COMPRESS_LEVEL) as archive:
+            for path, arcname in entries:
+                archive.add(path, arcname=arcname, recursive=False)
+    writer.flush_remaining()
+
+
+def iter_archive(entries: List[Tuple[str, str]], fmt: str = "zip") -> Iterator[bytes]:
+    """逐块产出归档内容；生成器关闭（客户端断开）时通知写线程退出"""
+    chunks = queue.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+    cancel = threading.Event()
+    done = object()
+
+    def run():
+        writer = _QueueWriter(chunks, cancel)
+        try:
+            _write_archive(entries, fmt, writer)
+            writer._put(done)
+        except ExportCancelled:
+            pass
+        except Exception as e:
+            print(f"导出归档失败: {str(e)}")
+            try:
+                writer._put(e)
+            except ExportCancelled:
+                pass
+
+    thread = threading.Thread(target=run, name="batch-export", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = chunks.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        cancel.set()
+        thread.join(timeout=5)
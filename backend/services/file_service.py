@@ -1,33 +1,73 @@
+import glob
 import os
-import json
 import shutil
 from datetime import datetime
 from fastapi import UploadFile
 from sqlalchemy.orm import Session
-from .. import crud, schemas, models
-from .clean_1 import clean_multiple_configs
-from .clean_2 import parse_config_file  # 导入二次清洗函数
-from .keyword_service import perform_keyword_check
+from .. import crud, schemas
+from .admission_service import ADMISSION_MAX_QUEUE, AdmissionRejected, admission
+from .cache_service import read_text
+from .clean_1 import clean_config_file
+from .cleaned2_service import cleaned2_extension, write_cleaned2
+from .keyword_service import hash_file_content
+from .parallel_service import is_large_file
+from .snapshot_service import snapshot_config_file
 
 # 确保上传目录存在
 UPLOAD_BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../static/uploads")
 os.makedirs(UPLOAD_BASE_DIR, exist_ok=True)
 
-async def process_uploaded_files(files: list[UploadFile], description: str, db: Session, keyword_set_id: int):
+def process_uploaded_files(files: list[UploadFile], description: str, db: Session, keyword_set_id: int):
+    """
+    保存上传文件并创建批次任务（清洗、二次清洗、关键词检测由任务分阶段执行，见 task_service）
+    inline 模式下由当前进程直接持有并执行该任务；external 模式下只入队，由 ky-match worker 进程领取
+    处理队列已满时抛出 AdmissionRejected，不保存文件
+    """
+    check_processing_capacity(db)
+    batch = save_uploaded_files(files, description, db)
+    return start_batch_processing(db, batch, keyword_set_id)
+
+def check_processing_capacity(db: Session):
+    """处理队列已满时抛出 AdmissionRejected（inline 模式看准入排队，external 模式看待执行的任务数）"""
+    from .task_service import WORKER_MODE
+
+    if WORKER_MODE == "inline":
+        admission.check_capacity()
+    elif crud.count_batch_tasks(db, "pending") >= ADMISSION_MAX_QUEUE:
+        raise AdmissionRejected(admission.retry_after())
+
+def start_batch_processing(db: Session, batch, keyword_set_id: int):
+    """为原始文件已登记的批次创建任务；inline 模式下在当前进程中执行完毕后返回"""
+    from .task_service import WORKER_MODE, create_task, run_batch_task, worker_id
+
+    owner = worker_id() if WORKER_MODE == "inline" else None
+    task = create_task(db, batch.id, keyword_set_id, owner=owner)
+    if owner:
+        run_batch_task(db, task, owner)
+    db.refresh(batch)
+    return batch
+
+def create_batch_dir(batch_id: int) -> str:
+    """创建批次目录 batch_<ID>_<时间戳>（含 cleaned_1 子目录）"""
+    batch_timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    batch_dir = os.path.join(UPLOAD_BASE_DIR, f"batch_{batch_id}_{batch_timestamp}")
+    os.makedirs(os.path.join(batch_dir, "cleaned_1"), exist_ok=True)
+    return batch_dir
+
+def get_batch_dir(batch_id: int) -> str:
+    """批次目录（不存在时创建）；原始文件不一定在批次目录下（如监视目录导入的文件）"""
+    existing = sorted(glob.glob(os.path.join(UPLOAD_BASE_DIR, f"batch_{batch_id}_*")))
+    return existing[0] if existing else create_batch_dir(batch_id)
+
+def save_uploaded_files(files: list[UploadFile], description: str, db: Session):
     # 创建新批次
     batch = crud.create_batch(db, schemas.BatchCreate(description=description))
 
     # 创建批次目录
-    batch_timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    batch_dir = os.path.join(UPLOAD_BASE_DIR, f"batch_{batch.id}_{batch_timestamp}")
+    batch_dir = create_batch_dir(batch.id)
     original_dir = os.path.join(batch_dir, "original")
-    cleaned1_dir = os.path.join(batch_dir, "cleaned_1")
-
     os.makedirs(original_dir, exist_ok=True)
-    os.makedirs(cleaned1_dir, exist_ok=True)
 
-    original_file_paths = []
-    batch_id = batch.id
     # 保存原始文件
     for file in files:
         file_path = os.path.join(original_dir, file.filename)
@@ -38,69 +78,61 @@ async def process_uploaded_files(files: list[UploadFile], description: str, db:
         crud.create_original_file(db, schemas.OriginalFileCreate(
             filename=file.filename,
             file_path=file_path,
-            batch_id=batch_id
+            batch_id=batch.id
         ))
+    return batch
 
-        original_file_paths.append(file_path)
-
-    # 执行初次清洗
-    clean_multiple_configs(original_file_paths, keep_bang_blocks=True)
+def perform_first_cleaning(batch_id: int, db: Session) -> list:
+    """
+    初次清洗：已有清洗记录的原始文件跳过，可重复执行（任务中断后续跑）
+    单个文件失败（不存在、无法解码等）时跳过该文件，不影响批次中的其他文件
+    :return: 跳过的文件及原因 ["文件名: 原因"]
+    """
+    original_files = [f for f in crud.get_original_files_by_batch(db, batch_id)
+                      if crud.get_cleaned_file_1_by_original(db, f.id) is None]
+    if not original_files:
+        return []
+
+    # 清洗结果直接写入批次目录的 cleaned_1（原始文件所在目录可能是只读的监视目录）
+    cleaned1_dir = os.path.join(get_batch_dir(batch_id), "cleaned_1")
+    os.makedirs(cleaned1_dir, exist_ok=True)
 
     # 保存清洗后的文件信息
-    for original_path in original_file_paths:
-        # 找到清洗后的文件
-        filename = os.path.basename(original_path)
-        name, ext = os.path.splitext(filename)
+    skipped = []
+    for original_file in original_files:
+        if not os.path.isfile(original_file.file_path):
+            print(f"cannot find file: {original_file.file_path}")
+            skipped.append(f"{original_file.filename}: 文件不存在")
+            continue
+        name, ext = os.path.splitext(original_file.filename)
         cleaned_filename = f"{name}{ext}_cleaned{ext}"
-        cleaned_path = os.path.join(original_dir, cleaned_filename)
-
-        # 如果清洗后的文件存在，移动到cleaned1_dir并更新数据库
-        if os.path.exists(cleaned_path):
-            new_cleaned_path = os.path.join(cleaned1_dir, cleaned_filename)
-            shutil.move(cleaned_path, new_cleaned_path)
-
-            # 获取原始文件ID
-            original_file = db.query(models.OriginalFile).filter(
-                models.OriginalFile.file_path == original_path
-            ).first()
-
-            # 创建清洗文件记录
-            crud.create_cleaned_file_1(db, schemas.CleanedFile1Create(
-                filename=cleaned_filename,
-                file_path=new_cleaned_path,
-                original_file_id=original_file.id,
-                batch_id=batch.id
-            ))
-
-    # 步骤2：执行二次清洗，
-    perform_second_cleaning(batch_id, db)
-
-    # 步骤3: 执行关键词检测
-
-
-    # 获取默认关键词组（或让用户提前选择，这里简化为取ID=1的组）
-    # default_keyword_set = crud.get_default_keyword_set(db)  # 需实现：获取默认关键词组
-    # if not default_keyword_set:
-    #     raise ValueError("无可用关键词组，请先创建关键词组")
-    # import pdb;pdb.set_trace()
-    # 执行关键词检测（基于clean_1的结果）
-    keyword_results = perform_keyword_check(
-        db=db,
-        batch_id=batch_id,
-        # 传入clean_1文件的ID列表（替代原clean_2的file_ids）
-        # file_ids=[f.id for f in original_file_paths],
-        keyword_set_id=keyword_set_id
-    )
-
-    # 更新批次状态为“已完成”
-    crud.update_batch_status(db, batch_id=batch_id, status="completed")
-    return batch
+        cleaned_path = os.path.join(cleaned1_dir, cleaned_filename)
+        try:
+            clean_config_file(original_file.file_path, keep_bang_blocks=True, output_path=cleaned_path)
+        except Exception as e:
+            print(f"初次清洗文件 {original_file.filename} 失败: {str(e)}")
+            skipped.append(f"{original_file.filename}: {str(e)}")
+            continue
+
+        # 创建清洗文件记录
+        crud.create_cleaned_file_1(db, schemas.CleanedFile1Create(
+            filename=cleaned_filename,
+            file_path=cleaned_path,
+            original_file_id=original_file.id,
+            batch_id=batch_id,
+            content_hash=hash_file_content(cleaned_path)
+        ))
+    return skipped
 
-def perform_second_cleaning(batch_id: int, db: Session):
+def perform_second_cleaning(batch_id: int, db: Session) -> list:
+    """
+    二次清洗：单个文件失败时跳过该文件，不影响批次中的其他文件
+    :return: 跳过的文件及原因 ["文件名: 原因"]
+    """
     # 获取批次的初次清洗文件
     cleaned1_files = crud.get_cleaned_files_1_by_batch(db, batch_id)
     if not cleaned1_files:
-        return
+        return []
 
     # 创建二次清洗目录
     batch = crud.get_batch(db, batch_id)
@@ -111,22 +143,33 @@ def perform_second_cleaning(batch_id: int, db: Session):
     os.makedirs(match_dir, exist_ok=True)
 
     # 执行二次清洗（使用新提供的代码）
+    skipped = []
     for file in cleaned1_files:
         try:
-            # 调用二次清洗函数解析配置文件
-            parsed_data = parse_config_file(file.file_path)
+            # 调用二次清洗函数解析配置文件：与同一设备上一批次的快照比对，只解析变化的区块
+            # （超大文件的变化区块并行解析）
+            if not file.content_hash:
+                file.content_hash = hash_file_content(file.file_path)
+                db.commit()
+            parsed_data = snapshot_config_file(db, file, batch_id, parallel=is_large_file(file.file_path))
 
             # 生成二次清洗后的文件名
             filename = os.path.basename(file.file_path)
             name, ext = os.path.splitext(filename)
-            cleaned2_filename = f"{name}_cleaned2.json"  # 保存为JSON格式
+            cleaned2_filename = f"{name}_cleaned2{cleaned2_extension()}"
             cleaned2_path = os.path.join(cleaned2_dir, cleaned2_filename)
 
-            # 写入JSON格式的清洗结果
-            with open(cleaned2_path, 'w', encoding='utf-8') as f:
-                json.dump(parsed_data, f, indent=4, ensure_ascii=False)
-
-            # 保存到数据库
+            # 写入清洗结果（默认为带区块索引的 JSON Lines，可按区块读取，见 cleaned2_service）
+            write_cleaned2(cleaned2_path, parsed_data)
+
+            # 保存到数据库（重复执行时更新已有记录）
+            existing = crud.get_cleaned_file_2_by_cleaned_file_1(db, file.id)
+            if existing:
+                existing.filename = cleaned2_filename
+                existing.file_path = cleaned2_path
+                existing.cleaned_time = datetime.utcnow()
+                db.commit()
+                continue
             crud.create_cleaned_file_2(db, schemas.CleanedFile2Create(
                 filename=cleaned2_filename,
                 file_path=cleaned2_path,
@@ -134,11 +177,14 @@ def perform_second_cleaning(batch_id: int, db: Session):
                 batch_id=batch_id
             ))
         except Exception as e:
+            db.rollback()
             print(f"二次清洗文件 {file.filename} 失败: {str(e)}")
+            skipped.append(f"{file.filename}: {str(e)}")
+    return skipped
 
 def get_file_content(file_path: str) -> str:
+    """读取文件内容（按 路径+修改时间+大小 缓存，见 cache_service）"""
     if not os.path.exists(file_path):
         return "File not found"
 
-    with open(file_path, 'r', encoding='utf-8') as f:
-        return f.read()
\ No newline at end of file
+    return read_text(file_path)
\ No newline at end of file
@@ -0,0 +1,233 @@
+"""
+批次内的临时正则搜索（grep）
+
+不需要为一次性的问题建关键词组：对批次某一阶段的文件逐行执行正则，由多个工作进程按文件并行扫描，
+每扫完一个文件即把该文件的命中交给调用方（接口以 NDJSON 逐行返回）。
+正则中必然出现的字面量（见 keyword_service.extract_required_literals）用作预过滤：
+文件中不含该字面量时整个文件跳过，行中不含时不执行正则。
+总耗时和命中数有上限。工作进程池（spawn 方式启动）在搜索之间复用，每个同时进行的搜索独占一个池；
+超时、达到命中上限或客户端断开时仍有文件未完成的，直接终止该池的进程（灾难性回溯的正则在单行内
+不会返回，只能终止进程），下次搜索时重新创建。
+"""
+import asyncio
+import atexit
+import multiprocessing
+import os
+import re
+import threading
+import time
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from .keyword_service import MIN_PREFILTER_LITERAL, extract_required_literals
+from .parallel_service import PARALLEL_WORKERS
+
+GREP_STAGES = ("original", "cleaned_1")
+# 搜索进程数（默认不超过 4，避免一次搜索占满 CPU）
+GREP_WORKERS = int(os.environ.get("KY_GREP_WORKERS", "0")) or min(PARALLEL_WORKERS, 4)
+# 同时进行的搜索数，超过时接口返回 429
+GREP_MAX_CONCURRENT = int(os.environ.get("KY_GREP_MAX_CONCURRENT", "2"))
+# 单次搜索的总耗时（秒）和命中数上限
+GREP_TIMEOUT = float(os.environ.get("KY_GREP_TIMEOUT", "30"))
+GREP_MAX_RESULTS = int(os.environ.get("KY_GREP_MAX_RESULTS", "10000"))
+# 返回的行内容最长字符数
+GREP_MAX_LINE_LENGTH = 1000
+# 工作进程每扫描多少行检查一次是否超时
+CANCEL_CHECK_LINES = 10000
+# 等待工作进程结果时检查客户端连接的间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
+_slots = threading.BoundedSemaphore(GREP_MAX_CONCURRENT)
+_active = 0
+# 空闲的工作进程池（最多 GREP_MAX_CONCURRENT 个）
+_idle_pools = []
+_pools_lock = threading.Lock()
+
+
+class GrepPatternError(ValueError):
+    """正则语法错误"""
+
+
+class GrepBusy(Exception):
+    """同时进行的搜索已达上限"""
+
+
+def grep_busy() -> bool:
+    """同时进行的搜索是否已达上限（接口在开始返回结果前检查）"""
+    return _active >= GREP_MAX_CONCURRENT
+
+
+def compile_grep_pattern(pattern: str, ignore_case: bool = False) -> Tuple[re.Pattern, Optional[str]]:
+    """编译正则，返回 (正则, 预过滤字面量)；预过滤字面量为最长的必需字面量（小写），没有合适的为 None"""
+    try:
+        regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+        literals = extract_required_literals(pattern)
+    except re.error as e:
+        raise GrepPatternError(f"正则语法错误: {e}")
+    literals = [lit for lit in literals if len(lit.strip()) >= MIN_PREFILTER_LITERAL]
+    return regex, max(literals, key=len) if literals else None
+
+
+def _acquire_pool():
+    with _pools_lock:
+        if _idle_pools:
+            return _idle_pools.pop()
+    return multiprocessing.get_context("spawn").Pool(GREP_WORKERS)
+
+
+def _release_pool(pool, finished: bool):
+    """全部文件已完成的池放回复用；仍有文件在扫描的池终止其进程"""
+    if finished:
+        with _pools_lock:
+            _idle_pools.append(pool)
+        return
+    pool.terminate()
+
+
+@atexit.register
+def shutdown_grep_pools():
+    with _pools_lock:
+        pools = list(_idle_pools)
+        _idle_pools.clear()
+    for pool in pools:
+        pool.terminate()
+
+
+def _submit(pool, loop, args) -> asyncio.Future:
+    """提交到工作进程池，返回当前事件循环中的 Future（结果由池的回调线程转交）"""
+    future = loop.create_future()
+
+    def _resolve(setter, value):
+        if not future.done():
+            setter(value)
+
+    def _callback(setter):
+        def callback(value):
+            try:
+                loop.call_soon_threadsafe(_resolve, setter, value)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+        return callback
+
+    pool.apply_async(grep_file, args, callback=_callback(future.set_result),
+                     error_callback=_callback(future.set_exception))
+    return future
+
+
+def grep_file(path: str, pattern: str, ignore_case: bool, literal: Optional[str], max_matches: int,
+              deadline: float) -> dict:
+    """
+    扫描单个文件（在工作进程中执行）
+    :return: {"matches": [[行号, 内容]], "skipped": 是否被预过滤跳过, "truncated": 是否因上限/超时未扫完, "error"}
+    """
+    result = {"matches": [], "skipped": False, "truncated": False}
+    try:
+        with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+            text = f.read()
+    except OSError as e:
+        result["error"] = str(e)
+        return result
+    # 预过滤按小写比较：忽略大小写时与正则一致，区分大小写时只会多放过、不会漏掉
+    if literal is not None and literal not in text.lower():
+        result["skipped"] = True
+        return result
+
+    regex = re.compile(pattern, re.IGNORECASE if ignore_case else 0)
+    matches = result["matches"]
+    for line_num, line in enumerate(text.splitlines(), start=1):
+        if line_num % CANCEL_CHECK_LINES == 0 and time.time() > deadline:
+            result["truncated"] = True
+            break
+        if literal is not None and literal not in line.lower():
+            continue
+        if regex.search(line):
+            matches.append([line_num, line[:GREP_MAX_LINE_LENGTH]])
+            if len(matches) >= max_matches:
+                result["truncated"] = True
+                break
+    return result
+
+
+async def stream_grep(files: List[Tuple[str, str]], pattern: str, ignore_case: bool = False,
+                      max_results: int = None, timeout: float = None,
+                      is_disconnected: Callable[[], Awaitable[bool]] = None) -> AsyncIterator[dict]:
+    """
+    并行扫描文件，按完成顺序逐条产出：
+        {"type": "match", "stage", "file", "line", "content"}
+        {"type": "error", "stage", "file", "error"}
+    最后产出 {"type": "summary", ...}（客户端断开时不产出）
+    :param files: [(阶段, 路径)]
+    :param is_disconnected: 检查客户端是否已断开
+    :raises GrepBusy: 同时进行的搜索已达上限
+    """
+    global _active
+    if not _slots.acquire(blocking=False):
+        raise GrepBusy("同时进行的搜索过多，请稍后重试")
+    _active += 1
+    try:
+        async for record in _stream_grep(files, pattern, ignore_case, max_results, timeout, is_disconnected):
+            yield record
+    finally:
+        _active -= 1
+        _slots.release()
+
+
+async def _stream_grep(files, pattern, ignore_case, max_results, timeout, is_disconnected):
+    max_results = min(max_results or GREP_MAX_RESULTS, GREP_MAX_RESULTS)
+    timeout = min(timeout or GREP_TIMEOUT, GREP_TIMEOUT)
+    _, literal = compile_grep_pattern(pattern, ignore_case)
+
+    started = time.monotonic()
+    deadline = time.time() + timeout
+    summary = {"type": "summary", "files": len(files), "scanned": 0, "skipped": 0, "matches": 0,
+               "truncated": False, "timed_out": False, "prefilter": literal}
+    if not files:
+        summary["elapsed"] = 0.0
+        yield summary
+        return
+
+    loop = asyncio.get_running_loop()
+    pool = _acquire_pool()
+    pending = {}
+    for stage, path in files:
+        future = _submit(pool, loop, (path, pattern, ignore_case, literal, max_results, deadline))
+        pending[future] = (stage, path)
+    disconnected = False
+    try:
+        while pending:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                summary["timed_out"] = summary["truncated"] = True
+                break
+            done, _ = await asyncio.wait(pending, timeout=min(remaining, DISCONNECT_POLL_INTERVAL),
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if is_disconnected is not None and await is_disconnected():
+                disconnected = True
+                break
+            for future in done:
+                stage, path = pending.pop(future)
+                result = future.result()
+                name = os.path.basename(path)
+                if "error" in result:
+                    yield {"type": "error", "stage": stage, "file": name, "error": result["error"]}
+                    continue
+                summary["skipped" if result["skipped"] else "scanned"] += 1
+                if result["truncated"]:
+                    summary["truncated"] = True
+                for line_num, content in result["matches"][:max_results - summary["matches"]]:
+                    summary["matches"] += 1
+                    yield {"type": "match", "stage": stage, "file": name, "line": line_num, "content": content}
+                if summary["matches"] >= max_results:
+                    summary["truncated"] = True
+                    break
+            if summary["matches"] >= max_results:
+                break
+    finally:
+        # 仍有文件未完成（超时、达到命中上限、客户端断开）时终止进程，不等待其扫完
+        for future in pending:
+            future.cancel()
+        _release_pool(pool, finished=not pending)
+
+    if not disconnected:
+        summary["elapsed"] = round(time.monotonic() - started, 3)
+        yield summary
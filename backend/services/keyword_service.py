@@ -1,18 +1,198 @@
+import hashlib
+import heapq
 import json
-from typing import List, Tuple, Dict
+import os
+import threading
+from collections import OrderedDict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Optional
 import ahocorasick
+import bisect
 import re
+try:
+    # 正则语法树只用于提取预过滤字面量；re 的内部模块不可用时关闭预过滤（正则逐行执行，结果不变）
+    from re import _parser as sre_parser, _constants as sre_constants
+except ImportError:
+    sre_parser = sre_constants = None
 from sqlalchemy.orm import Session
 from .. import models, schemas, crud
+from ..database import SessionLocal
+from .clean_2 import detect_vendor
+
+
+# 匹配器版本：匹配逻辑或结果结构变化时递增，使已缓存的匹配结果失效
+# 2: 访问控制列表（access-list / ip access-list）单独成区块
+MATCHER_VERSION = 2
+
+# 匹配结果的存储格式：columnar 为按行合并的列式格式（见 compact_match_data），legacy 为逐条命中的旧格式
+MATCH_FORMAT_COLUMNAR = "columnar"
+MATCH_RESULT_FORMAT = os.environ.get("KY_MATCH_RESULT_FORMAT", MATCH_FORMAT_COLUMNAR)
+
+# 以该前缀开头的关键词按正则处理，如 "re:snmp-server community \S+ RW"
+REGEX_PREFIX = "re:"
+# 用作预过滤的字面量最短长度，过短的字面量几乎每行都会命中，不如直接跑正则
+MIN_PREFILTER_LITERAL = 3
+
+
+def _collect_literal_runs(items, runs: List[str]):
+    """遍历正则语法树，收集必然出现的连续字面量片段"""
+    # 3.11 起才有的节点类型，旧版本中不存在时视为普通节点跳过
+    atomic_group = getattr(sre_constants, "ATOMIC_GROUP", None)
+    repeats = tuple(op for op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+                                  getattr(sre_constants, "POSSESSIVE_REPEAT", None)) if op is not None)
+    current = []
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            current.append(chr(av))
+            continue
+        if op is sre_constants.AT:
+            # 零宽断言（^ $ \b）不占字符，不打断字面量
+            continue
+        if current:
+            runs.append("".join(current))
+            current = []
+        if op is sre_constants.SUBPATTERN:
+            _collect_literal_runs(av[-1], runs)
+        elif atomic_group is not None and op is atomic_group:
+            _collect_literal_runs(av, runs)
+        elif op in repeats and av[0] >= 1:
+            # 至少出现一次的重复，内部字面量也是必需的
+            _collect_literal_runs(av[2], runs)
+        # 分支、字符集、可选重复等：无法确定必需字面量，跳过
+    if current:
+        runs.append("".join(current))
+
+
+def extract_required_literals(pattern: str) -> List[str]:
+    """
+    提取正则匹配时必然出现的字面量（小写），用于 Aho-Corasick 预过滤
+    语法树不可用或解析失败时返回空列表（不做预过滤）；正则语法由调用方 re.compile 校验
+    """
+    if sre_parser is None:
+        return []
+    runs: List[str] = []
+    try:
+        _collect_literal_runs(sre_parser.parse(pattern), runs)
+    except Exception:
+        return []
+    return [run.lower() for run in runs if run]
+
+
+# 配置区块正则（适配网络设备配置）
+# 访问控制列表只在行首识别（避免 "match access-list ..." 之类的引用切断所在区块）：
+# 命名 ACL "ip access-list extended NAME"，编号/ASA ACL "access-list 101 ..." 每行一条
+SECTION_PATTERN = re.compile(
+    r'(?P<section>interface\s+\S+|router\s+\S+\s*\d*|ip\s+vrf\s+\S+|(?<![^\n])ip\s+access-list\s+\S+\s+\S+|'
+    r'(?<![^\n])access-list\s+\S+|line\s+\S+|redundancy|mpls\s+\S+|hostname)\s*'
+    r'(?P<content>.*?)(?=\n(interface|router|ip\s+vrf|ip\s+access-list|access-list|line|redundancy|mpls|hostname|$))',
+    re.DOTALL | re.IGNORECASE
+)
+# 区块的结束标记（即 SECTION_PATTERN 中的前瞻部分）
+SECTION_END_PATTERN = re.compile(r'\n(interface|router|ip\s+vrf|ip\s+access-list|access-list|line|redundancy|mpls|hostname)',
+                                 re.IGNORECASE)
+
+
+def _section_search_end(full_text: str) -> int:
+    """
+    区块匹配只可能在最后一个结束标记之前成功；之后的每个候选都会扫描到文本末尾再失败，
+    对 "set interface ..." 这类配置会退化为平方复杂度。返回可截止的位置（结果不变）。
+    """
+    if full_text.endswith('\n'):
+        return len(full_text)
+    end = 0
+    for match in SECTION_END_PATTERN.finditer(full_text):
+        end = match.end()
+    return end
+
+
+def normalize_scope(scope: str) -> str:
+    """区块作用域按名称前缀匹配（不区分大小写），"_" 视为空格，如 router_bgp 匹配 router bgp 65000"""
+    return scope.strip().lower().replace("_", " ")
+
+
+def parse_scopes(scopes) -> Optional[Tuple[str, ...]]:
+    """作用域列表或逗号分隔的字符串 -> 规范化的前缀元组，为空表示不限区块"""
+    if not scopes:
+        return None
+    if isinstance(scopes, str):
+        scopes = scopes.split(",")
+    prefixes = tuple(dict.fromkeys(normalize_scope(s) for s in scopes if s.strip()))
+    return prefixes or None
+
+
+class SectionScope:
+    """关键词组的区块作用域：哪些区块需要扫描，某个关键词在某区块的命中是否有效"""
+
+    def __init__(self, keywords, scopes=None, keyword_scopes: Dict[str, object] = None):
+        """
+        :param scopes: 关键词组级别的区块作用域（区块名前缀），为空表示全部区块
+        :param keyword_scopes: 单个关键词的作用域，优先于关键词组级别
+        """
+        self.scopes = parse_scopes(scopes)
+        self.keyword_scopes = {}
+        for word, word_scopes in (keyword_scopes or {}).items():
+            prefixes = parse_scopes(word_scopes)
+            if prefixes:
+                self.keyword_scopes[word] = prefixes
+        # 是否存在不限区块的关键词；否则只需扫描作用域内的区块
+        self.has_unscoped = self.scopes is None and any(w not in self.keyword_scopes for w in keywords)
+        self.scoped = not self.has_unscoped or bool(self.keyword_scopes)
+        self.scope_prefixes = tuple(dict.fromkeys(
+            (self.scopes or ()) + tuple(p for prefixes in self.keyword_scopes.values() for p in prefixes)))
+
+    def section_in_scope(self, section: str) -> bool:
+        """该区块是否可能有关键词命中（不在任何作用域内的区块无需扫描）"""
+        return self.has_unscoped or section.startswith(self.scope_prefixes)
+
+    def keyword_in_scope(self, keyword: str, section: str) -> bool:
+        prefixes = self.keyword_scopes.get(keyword, self.scopes)
+        return prefixes is None or section.startswith(prefixes)
 
 
 class ConfigKeywordMatcher:
-    def __init__(self, keywords):
+    def __init__(self, keywords, scopes=None, keyword_scopes: Dict[str, object] = None):
+        """
+        :param scopes: 关键词组级别的区块作用域（区块名前缀），为空表示全部区块
+        :param keyword_scopes: 单个关键词的作用域，优先于关键词组级别
+        """
+        self.keywords = [word for word in keywords if word.strip()]  # 供子进程重建匹配器
+        self.scope = SectionScope(self.keywords, scopes, keyword_scopes)
+        self.scoped = self.scope.scoped
         self.automaton = ahocorasick.Automaton()
-        self.keyword_map = {word.lower(): word for word in keywords if word.strip()}
-        for idx, word_lower in enumerate(self.keyword_map.keys()):
-            self.automaton.add_word(word_lower, (idx, word_lower))
-        self.automaton.make_automaton()
+        self.keyword_map = {}
+        self.regexes: List[Tuple[str, re.Pattern]] = []  # (原始关键词, 编译后的正则)
+        unfiltered = []  # 无可用字面量、需逐行执行的正则
+        literals: Dict[str, Tuple[bool, list]] = {}  # 小写字面量 -> (是否为关键词本身, 依赖它预过滤的正则)
+
+        for word in keywords:
+            if not word.strip():
+                continue
+            if word.startswith(REGEX_PREFIX):
+                pattern = word[len(REGEX_PREFIX):]
+                try:
+                    compiled = re.compile(pattern, re.IGNORECASE)
+                    required = [lit for lit in extract_required_literals(pattern) if len(lit.strip()) >= MIN_PREFILTER_LITERAL]
+                except re.error as e:
+                    raise ValueError(f"无效的正则关键词 {word!r}: {e}")
+                regex_id = len(self.regexes)
+                self.regexes.append((word, compiled))
+                if required:
+                    # 所有字面量都是必需的，取最长的一个作为预过滤条件即可
+                    literals.setdefault(max(required, key=len), (False, []))[1].append(regex_id)
+                else:
+                    unfiltered.append(regex_id)
+            else:
+                word_lower = word.lower()
+                self.keyword_map[word_lower] = word
+                literals[word_lower] = (True, literals.get(word_lower, (False, []))[1])
+
+        for word_lower, (is_keyword, regex_ids) in literals.items():
+            self.automaton.add_word(word_lower, (word_lower, is_keyword, tuple(regex_ids)))
+        self.has_literals = bool(literals)
+        if self.has_literals:
+            self.automaton.make_automaton()
+        self.unfiltered_regexes = tuple(unfiltered)
 
     def _is_full_word_match(self, line_lower: str, start_idx: int, end_idx: int) -> bool:
         """保持完整单词匹配逻辑"""
@@ -20,20 +200,26 @@ class ConfigKeywordMatcher:
         end_ok = (end_idx == len(line_lower) - 1) or (not line_lower[end_idx + 1].isalnum() and line_lower[end_idx + 1] != '_')
         return start_ok and end_ok
 
-    def search_in_lines(self, lines_with_original_numbers: List[Tuple[str, int]]) -> List[dict]:
+    def match_line(self, line_content: str) -> List[str]:
         """
-        在带原始行号的行列表中搜索关键词
-        :param lines_with_original_numbers: 元素为 (行内容, 原始行号) 的列表
-        :return: 包含原始行号的匹配结果
+        匹配单行，返回命中的关键词列表（按出现顺序，同一位置去重）
+        字面量关键词要求完整单词匹配；正则关键词仅在其预过滤字面量命中时执行
         """
-        matches = []
-        for line_content, original_line_num in lines_with_original_numbers:
-            line_lower = line_content.lower()
+        hits = []
+        line_lower = line_content.lower()
+        candidate_regexes = None
+
+        if self.has_literals:
             matched_positions = set()  # 去重：(关键词, 起始位置, 结束位置)
+            for end_idx, (word_lower, is_keyword, regex_ids) in self.automaton.iter(line_lower):
+                if regex_ids:
+                    if candidate_regexes is None:
+                        candidate_regexes = set()
+                    candidate_regexes.update(regex_ids)
+                if not is_keyword:
+                    continue
 
-            for end_idx, (_, word_lower) in self.automaton.iter(line_lower):
-                word_len = len(word_lower)
-                start_idx = end_idx - word_len + 1
+                start_idx = end_idx - len(word_lower) + 1
 
                 # 校验完整单词匹配
                 if not self._is_full_word_match(line_lower, start_idx, end_idx):
@@ -44,21 +230,45 @@ class ConfigKeywordMatcher:
                 if match_key in matched_positions:
                     continue
                 matched_positions.add(match_key)
+                hits.append(self.keyword_map[word_lower])
+
+        if candidate_regexes or self.unfiltered_regexes:
+            regex_ids = sorted(candidate_regexes.union(self.unfiltered_regexes)) if candidate_regexes else self.unfiltered_regexes
+            for regex_id in regex_ids:
+                word, compiled = self.regexes[regex_id]
+                for m in compiled.finditer(line_content):
+                    if m.end() > m.start():
+                        hits.append(word)
+        return hits
 
+    def search_in_lines(self, lines_with_original_numbers: List[Tuple[str, int]], memo: "LineMatchMemo" = None) -> List[dict]:
+        """
+        在带原始行号的行列表中搜索关键词
+        :param lines_with_original_numbers: 元素为 (行内容, 原始行号) 的列表
+        :param memo: 行级匹配缓存，相同内容的行只匹配一次
+        :return: 包含原始行号的匹配结果
+        """
+        match_line = memo.match_line if memo is not None else self.match_line
+        matches = []
+        for line_content, original_line_num in lines_with_original_numbers:
+            hits = match_line(line_content)
+            if not hits:
+                continue
+            content = line_content.strip()
+            for keyword in hits:
                 # 记录原始行号（核心修改）
                 matches.append({
                     "line": original_line_num,  # 使用原始文件的绝对行号
-                    "keyword": self.keyword_map[word_lower],
-                    "content": line_content.strip()
+                    "keyword": keyword,
+                    "content": content
                 })
         return matches
 
-    def search_config_data(self, raw_data: str, vendor: str = "unknown") -> dict:
+    @staticmethod
+    def build_sections(raw_data: str) -> Dict[str, List[Tuple[str, int]]]:
         """
-        从原始文本提取区块并匹配关键词，使用原始文件行号
-        :param raw_data: 原始配置文本
-        :param vendor: 设备厂商
-        :return: 包含原始行号的匹配结果
+        从原始文本提取配置区块，返回 区块名 -> [(行内容, 原始行号), ...]
+        未被任何区块覆盖的行归入 global
         """
         # 1. 预处理原始数据，保留每行的原始内容和绝对行号（核心步骤）
         raw_lines = raw_data.splitlines()  # 按换行分割，保留空行（确保行号准确）
@@ -68,14 +278,7 @@ class ConfigKeywordMatcher:
         full_text = '\n'.join(raw_lines)
         text_length = len(full_text)
 
-        # 2. 定义配置区块正则（适配网络设备配置）
-        section_pattern = re.compile(
-            r'(?P<section>interface\s+\S+|router\s+\S+\s*\d*|ip\s+vrf\s+\S+|line\s+\S+|redundancy|mpls\s+\S+|hostname)\s*'
-            r'(?P<content>.*?)(?=\n(interface|router|ip\s+vrf|line|redundancy|mpls|hostname|$))',
-            re.DOTALL | re.IGNORECASE
-        )
-
-        # 3. 计算每行在全文中的起始索引（用于定位区块对应的原始行）
+        # 2. 计算每行在全文中的起始索引（用于定位区块对应的原始行）
         line_start_indices = []
         current_pos = 0
         for line in raw_lines:
@@ -83,36 +286,34 @@ class ConfigKeywordMatcher:
             current_pos += len(line) + 1  # +1 是换行符的长度（\n）
         line_start_indices.append(text_length)  # 最后一行的结束位置
 
-        # 4. 提取区块并映射到原始行号
+        def line_of(pos):
+            # 二分查找包含该位置的行（行号从1开始）
+            idx = bisect.bisect_right(line_start_indices, pos) - 1
+            if 0 <= idx < len(raw_lines) and pos < line_start_indices[idx + 1]:
+                return idx + 1
+            return None
+
+        # 3. 提取区块并映射到原始行号
         sections = {}
-        # 提取区块内容和对应的原始行号范围
-        for match in section_pattern.finditer(full_text):
+        for match in SECTION_PATTERN.finditer(full_text, 0, _section_search_end(full_text)):
             section_name = match.group('section').strip().lower()
-            section_content = match.group('content').strip()
-            section_start = match.start()  # 区块在全文中的起始位置
-            section_end = match.end()      # 区块在全文中的结束位置
-
-            # 找到区块起始行（第一个包含区块起始位置的行）
-            start_line = None
-            for idx, pos in enumerate(line_start_indices):
-                if pos <= section_start < line_start_indices[idx + 1]:
-                    start_line = idx + 1  # 行号从1开始
-                    break
-
-            # 找到区块结束行（最后一个包含区块结束位置的行）
-            end_line = None
-            for idx, pos in enumerate(line_start_indices):
-                if pos <= section_end < line_start_indices[idx + 1]:
-                    end_line = idx + 1
-                    break
+            start_line = line_of(match.start())  # 区块起始行
+            end_line = line_of(match.end())      # 区块结束行
 
             # 提取区块内的行（带原始行号）
             if start_line is not None and end_line is not None:
                 # 截取 (行内容, 原始行号) 列表中属于当前区块的部分
                 section_lines = lines_with_numbers[start_line - 1:end_line]  # 切片是左闭右开
-                sections[section_name] = section_lines
+                if section_name.startswith('ip access-list'):
+                    # 命名 ACL 与编号 ACL 统一以 access-list 开头，作用域 access-list 可同时匹配
+                    section_name = section_name[len('ip '):]
+                if section_name.startswith('access-list') and section_name in sections:
+                    # 同一编号 ACL 的各条规则分布在多行（可能不相邻），合并为一个区块
+                    sections[section_name] = sections[section_name] + section_lines
+                else:
+                    sections[section_name] = section_lines
 
-        # 5. 提取全局配置（未被区块包含的行）
+        # 4. 提取全局配置（未被区块包含的行）
         covered_lines = set()
         for section_lines in sections.values():
             covered_lines.update([line_num for _, line_num in section_lines])
@@ -120,14 +321,29 @@ class ConfigKeywordMatcher:
         global_lines = [ln for ln in lines_with_numbers if ln[1] not in covered_lines]
         if global_lines:
             sections['global'] = global_lines
+        return sections
 
-        # 6. 对每个区块执行关键词匹配（使用原始行号）
+    def search_config_data(self, raw_data: str, vendor: str = "unknown", memo: "LineMatchMemo" = None) -> dict:
+        """
+        从原始文本提取区块并匹配关键词，使用原始文件行号
+        :param raw_data: 原始配置文本
+        :param vendor: 设备厂商
+        :param memo: 行级匹配缓存（可跨文件共享）
+        :return: 包含原始行号的匹配结果
+        """
+        sections = self.build_sections(raw_data)
+
+        # 对每个区块执行关键词匹配（使用原始行号）；设置了作用域时只扫描作用域内的区块
         section_matches = {}
         for section, lines in sections.items():
             if not lines:
                 continue
+            if self.scoped and not self.scope.section_in_scope(section):
+                continue
             # 调用匹配方法时传入带原始行号的行列表
-            matches = self.search_in_lines(lines)
+            matches = self.search_in_lines(lines, memo=memo)
+            if self.scoped:
+                matches = [m for m in matches if self.scope.keyword_in_scope(m["keyword"], section)]
             if matches:
                 section_matches[section] = matches
 
@@ -137,44 +353,306 @@ class ConfigKeywordMatcher:
         }
 
 
-def split_text_by_bytes_preserve_lines(text: str, max_bytes: int = 50*1024):
+def assemble_section_matches(sections: Dict[str, List[Tuple[str, int]]], line_hits: Dict[int, Tuple[str, ...]],
+                             vendor: str = "unknown", scope: SectionScope = None) -> dict:
+    """
+    由区块划分和逐行命中结果（绝对行号 -> 关键词）组装匹配结果，
+    结构与 ConfigKeywordMatcher.search_config_data 一致（传入 scope 时按区块作用域过滤）
+    """
+    scoped = scope is not None and scope.scoped
+    section_matches = {}
+    for section, lines in sections.items():
+        if scoped and not scope.section_in_scope(section):
+            continue
+        matches = [
+            {"line": line_num, "keyword": keyword, "content": line_content.strip()}
+            for line_content, line_num in lines
+            for keyword in line_hits.get(line_num, ())
+            if not scoped or scope.keyword_in_scope(keyword, section)
+        ]
+        if matches:
+            section_matches[section] = matches
+
+    return {
+        "vendor": vendor,
+        "matches": section_matches
+    }
+
+
+class LineMatchMemo:
+    """
+    行级匹配缓存：同一平台的设备配置大量重复（如 "no ip http server"），
+    以行内容为键，每个不同的行只做一次小写+自动机扫描，命中结果复用到所有出现位置。
+    结果只依赖行内容本身，因此可在一个批次的所有文件间共享。
+    """
+
+    def __init__(self, matcher: ConfigKeywordMatcher, max_entries: int = 200_000):
+        self.matcher = matcher
+        self.max_entries = max_entries
+        self._cache: Dict[str, Tuple[str, ...]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def match_line(self, line_content: str) -> Tuple[str, ...]:
+        cached = self._cache.get(line_content)
+        if cached is not None:
+            self.hits += 1
+            return cached
+        self.misses += 1
+        result = tuple(self.matcher.match_line(line_content))
+        # 达到上限后不再新增，已缓存的（通常是最常见的）行继续生效
+        if len(self._cache) < self.max_entries:
+            self._cache[line_content] = result
+        return result
+
+    def __len__(self):
+        return len(self._cache)
+
+
+# 已编译匹配器的缓存：(关键词组ID, 版本[, "severity", 最低严重程度]) -> ConfigKeywordMatcher
+# 关键词组变更时版本递增，同组旧版本的条目随之丢弃
+MATCHER_CACHE_SIZE = int(os.environ.get("KY_MATCHER_CACHE_SIZE", "4"))
+_matcher_cache: "OrderedDict[Tuple[int, int], ConfigKeywordMatcher]" = OrderedDict()
+_matcher_pending = {}
+_matcher_lock = threading.Lock()
+_compile_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="keyword-compile")
+
+
+def load_keyword_set_entries(db: Session, keyword_set_id: int):
+    """读取关键词组的 (关键词列表, 关键词组作用域, 单个关键词作用域)"""
+    keyword_set = crud.get_keyword_set(db, keyword_set_id)
+    keywords = []
+    keyword_scopes = {}
+    for value, scope in crud.iter_keyword_entries(db, keyword_set_id):
+        keywords.append(value)
+        if scope:
+            keyword_scopes[value] = scope
+    set_scopes = json.loads(keyword_set.scopes) if keyword_set and keyword_set.scopes else None
+    return keywords, set_scopes, keyword_scopes
+
+
+def _compile_matcher(keyword_set_id: int, version: int) -> ConfigKeywordMatcher:
+    key = (keyword_set_id, version)
+    try:
+        db = SessionLocal()
+        try:
+            keywords, set_scopes, keyword_scopes = load_keyword_set_entries(db, keyword_set_id)
+            # 读取关键词之后的版本：与请求的版本不同说明关键词组已再次更新，读到的不是该版本的关键词
+            keyword_set = crud.get_keyword_set(db, keyword_set_id)
+            current_version = (keyword_set.version or 1) if keyword_set else None
+        finally:
+            db.close()
+        matcher = ConfigKeywordMatcher(keywords, scopes=set_scopes, keyword_scopes=keyword_scopes)
+        with _matcher_lock:
+            # 较早版本的编译晚于新版本完成时不写入缓存，也不淘汰新版本的匹配器
+            newer = any(k[0] == keyword_set_id and k[1] > version for k in _matcher_cache)
+            if current_version == version and not newer:
+                for stale in [k for k in _matcher_cache if k[0] == keyword_set_id and k[1] < version]:
+                    del _matcher_cache[stale]
+                _matcher_cache[key] = matcher
+                while len(_matcher_cache) > MATCHER_CACHE_SIZE:
+                    _matcher_cache.popitem(last=False)
+        return matcher
+    finally:
+        with _matcher_lock:
+            _matcher_pending.pop(key, None)
+
+
+def schedule_matcher_compile(keyword_set_id: int, version: int):
+    """关键词组变更后在后台线程预编译自动机，请求本身不等待编译完成"""
+    key = (keyword_set_id, version or 1)
+    with _matcher_lock:
+        if key in _matcher_cache or key in _matcher_pending:
+            return
+        _matcher_pending[key] = _compile_executor.submit(_compile_matcher, *key)
+
+
+def get_keyword_matcher(keyword_set_id: int, version: int) -> ConfigKeywordMatcher:
+    """取已编译的匹配器；正在后台编译时等待其完成，否则当场编译"""
+    key = (keyword_set_id, version or 1)
+    with _matcher_lock:
+        matcher = _matcher_cache.get(key)
+        if matcher is not None:
+            _matcher_cache.move_to_end(key)
+            return matcher
+        future = _matcher_pending.get(key)
+    if future is not None:
+        return future.result()
+    return _compile_matcher(*key)
+
+
+class MultiSetMatcher:
     """
-    按字节长度切分文本，每组尽可能接近 max_bytes，
-    保留整行（不截断），包含换行符。
+    多个关键词组合并为一个自动机：每个命中的关键词带有其所属关键词组的标记，
+    每个文件只扫描一次，再按关键词组拆分结果（与逐组调用 search_config_data 一致）
     """
-    lines = text.splitlines(True)  # 保留换行符
-    chunks = []
-    current_chunk = ""
-    current_size = 0
 
+    def __init__(self, keyword_sets: Dict[int, tuple]):
+        """
+        :param keyword_sets: 关键词组ID -> (关键词列表, 关键词组作用域, 单个关键词作用域)
+        """
+        union = list(dict.fromkeys(
+            word for keywords, _, _ in keyword_sets.values() for word in keywords if word.strip()))
+        self.matcher = ConfigKeywordMatcher(union)
+        self.scopes: Dict[int, SectionScope] = {}
+        # 合并自动机返回的关键词 -> {关键词组ID: 该组中的原始写法}（字面量不区分大小写，组内后出现的写法为准）
+        self.tags: Dict[str, Dict[int, str]] = {}
+        # 各组正则关键词的先后顺序，用于还原组内命中顺序
+        self.regex_rank: Dict[int, Dict[str, int]] = {}
+        for set_id, (keywords, set_scopes, keyword_scopes) in keyword_sets.items():
+            keywords = [word for word in keywords if word.strip()]
+            self.scopes[set_id] = SectionScope(keywords, set_scopes, keyword_scopes)
+            rank = self.regex_rank[set_id] = {}
+            for word in keywords:
+                if word.startswith(REGEX_PREFIX):
+                    rank.setdefault(word, len(rank))
+                    tag = word
+                else:
+                    tag = self.matcher.keyword_map[word.lower()]
+                self.tags.setdefault(tag, {})[set_id] = word
+
+    def split_hits(self, hits) -> Dict[int, List[str]]:
+        """把一行的命中按关键词组拆分"""
+        per_set: Dict[int, List[str]] = {}
+        for tag in hits:
+            for set_id, word in self.tags[tag].items():
+                per_set.setdefault(set_id, []).append(word)
+        for set_id, words in per_set.items():
+            # 正则命中排在字面量之后；合并后的正则顺序可能与组内不同，按组内顺序重排
+            rank = self.regex_rank[set_id]
+            if len(rank) > 1 and words[-1].startswith(REGEX_PREFIX):
+                first = next(i for i, w in enumerate(words) if w.startswith(REGEX_PREFIX))
+                words[first:] = sorted(words[first:], key=rank.__getitem__)
+        return per_set
+
+    def search_config_data(self, raw_data: str, vendor: str = "unknown",
+                           memo: "LineMatchMemo" = None) -> Dict[int, dict]:
+        """
+        扫描一次，返回 关键词组ID -> 匹配结果（结构同 ConfigKeywordMatcher.search_config_data）
+        只扫描至少在一个关键词组作用域内的区块
+        """
+        sections = self.matcher.build_sections(raw_data)
+        match_line = memo.match_line if memo is not None else self.matcher.match_line
+        scopes = list(self.scopes.values())
+
+        line_hits = {set_id: {} for set_id in self.scopes}
+        scanned = set()
+        for section, lines in sections.items():
+            if not any(scope.section_in_scope(section) for scope in scopes):
+                continue
+            for line_content, line_num in lines:
+                if line_num in scanned:
+                    continue
+                scanned.add(line_num)
+                hits = match_line(line_content)
+                if hits:
+                    for set_id, words in self.split_hits(hits).items():
+                        line_hits[set_id][line_num] = words
+
+        return {
+            set_id: assemble_section_matches(sections, line_hits[set_id], vendor, scope=scope)
+            for set_id, scope in self.scopes.items()
+        }
+
+
+def get_multi_set_matcher(db: Session, keyword_sets) -> MultiSetMatcher:
+    """按 (关键词组ID, 版本) 组合缓存合并后的匹配器"""
+    key = ("multi",) + tuple(sorted((ks.id, ks.version or 1) for ks in keyword_sets))
+    with _matcher_lock:
+        matcher = _matcher_cache.get(key)
+        if matcher is not None:
+            _matcher_cache.move_to_end(key)
+            return matcher
+    matcher = MultiSetMatcher({ks.id: load_keyword_set_entries(db, ks.id) for ks in keyword_sets})
+    with _matcher_lock:
+        _matcher_cache[key] = matcher
+        while len(_matcher_cache) > MATCHER_CACHE_SIZE:
+            _matcher_cache.popitem(last=False)
+    return matcher
+
+
+# 匹配结果分段的默认预算（字节）
+SEGMENT_MAX_BYTES = 50 * 1024
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计 token 数：ASCII 字符约 4 个一个 token，其他字符（如中文）约每个字符一个 token"""
+    non_ascii = len(text) - len(text.encode("ascii", "ignore"))
+    return (len(text) - non_ascii + 3) // 4 + non_ascii
+
+
+def iter_text_segments(lines, max_bytes: int = None, max_tokens: int = None):
+    """
+    按预算把行序列切分为段，逐段产出（生成器，不预先生成全部分段）
+    保留整行（不截断），行内容原样拼接（含换行符）；预算为字节数或估算的 token 数，
+    同时给出时两者都需满足，都未给出时按 SEGMENT_MAX_BYTES；单行超出预算时独立成段
+    """
+    if max_bytes is None and max_tokens is None:
+        max_bytes = SEGMENT_MAX_BYTES
+    current = []
+    size_bytes = size_tokens = 0
     for line in lines:
-        line_bytes = len(line.encode("utf-8"))
-        # 如果行比 max_bytes 还长，直接独立成块
-        if line_bytes >= max_bytes:
-            if current_chunk:
-                chunks.append(current_chunk)
-                current_chunk = ""
-                current_size = 0
-            chunks.append(line)
-            continue
+        line_bytes = len(line.encode("utf-8")) if max_bytes else 0
+        line_tokens = estimate_tokens(line) if max_tokens else 0
+        if current and ((max_bytes and size_bytes + line_bytes > max_bytes)
+                        or (max_tokens and size_tokens + line_tokens > max_tokens)):
+            yield "".join(current)
+            current = []
+            size_bytes = size_tokens = 0
+        current.append(line)
+        size_bytes += line_bytes
+        size_tokens += line_tokens
+    if current:
+        yield "".join(current)
+
+
+def hash_file_content(file_path: str) -> str:
+    """流式计算文件内容的 sha256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def keyword_hits_key(keyword_set_id: int, keyword_set_version: int) -> str:
+    """关键词组(版本) + 匹配器版本，用于标识快照中保存的逐行命中"""
+    return f"{keyword_set_id}:{keyword_set_version or 1}:{MATCHER_VERSION}"
+
 
-        # 若加入当前块后超过 max_bytes
-        if current_size + line_bytes > max_bytes:
-            # 如果当前块非空 -> 结束当前块
-            if current_chunk:
-                chunks.append(current_chunk)
-                current_chunk = ""
-                current_size = 0
+def match_cache_key(content_hash: str, keyword_set_id: int, keyword_set_version: int) -> str:
+    """匹配结果缓存键：清洗内容 + 关键词组(版本) + 匹配器版本 任一变化都会失效"""
+    return f"{content_hash}:{keyword_hits_key(keyword_set_id, keyword_set_version)}"
 
-        # 加入行
-        current_chunk += line
-        current_size += line_bytes
 
-    # 收尾
-    if current_chunk:
-        chunks.append(current_chunk)
+def _save_match_result(db: Session, batch_id: int, file, keyword_set_id: int, cache_key: str, match_result: dict,
+                       existing, filename: str, match_file_path: str):
+    """写出匹配结果文件并保存到数据库（已有记录时原地更新），按 MATCH_RESULT_FORMAT 存储"""
+    if MATCH_RESULT_FORMAT == MATCH_FORMAT_COLUMNAR:
+        match_result = compact_match_data(match_result)
+        with open(match_file_path, 'w', encoding='utf-8') as f:
+            json.dump(match_result, f, ensure_ascii=False, separators=(",", ":"))
+    else:
+        match_result = expand_match_data(match_result)
+        with open(match_file_path, 'w', encoding='utf-8') as f:
+            json.dump(match_result, f, ensure_ascii=False, indent=2)
 
-    return chunks
+    if existing:
+        # 缓存键变化（内容或关键词组已更新）：原地更新，避免结果堆积
+        db_result = crud.update_keyword_match_result(db, existing.id, match_result, cache_key=cache_key)
+        db_result.match_data = json.dumps(match_result, ensure_ascii=False)
+    else:
+        db_result = crud.create_keyword_match_result(db, schemas.KeywordMatchResultCreate(
+            batch_id=batch_id,
+            file_id=file.id,
+            filename=filename,
+            file_path=match_file_path,
+            keyword_set_id=keyword_set_id,
+            match_data=match_result,
+            cache_key=cache_key
+        ))
+    db.commit()
+    return db_result
 
 
 def perform_keyword_check(
@@ -182,14 +660,17 @@ def perform_keyword_check(
     batch_id: int,
     keyword_set_id: int
 ):
-    """执行关键词检查，确保行号为原始文件行号"""
+    """
+    执行关键词检查，确保行号为原始文件行号
+    结果按 (内容哈希, 关键词组, 关键词组版本, 匹配器版本) 缓存：
+    同一文件重复检查直接返回已有记录；其他批次中相同内容的结果直接复用，不重新扫描
+    """
     # 1. 验证关键词组
 
     keyword_set = crud.get_keyword_set(db, keyword_set_id)
     if not keyword_set:
         raise ValueError("关键词组不存在")
-    keywords = [k.strip() for k in keyword_set.keywords.split(",") if k.strip()]
-    if not keywords:
+    if not keyword_set.keyword_count:
         raise ValueError("关键词组不能为空")
 
     # 2. 获取清洗文件（原始文本格式）
@@ -197,84 +678,460 @@ def perform_keyword_check(
     if not cleaned_files:
         raise ValueError(f"批次 {batch_id} 没有初次清洗文件")
 
-    # 3. 初始化匹配器
-    matcher = ConfigKeywordMatcher(keywords)
+    # 延迟导入：parallel_service / snapshot_service 依赖本模块
+    from .parallel_service import is_large_file, search_config_data_parallel
+    from .snapshot_service import (load_snapshot, save_snapshot, has_block_hits,
+                                   match_with_snapshot, record_match_hits)
+
+    # 3. 匹配器按需初始化（全部命中缓存时无需构建自动机），行级缓存在整个批次内共享
+    matcher = None
+    memo = None
     results = []
+    reused = 0
+    reused_blocks = 0
+    hits_key = keyword_hits_key(keyword_set_id, keyword_set.version)
+    # 设置了区块作用域时匹配结果经过过滤，不能反推逐行命中写入快照
+    record_hits = not crud.keyword_set_is_scoped(db, keyword_set)
 
     # 4. 处理文件（保留原始行号，不合并/去重行）
     for file in cleaned_files:
         try:
-            # 读取原始文本（保留所有行，包括空行，确保行号准确）
-            with open(file.file_path, 'r', encoding='utf-8') as f:
-                raw_data = f.read()  # 不做任何行去重或合并，保持原始结构
+            if not file.content_hash:
+                file.content_hash = hash_file_content(file.file_path)
+                db.commit()
+            cache_key = match_cache_key(file.content_hash, keyword_set_id, keyword_set.version)
 
-            # 获取厂商信息（示例）
-            vendor = "cisco"  # 实际可从文件名/内容提取
+            filename = file.filename.replace('.cfg', '_matches.json').replace('.txt', '_matches.json')
+            match_file_path = file.file_path.replace('cleaned_1', 'match').replace(file.filename, filename)
+
+            # 4.1 本批次已有相同缓存键的结果：直接返回，不新增记录
+            existing = crud.get_latest_match_result(db, batch_id, file.id, keyword_set_id)
+            if existing and existing.cache_key == cache_key:
+                if not os.path.exists(existing.file_path or match_file_path):
+                    with open(match_file_path, 'w', encoding='utf-8') as f:
+                        f.write(existing.match_data)
+                results.append(existing)
+                reused += 1
+                continue
 
-            # 执行匹配（行号为原始文件行号）
-            match_result = matcher.search_config_data(raw_data, vendor=vendor)
+            # 本文件的设备快照（二次清洗时生成），用于按区块复用上一批次的命中
+            snapshot_row = crud.get_snapshot_by_cleaned_file_1(db, file.id)
+            snapshot = load_snapshot(snapshot_row.snapshot_path) if snapshot_row else None
+            if snapshot is not None and snapshot.get("content_hash") != file.content_hash:
+                snapshot = None
+
+            # 4.2 其他批次有相同内容的结果：复用，否则扫描
+            cached = crud.get_match_result_by_cache_key(db, cache_key)
+            if cached:
+                match_result = expand_match_data(json.loads(cached.match_data))
+                reused += 1
+                if snapshot is not None and record_hits:
+                    record_match_hits(snapshot, hits_key, match_result)
+                    save_snapshot(snapshot_row.snapshot_path, snapshot)
+            else:
+                if matcher is None:
+                    matcher = get_keyword_matcher(keyword_set_id, keyword_set.version)
+                    memo = LineMatchMemo(matcher)
+
+                # 读取原始文本（保留所有行，包括空行，确保行号准确）
+                with open(file.file_path, 'r', encoding='utf-8') as f:
+                    raw_data = f.read()  # 不做任何行去重或合并，保持原始结构
+
+                # 获取厂商信息（与二次清洗使用同一识别逻辑）
+                vendor = detect_vendor(raw_data.splitlines())
+
+                # 执行匹配（行号为原始文件行号）
+                # 阈值按文件字节数比较（len(raw_data) 为字符数，非 ASCII 内容会被低估）
+                large = is_large_file(file.file_path)
+                if snapshot is not None and (not large or has_block_hits(snapshot, hits_key)):
+                    # 有快照：未变化的区块直接继承上一批次的命中，只匹配变化的区块
+                    match_result, block_count = match_with_snapshot(matcher, raw_data, snapshot, hits_key,
+                                                                    vendor=vendor, memo=memo)
+                    reused_blocks += block_count
+                elif large:
+                    # 超大文件：按区块并行匹配
+                    match_result = search_config_data_parallel(matcher, raw_data, vendor=vendor)
+                    if snapshot is not None and record_hits:
+                        record_match_hits(snapshot, hits_key, match_result)
+                else:
+                    match_result = matcher.search_config_data(raw_data, vendor=vendor, memo=memo)
+                if snapshot is not None:
+                    save_snapshot(snapshot_row.snapshot_path, snapshot)
 
             # 保存结果
-            filename = file.filename.replace('.cfg', '_matches.json').replace('.txt', '_matches.json')
-            match_file_path = file.file_path.replace('cleaned_1', 'match').replace(file.filename, filename)
-            with open(match_file_path, 'w', encoding='utf-8') as f:
-                json.dump(match_result, f, ensure_ascii=False, indent=2)
-
-            db_result = crud.create_keyword_match_result(db, schemas.KeywordMatchResultCreate(
-                batch_id=batch_id,
-                file_id=file.id,
-                filename=filename,
-                file_path=match_file_path,
-                keyword_set_id=keyword_set_id,
-                match_data=match_result
-            ))
-            db.commit()
-            results.append(db_result)
+            results.append(_save_match_result(db, batch_id, file, keyword_set_id, cache_key, match_result,
+                                              existing, filename, match_file_path))
 
         except Exception as e:
             print(f"处理文件 {file.filename} 时出错: {str(e)}")
             continue
 
+    print(f"[关键词检查] 批次 {batch_id}: 文件 {len(cleaned_files)}，复用缓存 {reused}，复用快照区块 {reused_blocks}")
+    if memo is not None:
+        print(f"[关键词检查] 批次 {batch_id}: 不同行 {len(memo)}，缓存命中 {memo.hits}，实际匹配 {memo.misses}")
     return results
 
-def get_keyword_matche_segments(match_data: dict):
+def perform_multi_keyword_check(db: Session, batch_id: int, keyword_set_ids: List[int]):
+    """
+    多个关键词组一次完成检查：每个文件只读取和扫描一次，按关键词组分别保存结果
+    缓存规则与 perform_keyword_check 相同，只有未命中缓存的关键词组参与扫描
+    """
+    keyword_sets = []
+    for keyword_set_id in dict.fromkeys(keyword_set_ids):
+        keyword_set = crud.get_keyword_set(db, keyword_set_id)
+        if not keyword_set:
+            raise ValueError(f"关键词组 {keyword_set_id} 不存在")
+        if not keyword_set.keyword_count:
+            raise ValueError(f"关键词组 {keyword_set_id} 不能为空")
+        keyword_sets.append(keyword_set)
+    unscoped = {ks.id for ks in keyword_sets if not crud.keyword_set_is_scoped(db, ks)}
+    if not keyword_sets:
+        raise ValueError("未指定关键词组")
 
-    all_matches: List[Dict] = []
-    # 遍历所有配置区块（如hostname、mpls ldp、global等）
-    for section_name, section_matches in match_data["matches"].items():
-        # 遍历区块下的每个匹配项，补充"所属区块"信息
-        for match in section_matches:
-            # 校验单个匹配项的字段完整性
-            if not all(k in match for k in ["line", "keyword", "content"]):
-                print(f"警告：跳过无效匹配项（字段不完整）: {match}")
-                continue
-            # 补充"所属区块"，方便后续文件展示
-            all_matches.append({
-                "line": match["line"],          # 行号（排序依据）
-                "section": section_name,       # 所属配置区块
-                "keyword": match["keyword"],   # 匹配的关键词
-                "content": match["content"]    # 原始配置内容
+    cleaned_files = crud.get_cleaned_files_1_by_batch(db, batch_id=batch_id)
+    if not cleaned_files:
+        raise ValueError(f"批次 {batch_id} 没有初次清洗文件")
+
+    from .snapshot_service import load_snapshot, save_snapshot, match_multi_with_snapshot, record_match_hits
+
+    matcher = None
+    memo = None
+    results = []
+    reused = scanned = reused_blocks = 0
+
+    for file in cleaned_files:
+        try:
+            if not file.content_hash:
+                file.content_hash = hash_file_content(file.file_path)
+                db.commit()
+
+            snapshot_row = crud.get_snapshot_by_cleaned_file_1(db, file.id)
+            snapshot = load_snapshot(snapshot_row.snapshot_path) if snapshot_row else None
+            if snapshot is not None and snapshot.get("content_hash") != file.content_hash:
+                snapshot = None
+
+            name, _ = os.path.splitext(file.filename)
+            pending = []
+            for keyword_set in keyword_sets:
+                cache_key = match_cache_key(file.content_hash, keyword_set.id, keyword_set.version)
+                # 同一文件在多个关键词组下的结果分别保存
+                filename = f"{name}_matches_set{keyword_set.id}.json"
+                match_file_path = os.path.join(os.path.dirname(file.file_path).replace('cleaned_1', 'match'), filename)
+                existing = crud.get_latest_match_result(db, batch_id, file.id, keyword_set.id)
+                if existing and existing.cache_key == cache_key:
+                    results.append(existing)
+                    reused += 1
+                    continue
+                cached = crud.get_match_result_by_cache_key(db, cache_key)
+                if cached:
+                    match_result = expand_match_data(json.loads(cached.match_data))
+                    reused += 1
+                    results.append(_save_match_result(db, batch_id, file, keyword_set.id, cache_key, match_result,
+                                                      existing, filename, match_file_path))
+                    if snapshot is not None and keyword_set.id in unscoped:
+                        record_match_hits(snapshot, keyword_hits_key(keyword_set.id, keyword_set.version),
+                                          match_result)
+                    continue
+                pending.append((keyword_set, cache_key, existing, filename, match_file_path))
+
+            if pending:
+                if matcher is None:
+                    matcher = get_multi_set_matcher(db, keyword_sets)
+                    memo = LineMatchMemo(matcher.matcher)
+                with open(file.file_path, 'r', encoding='utf-8') as f:
+                    raw_data = f.read()
+                vendor = detect_vendor(raw_data.splitlines())
+                if snapshot is not None:
+                    # 有快照：各组未变化区块的命中直接继承，只扫描缺少命中的区块（同时回写快照）
+                    hits_keys = {ks.id: keyword_hits_key(ks.id, ks.version) for ks, _, _, _, _ in pending}
+                    per_set, block_count = match_multi_with_snapshot(matcher, raw_data, snapshot, hits_keys,
+                                                                     vendor=vendor, memo=memo)
+                    reused_blocks += block_count
+                else:
+                    per_set = matcher.search_config_data(raw_data, vendor=vendor, memo=memo)
+                scanned += 1
+
+                for keyword_set, cache_key, existing, filename, match_file_path in pending:
+                    results.append(_save_match_result(db, batch_id, file, keyword_set.id, cache_key,
+                                                      per_set[keyword_set.id], existing, filename, match_file_path))
+
+            if snapshot is not None:
+                save_snapshot(snapshot_row.snapshot_path, snapshot)
+
+        except Exception as e:
+            print(f"处理文件 {file.filename} 时出错: {str(e)}")
+            continue
+
+    print(f"[多组关键词检查] 批次 {batch_id}: 关键词组 {len(keyword_sets)}，文件 {len(cleaned_files)}，"
+          f"扫描 {scanned}，复用缓存 {reused}，复用快照区块 {reused_blocks}")
+    return results
+
+def _severity_key(word: str) -> str:
+    return word if word.startswith(REGEX_PREFIX) else word.lower()
+
+
+def get_severity_matcher(keyword_set_id: int, version: int, min_severity: Optional[int]) -> ConfigKeywordMatcher:
+    """只包含严重程度不低于 min_severity 的关键词的匹配器（自动机更小，低严重程度的行不会产生命中）"""
+    if min_severity is None:
+        return get_keyword_matcher(keyword_set_id, version)
+    key = (keyword_set_id, version or 1, "severity", min_severity)
+    with _matcher_lock:
+        matcher = _matcher_cache.get(key)
+        if matcher is not None:
+            _matcher_cache.move_to_end(key)
+            return matcher
+    db = SessionLocal()
+    try:
+        keywords, set_scopes, keyword_scopes = load_keyword_set_entries(db, keyword_set_id)
+        severities = crud.get_keyword_severities(db, keyword_set_id)
+    finally:
+        db.close()
+    keywords = [word for word in keywords if (severities.get(word) or 0) >= min_severity]
+    kept = set(keywords)
+    matcher = ConfigKeywordMatcher(keywords, scopes=set_scopes,
+                                   keyword_scopes={w: s for w, s in keyword_scopes.items() if w in kept})
+    with _matcher_lock:
+        _matcher_cache[key] = matcher
+        while len(_matcher_cache) > MATCHER_CACHE_SIZE:
+            _matcher_cache.popitem(last=False)
+    return matcher
+
+
+def _iter_lines_in_order(matcher: ConfigKeywordMatcher, raw_data: str):
+    """
+    按行号顺序产出 (行内容, 行号, 所在区块列表)
+    未设置作用域时不划分区块（区块列表为 None）；否则只产出作用域内区块中的行
+    """
+    if not matcher.scoped:
+        for idx, line in enumerate(raw_data.splitlines()):
+            yield line, idx + 1, None
+        return
+    in_scope = {}
+    for section, lines in matcher.build_sections(raw_data).items():
+        if not matcher.scope.section_in_scope(section):
+            continue
+        for line_content, line_num in lines:
+            in_scope.setdefault(line_num, (line_content, []))[1].append(section)
+    for line_num in sorted(in_scope):
+        line_content, sections = in_scope[line_num]
+        yield line_content, line_num, sections
+
+
+def _scoped_hits(matcher: ConfigKeywordMatcher, hits, sections):
+    """(关键词, 区块)：设置了作用域时取该关键词有效的第一个区块，都无效则丢弃"""
+    for keyword in hits:
+        if sections is None:
+            yield keyword, None
+            continue
+        section = next((s for s in sections if matcher.scope.keyword_in_scope(keyword, s)), None)
+        if section is not None:
+            yield keyword, section
+
+
+def rank_config_matches(matcher: ConfigKeywordMatcher, raw_data: str, severity_of: Dict[str, int], k: int,
+                        memo: LineMatchMemo = None) -> dict:
+    """
+    严重程度最高的 k 条命中（同等严重程度按行号先后），用大小为 k 的小顶堆维护；
+    按行号顺序扫描，堆满且堆顶已达到最高严重程度时提前结束（之后的命中不可能再入选）
+    """
+    match_line = memo.match_line if memo is not None else matcher.match_line
+    top_severity = max((severity_of.get(_severity_key(w), 0) for w in matcher.keywords), default=0)
+    heap = []
+    order = 0
+    scanned = 0
+    complete = True
+    for line_content, line_num, sections in _iter_lines_in_order(matcher, raw_data):
+        scanned += 1
+        for keyword, section in _scoped_hits(matcher, match_line(line_content), sections):
+            severity = severity_of.get(_severity_key(keyword), 0)
+            # 行号、命中顺序取负：堆顶为最不严重、最靠后的命中
+            entry = (severity, -line_num, -order, {
+                "line": line_num, "keyword": keyword, "severity": severity,
+                "section": section, "content": line_content.strip()
             })
+            order += 1
+            if len(heap) < k:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+        if len(heap) >= k and heap[0][0] >= top_severity:
+            complete = False
+            break
+    return {
+        "findings": [entry[3] for entry in sorted(heap, reverse=True)],
+        "scanned_lines": scanned,
+        "complete": complete,  # False 表示提前结束，未扫描到文件末尾
+    }
+
+
+def find_first_match(matcher: ConfigKeywordMatcher, raw_data: str, severity_of: Dict[str, int],
+                     memo: LineMatchMemo = None) -> dict:
+    """存在性检查：按行号顺序扫描，遇到第一条命中即停止"""
+    match_line = memo.match_line if memo is not None else matcher.match_line
+    scanned = 0
+    for line_content, line_num, sections in _iter_lines_in_order(matcher, raw_data):
+        scanned += 1
+        for keyword, section in _scoped_hits(matcher, match_line(line_content), sections):
+            return {"found": True, "scanned_lines": scanned, "match": {
+                "line": line_num, "keyword": keyword, "severity": severity_of.get(_severity_key(keyword), 0),
+                "section": section, "content": line_content.strip()
+            }}
+    return {"found": False, "scanned_lines": scanned, "match": None}
+
+
+def perform_keyword_ranking(db: Session, batch_id: int, keyword_set_id: int, mode: str = "top", k: int = 50,
+                            min_severity: int = None) -> List[dict]:
+    """
+    按严重程度匹配（供看板查询，结果不落库）：
+    - top: 每个文件严重程度最高的 k 条命中
+    - exists: 每个文件是否存在严重程度不低于 min_severity 的命中
+    """
+    keyword_set = crud.get_keyword_set(db, keyword_set_id)
+    if not keyword_set:
+        raise ValueError("关键词组不存在")
+    if not keyword_set.keyword_count:
+        raise ValueError("关键词组不能为空")
+    cleaned_files = crud.get_cleaned_files_1_by_batch(db, batch_id=batch_id)
+    if not cleaned_files:
+        raise ValueError(f"批次 {batch_id} 没有初次清洗文件")
+
+    severity_of = {}
+    for word, severity in crud.get_keyword_severities(db, keyword_set_id).items():
+        key = _severity_key(word)
+        severity_of[key] = max(severity_of.get(key, severity), severity)
+    matcher = get_severity_matcher(keyword_set_id, keyword_set.version, min_severity)
+    memo = LineMatchMemo(matcher)
+
+    results = []
+    for file in cleaned_files:
+        try:
+            if not matcher.keywords:
+                result = ({"found": False, "scanned_lines": 0, "match": None} if mode == "exists"
+                          else {"findings": [], "scanned_lines": 0, "complete": True})
+            else:
+                with open(file.file_path, 'r', encoding='utf-8') as f:
+                    raw_data = f.read()
+                if mode == "exists":
+                    result = find_first_match(matcher, raw_data, severity_of, memo=memo)
+                else:
+                    result = rank_config_matches(matcher, raw_data, severity_of, k, memo=memo)
+        except Exception as e:
+            print(f"处理文件 {file.filename} 时出错: {str(e)}")
+            continue
+        results.append({"file_id": file.id, "filename": file.filename, "mode": mode, **result})
+    return results
+
+
+def compact_match_data(match_data: dict) -> dict:
+    """
+    逐条命中的匹配结果 -> 列式格式：
+        {"format": "columnar", "vendor",
+         "keywords": [关键词], "sections": [区块名], "rows": [各区块的行数],
+         "line": [行号（首个为绝对值，其余为与上一行之差）], "hits": [[关键词下标]], "content": [行内容]}
+    同一区块中同一行的多个命中合并为一行，行内容只保存一次；已是列式格式或不含 matches 时原样返回
+    """
+    if match_data.get("format") == MATCH_FORMAT_COLUMNAR or "matches" not in match_data:
+        return match_data
+    keyword_ids: Dict[str, int] = {}
+    sections, rows, lines, hits, contents = [], [], [], [], []
+    previous = 0
+    for section, section_matches in match_data["matches"].items():
+        count = 0
+        last_line = None
+        for m in section_matches:
+            keyword_id = keyword_ids.setdefault(m["keyword"], len(keyword_ids))
+            if m["line"] == last_line and m["content"] == contents[-1]:
+                hits[-1].append(keyword_id)
+                continue
+            lines.append(m["line"] - previous)
+            previous = last_line = m["line"]
+            hits.append([keyword_id])
+            contents.append(m["content"])
+            count += 1
+        sections.append(section)
+        rows.append(count)
+    return {
+        "format": MATCH_FORMAT_COLUMNAR,
+        "vendor": match_data.get("vendor"),
+        "keywords": list(keyword_ids),
+        "sections": sections,
+        "rows": rows,
+        "line": lines,
+        "hits": hits,
+        "content": contents,
+    }
+
+
+def expand_match_data(match_data: dict) -> dict:
+    """列式格式 -> 逐条命中的旧格式 {"vendor", "matches": {区块: [{"line", "keyword", "content"}]}}；旧格式原样返回"""
+    if match_data.get("format") != MATCH_FORMAT_COLUMNAR:
+        return match_data
+    keywords = match_data["keywords"]
+    matches = {}
+    line = 0
+    rows = zip(match_data["line"], match_data["hits"], match_data["content"])
+    for section, count in zip(match_data["sections"], match_data["rows"]):
+        section_matches = matches[section] = []
+        for delta, keyword_ids, content in islice(rows, count):
+            line += delta
+            section_matches.extend({"line": line, "keyword": keywords[k], "content": content} for k in keyword_ids)
+    return {"vendor": match_data.get("vendor"), "matches": matches}
 
-    if not all_matches:
-        raise ValueError("匹配结果中无有效数据，无法生成文件")
 
-    # 按"line"字段升序排序
-    sorted_matches = sorted(all_matches, key=lambda x: x["line"])
+def count_keyword_hits(match_data: dict) -> Dict[str, int]:
+    """匹配结果中各关键词的命中数（两种存储格式均可，不展开列式格式）"""
+    counts: Dict[str, int] = {}
+    if match_data.get("format") == MATCH_FORMAT_COLUMNAR:
+        keywords = match_data["keywords"]
+        for keyword_ids in match_data["hits"]:
+            for k in keyword_ids:
+                counts[keywords[k]] = counts.get(keywords[k], 0) + 1
+        return counts
+    for section_matches in match_data.get("matches", {}).values():
+        for m in section_matches:
+            counts[m["keyword"]] = counts.get(m["keyword"], 0) + 1
+    return counts
 
-    # 构建排序后的匹配项内容（按固定格式对齐）
-    match_lines = []
-    for idx, match in enumerate(sorted_matches, 1):
-        # 格式：行号 | 所属区块 | 关键词 | 配置内容（对齐显示，易读）
-        line = (
-            f"{match['content']}"
-        )
-        match_lines.append(line)
 
-    # 合并头部和匹配项，形成完整文件内容
-    file_content = "\n".join(match_lines)
+def render_match_data(match_data: dict, view: str = "compact") -> dict:
+    """按接口请求的视图返回匹配结果：legacy 为旧格式，compact 为列式格式（两种存储格式均可）"""
+    return expand_match_data(match_data) if view == "legacy" else compact_match_data(match_data)
 
-    # 每个片段最多50k字节，跨行不截断
-    # segments = split_text_by_bytes_preserve_lines(file_content, max_bytes=50*1024)
-    return file_content
 
+def project_match_data(match_data: dict, keyword: str = None, section: str = None, fields: str = "full"):
+    """
+    按关键词/区块过滤匹配结果，并按需投影为统计信息（两种存储格式均可，明细按旧格式返回）
+    :param keyword: 只保留该关键词（不区分大小写）
+    :param section: 只保留名称以该前缀开头的区块（不区分大小写）
+    :param fields: "full" 返回命中明细；"counts" 只返回计数
+    :return: 过滤后的结果；过滤后无命中时返回 None
+    """
+    match_data = expand_match_data(match_data)
+    keyword_lower = keyword.lower() if keyword else None
+    section_lower = section.lower() if section else None
+
+    matches = {}
+    for section_name, section_matches in match_data.get("matches", {}).items():
+        if section_lower and not section_name.lower().startswith(section_lower):
+            continue
+        if keyword_lower:
+            section_matches = [m for m in section_matches if m.get("keyword", "").lower() == keyword_lower]
+        if section_matches:
+            matches[section_name] = section_matches
+
+    if (keyword or section) and not matches:
+        return None
+
+    if fields == "counts":
+        keyword_counts: Dict[str, int] = {}
+        for section_matches in matches.values():
+            for m in section_matches:
+                keyword_counts[m.get("keyword")] = keyword_counts.get(m.get("keyword"), 0) + 1
+        return {
+            "vendor": match_data.get("vendor"),
+            "total": sum(len(v) for v in matches.values()),
+            "sections": {name: len(v) for name, v in matches.items()},
+            "keywords": keyword_counts,
+        }
+
+    return {"vendor": match_data.get("vendor"), "matches": matches}
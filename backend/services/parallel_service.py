@@ -0,0 +1,164 @@
+"""
+单个超大配置文件的块内并行处理
+
+按厂商的安全区块边界（见 clean_2.iter_block_boundaries）把文件切成若干块，
+由多个进程分别解析/匹配，再按原顺序合并，结果与整体串行处理完全一致（包括绝对行号）。
+工作进程池在首次使用时创建并在进程内复用（spawn 方式启动，不从多线程的 API 进程 fork）。
+"""
+import atexit
+import hashlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from .clean_2 import detect_vendor, split_config_chunks, parse_vendor_lines, merge_parsed_parts
+from .keyword_service import ConfigKeywordMatcher, LineMatchMemo, assemble_section_matches
+
+# 超过该大小的文件启用块内并行（默认 64MB）
+PARALLEL_FILE_THRESHOLD = int(os.environ.get("KY_MATCH_PARALLEL_FILE_MB", "64")) * 1024 * 1024
+# 块内并行的进程数（默认为 CPU 核数）
+PARALLEL_WORKERS = int(os.environ.get("KY_MATCH_PARALLEL_WORKERS", "0")) or os.cpu_count() or 1
+# 每个进程分到的块数，略多于 1 以平衡各块耗时差异
+CHUNKS_PER_WORKER = 2
+
+# 子进程内的匹配器：(关键词指纹, 匹配器, 行级缓存)，关键词变化时重建
+_CHUNK_MATCHER = None
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def get_process_pool(workers: int = None) -> ProcessPoolExecutor:
+    """
+    进程内共享的工作进程池（首次使用时创建）
+    已创建的池进程数少于 workers 时仍复用该池，多出的块排队执行
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None:
+            _pool_workers = max(workers or 0, PARALLEL_WORKERS)
+            _pool = ProcessPoolExecutor(max_workers=_pool_workers, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _reset_process_pool(pool: ProcessPoolExecutor):
+    """工作进程异常退出后池不可再用：丢弃，下次使用时重新创建"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _run_in_pool(func, items, workers: int = None, chunksize: int = 1) -> list:
+    pool = get_process_pool(workers)
+    try:
+        return list(pool.map(func, items, chunksize=chunksize))
+    except BrokenProcessPool:
+        _reset_process_pool(pool)
+        raise
+
+
+@atexit.register
+def shutdown_process_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _keywords_fingerprint(keywords) -> str:
+    return hashlib.sha1("\n".join(keywords).encode("utf-8")).hexdigest()
+
+
+def _chunk_memo(fingerprint: str, keywords):
+    """子进程内按关键词指纹复用匹配器和行级缓存"""
+    global _CHUNK_MATCHER
+    if _CHUNK_MATCHER is None or _CHUNK_MATCHER[0] != fingerprint:
+        matcher = ConfigKeywordMatcher(keywords)
+        _CHUNK_MATCHER = (fingerprint, matcher, LineMatchMemo(matcher))
+    return _CHUNK_MATCHER[2]
+
+
+def _parse_chunk(args):
+    lines, vendor = args
+    return parse_vendor_lines(lines, vendor)
+
+
+def _match_chunk(args):
+    """匹配一块连续的行，只返回有命中的行：{绝对行号: (关键词, ...)}"""
+    fingerprint, keywords, lines, first_line_num = args
+    memo = _chunk_memo(fingerprint, keywords)
+    line_hits = {}
+    for offset, line in enumerate(lines):
+        hits = memo.match_line(line)
+        if hits:
+            line_hits[first_line_num + offset] = hits
+    return line_hits
+
+
+def is_large_file(file_path: str) -> bool:
+    return os.path.getsize(file_path) >= PARALLEL_FILE_THRESHOLD
+
+
+def parse_config_lines_parallel(raw_lines, workers: int = None) -> dict:
+    """并行版 clean_2.parse_config_lines"""
+    workers = workers or PARALLEL_WORKERS
+    lines = [line.rstrip() for line in raw_lines if line.strip()]
+    vendor = detect_vendor(lines)
+
+    chunks = split_config_chunks(lines, vendor, workers * CHUNKS_PER_WORKER)
+    if len(chunks) == 1:
+        return merge_parsed_parts([parse_vendor_lines(lines, vendor)], vendor)
+
+    parts = _run_in_pool(_parse_chunk, [(lines[start:end], vendor) for start, end in chunks], workers)
+    return merge_parsed_parts(parts, vendor)
+
+
+def parse_config_file_parallel(file_path: str, workers: int = None) -> dict:
+    """并行版 clean_2.parse_config_file"""
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        return parse_config_lines_parallel(f, workers=workers)
+
+
+def parse_blocks_parallel(blocks, vendor: str, workers: int = None) -> list:
+    """并行解析多个相互独立的区块（每项为已去除空行的行列表），按原顺序返回各自的解析结果"""
+    workers = workers or PARALLEL_WORKERS
+    return _run_in_pool(_parse_chunk, [(lines, vendor) for lines in blocks], workers, chunksize=64)
+
+
+def search_config_data_parallel(matcher: ConfigKeywordMatcher, raw_data: str, vendor: str = "unknown",
+                                workers: int = None) -> dict:
+    """
+    并行版 ConfigKeywordMatcher.search_config_data
+    各进程只做逐行匹配（与区块无关），区块划分在主进程中与之并行完成，最后按区块组装
+    """
+    workers = workers or PARALLEL_WORKERS
+    raw_lines = raw_data.splitlines()
+    chunks = split_config_chunks(raw_lines, vendor, workers * CHUNKS_PER_WORKER)
+    if len(chunks) == 1 or matcher.scoped:
+        # 设置了区块作用域时串行版只扫描作用域内的区块，扫描量已按比例减少
+        return matcher.search_config_data(raw_data, vendor=vendor)
+
+    # 池是共享的：关键词随任务传入，子进程按指纹复用已构建的匹配器
+    fingerprint = _keywords_fingerprint(matcher.keywords)
+    pool = get_process_pool(workers)
+    futures = [pool.submit(_match_chunk, (fingerprint, matcher.keywords, raw_lines[start:end], start + 1))
+               for start, end in chunks]
+    line_hits = {}
+    try:
+        sections = matcher.build_sections(raw_data)
+        for future in futures:
+            line_hits.update(future.result())
+    except BrokenProcessPool:
+        _reset_process_pool(pool)
+        raise
+    finally:
+        for future in futures:
+            future.cancel()
+
+    return assemble_section_matches(sections, line_hits, vendor, scope=matcher.scope)
@@ -0,0 +1,211 @@
+"""
+保留策略与清理
+
+保留以下批次，其余批次连同文件（上传目录下的批次目录，含快照）和数据库记录一起删除：
+- 固定（pinned）的批次、有待执行或执行中任务的批次
+- 最近 RETAIN_DAYS 天内的批次
+- 每台设备（按快照中的主机名）最近的 RETAIN_PER_DEVICE 个批次；没有设备信息的批次只按天数判断
+上传中的批次（分块上传会话未完成）不按以上规则清理，超过 UPLOAD_SESSION_TTL_HOURS 小时没有写入时删除。
+
+删除按每 GC_CHUNK_BATCHES 个批次一个事务进行，事务之间短暂让出写锁，避免长时间阻塞 API 写入；
+先提交数据库删除再删除文件（中断时最多留下无记录引用的目录，下次清理时按目录名识别）。
+清理后增量回收空闲页（数据库为 auto_vacuum=INCREMENTAL 时）并更新查询优化统计。
+后台清理默认关闭（KY_GC_INTERVAL=0），可用 ky-match gc 手动执行（--dry-run 只列出要删除的批次）。
+"""
+import glob
+import os
+import re
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .. import crud
+from ..database import SessionLocal, engine
+from .file_service import UPLOAD_BASE_DIR
+
+# 每台设备保留的最近批次数（0 表示不按设备保留）
+RETAIN_PER_DEVICE = int(os.environ.get("KY_RETAIN_PER_DEVICE", "10"))
+# 保留最近多少天内的批次（0 表示不按天数保留）
+RETAIN_DAYS = int(os.environ.get("KY_RETAIN_DAYS", "30"))
+# 后台清理间隔（秒），默认 0 不启动后台清理：升级前的批次没有快照，只能按天数判断，
+# 默认策略会删除大部分历史批次，需先用 ky-match gc --dry-run 确认后再显式开启（如 3600）
+GC_INTERVAL = int(os.environ.get("KY_GC_INTERVAL", "0"))
+# 每个事务删除的批次数 / 记录数，事务之间的间隔（秒）
+GC_CHUNK_BATCHES = int(os.environ.get("KY_GC_CHUNK_BATCHES", "20"))
+# 未完成的分块上传会话的保留时长（小时，自最后一次写入起）
+UPLOAD_SESSION_TTL_HOURS = int(os.environ.get("KY_UPLOAD_SESSION_TTL_HOURS", "24"))
+GC_CHUNK_ROWS = 1000
+GC_PAUSE = 0.05
+# 每次增量回收的页数及最多回收次数
+VACUUM_STEP_PAGES = 1000
+VACUUM_MAX_STEPS = 100
+
+_BATCH_DIR = re.compile(r"^batch_(\d+)_\d+$")
+
+
+def plan_retention(db: Session, keep_per_device: int = None, keep_days: int = None) -> list:
+    """按保留策略计算要删除的批次ID（两条规则都未启用时不删除任何批次）"""
+    keep_per_device = RETAIN_PER_DEVICE if keep_per_device is None else keep_per_device
+    keep_days = RETAIN_DAYS if keep_days is None else keep_days
+    if keep_per_device <= 0 and keep_days <= 0:
+        return []
+
+    cutoff = datetime.utcnow() - timedelta(days=keep_days) if keep_days > 0 else None
+    candidates = [batch_id for batch_id, _ in crud.get_gc_candidate_batches(db, created_before=cutoff)]
+    if not candidates:
+        return []
+
+    # 有设备信息的批次：每台设备最近的 N 个保留；一个批次只要是任一设备的最近 N 个之一即保留
+    kept = set()
+    with_device = set()
+    per_device = {}
+    for hostname, batch_id in crud.get_device_batch_ids(db):
+        with_device.add(batch_id)
+        count = per_device.get(hostname, 0)
+        if count < keep_per_device:
+            kept.add(batch_id)
+            per_device[hostname] = count + 1
+
+    # 没有设备信息的批次只按天数判断，未启用天数规则时保留
+    return [batch_id for batch_id in candidates
+            if batch_id not in kept and (batch_id in with_device or cutoff is not None)]
+
+
+def batch_dirs(batch_id: int) -> list:
+    """批次在上传目录下的目录（batch_<ID>_<时间戳>）"""
+    return [path for path in glob.glob(os.path.join(UPLOAD_BASE_DIR, f"batch_{batch_id}_*"))
+            if _BATCH_DIR.match(os.path.basename(path)) and os.path.isdir(path)]
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _remove_dirs(paths) -> int:
+    freed = 0
+    for path in paths:
+        freed += _dir_size(path)
+        shutil.rmtree(path, ignore_errors=True)
+    return freed
+
+
+def delete_batches_with_files(db: Session, batch_ids) -> dict:
+    """删除批次的数据库记录（一个事务）后删除批次目录，返回 {"rows": 各表行数, "dirs", "freed_bytes"}"""
+    dirs = [path for batch_id in batch_ids for path in batch_dirs(batch_id)]
+    rows = crud.delete_batches(db, batch_ids)
+    return {"rows": rows, "dirs": len(dirs), "freed_bytes": _remove_dirs(dirs)}
+
+
+def orphan_batch_dirs(db: Session) -> list:
+    """上传目录下没有对应批次记录的批次目录（如清理中断后遗留）"""
+    orphans = []
+    for name in os.listdir(UPLOAD_BASE_DIR):
+        m = _BATCH_DIR.match(name)
+        if m and crud.get_batch(db, int(m.group(1))) is None:
+            orphans.append(os.path.join(UPLOAD_BASE_DIR, name))
+    return orphans
+
+
+def vacuum_database(full: bool = False) -> dict:
+    """
+    回收空闲页并更新统计信息
+    :param full: 将数据库转换为 auto_vacuum=INCREMENTAL 并执行一次完整 VACUUM（需独占数据库，适合维护窗口）
+    """
+    result = {"freed_pages": 0}
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if full:
+            conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.exec_driver_sql("VACUUM")
+        mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+        result["auto_vacuum"] = {0: "none", 1: "full", 2: "incremental"}.get(mode, mode)
+        if mode == 2:
+            for _ in range(VACUUM_MAX_STEPS):
+                free = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+                if not free:
+                    break
+                conn.exec_driver_sql(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})")
+                result["freed_pages"] += min(free, VACUUM_STEP_PAGES)
+                time.sleep(GC_PAUSE)
+        result["free_pages"] = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+        conn.execute(text("ANALYZE") if full else text("PRAGMA optimize"))
+    return result
+
+
+def run_gc(keep_per_device: int = None, keep_days: int = None, dry_run: bool = False,
+           vacuum: bool = True, full_vacuum: bool = False) -> dict:
+    """执行一次清理，返回统计；dry_run 时只返回计划删除的批次"""
+    db = SessionLocal()
+    try:
+        batch_ids = plan_retention(db, keep_per_device, keep_days)
+        expired_uploads = crud.get_expired_upload_batch_ids(
+            db, datetime.utcnow() - timedelta(hours=UPLOAD_SESSION_TTL_HOURS))
+        batch_ids += [batch_id for batch_id in expired_uploads if batch_id not in batch_ids]
+        if dry_run:
+            return {"dry_run": True, "batches": batch_ids, "expired_uploads": expired_uploads,
+                    "orphan_dirs": orphan_batch_dirs(db)}
+
+        stats = {"batches": 0, "expired_uploads": len(expired_uploads), "rows": {}, "dirs": 0, "freed_bytes": 0}
+        for start in range(0, len(batch_ids), GC_CHUNK_BATCHES):
+            chunk = batch_ids[start:start + GC_CHUNK_BATCHES]
+            deleted = delete_batches_with_files(db, chunk)
+            for table, count in deleted["rows"].items():
+                stats["rows"][table] = stats["rows"].get(table, 0) + count
+            stats["batches"] += len(chunk)
+            stats["freed_bytes"] += deleted["freed_bytes"]
+            stats["dirs"] += deleted["dirs"]
+            time.sleep(GC_PAUSE)
+
+        orphans = orphan_batch_dirs(db)
+        stats["freed_bytes"] += _remove_dirs(orphans)
+        stats["dirs"] += len(orphans)
+
+        # 保留批次中的冗余记录：重复执行匹配留下的旧结果、已结束的历史任务
+        days = RETAIN_DAYS if keep_days is None else keep_days
+        for key, delete in (
+            ("superseded_matches", lambda: crud.delete_superseded_match_results(db, GC_CHUNK_ROWS)),
+            ("finished_tasks", lambda: crud.delete_finished_tasks(
+                db, datetime.utcnow() - timedelta(days=max(days, 1)), GC_CHUNK_ROWS)),
+        ):
+            stats[key] = 0
+            while True:
+                count = delete()
+                stats[key] += count
+                if count < GC_CHUNK_ROWS:
+                    break
+                time.sleep(GC_PAUSE)
+    finally:
+        db.close()
+
+    if vacuum or full_vacuum:
+        stats["vacuum"] = vacuum_database(full=full_vacuum)
+    return stats
+
+
+def _gc_loop(stop_event: threading.Event, interval: int):
+    while not stop_event.wait(interval):
+        try:
+            stats = run_gc()
+            if stats["batches"] or stats["dirs"]:
+                print(f"[gc] 清理批次 {stats['batches']} 个，目录 {stats['dirs']} 个，"
+                      f"释放 {stats['freed_bytes'] / 1024 / 1024:.1f}MB")
+        except Exception as e:
+            print(f"[gc] 清理失败: {str(e)}")
+
+
+def start_gc_worker(interval: int = None) -> threading.Event:
+    """启动后台清理线程（首次清理在一个间隔之后），返回用于停止该线程的事件"""
+    stop_event = threading.Event()
+    threading.Thread(target=_gc_loop, args=(stop_event, interval or GC_INTERVAL),
+                     name="retention-gc", daemon=True).start()
+    return stop_event
@@ -0,0 +1,341 @@
+"""
+关键词规则：在同一区块或同一行内对关键词做 AND / OR / NOT 组合
+
+规则表达式示例：
+    "switchport mode trunk" AND NOT "switchport trunk allowed vlan"
+    neighbor AND NOT (password OR "re:authentication-key \\S+")
+
+    "switchport mode trunk" AND NOT set:12
+
+关键词（项）的匹配规则与关键词组一致：字面量按完整单词、不区分大小写匹配，"re:" 开头按正则匹配；
+含空格或括号的关键词需加双引号。"set:<关键词组ID>" 引用关键词组：组内任一关键词命中即成立
+（关键词组自身的区块作用域不生效，作用域由规则的 sections 决定）。
+所有规则的项和被引用关键词组的关键词合并为一个自动机，每个文件只扫描一次，
+得到每行命中项的位图（int），区块位图为区块内各行位图的按位或；
+规则预先化为析取范式，每个合取子句对应 (必须出现的位, 不得出现的位)，求值只需位运算。
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .. import crud
+from .clean_2 import detect_vendor
+from .keyword_service import REGEX_PREFIX, ConfigKeywordMatcher, parse_scopes
+
+RULE_LEVELS = ("section", "line")
+# 引用关键词组的项：set:<关键词组ID>
+SET_REFERENCE_PREFIX = "set:"
+# 析取范式的子句数上限，防止 NOT/AND 嵌套过深时组合爆炸
+MAX_RULE_CLAUSES = 256
+
+_TOKEN = re.compile(r'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+_OPERATORS = ("AND", "OR", "NOT")
+
+
+class RuleSyntaxError(ValueError):
+    pass
+
+
+def tokenize(expression: str) -> List[Tuple[str, str]]:
+    """拆分为 ("(" | ")" | "AND" | "OR" | "NOT" | "TERM", 文本)"""
+    tokens = []
+    pos = 0
+    expression = expression.strip()
+    while pos < len(expression):
+        m = _TOKEN.match(expression, pos)
+        if not m:
+            raise RuleSyntaxError(f"无法解析的规则表达式（位置 {pos}）: {expression[pos:pos + 20]!r}")
+        lparen, rparen, quoted, bare = m.groups()
+        if lparen:
+            tokens.append(("(", lparen))
+        elif rparen:
+            tokens.append((")", rparen))
+        elif quoted is not None:
+            tokens.append(("TERM", quoted.replace('\\"', '"')))
+        elif bare.upper() in _OPERATORS:
+            tokens.append((bare.upper(), bare))
+        else:
+            tokens.append(("TERM", bare))
+        pos = m.end()
+    return tokens
+
+
+def parse_rule(expression: str):
+    """
+    解析为语法树：("term", 关键词) / ("not", 子树) / ("and", [子树]) / ("or", [子树])
+    优先级 NOT > AND > OR
+    """
+    tokens = tokenize(expression)
+    pos = 0
+
+    def peek():
+        return tokens[pos][0] if pos < len(tokens) else None
+
+    def take(kind):
+        nonlocal pos
+        if peek() != kind:
+            found = tokens[pos][1] if pos < len(tokens) else "结尾"
+            raise RuleSyntaxError(f"规则表达式中应为 {kind}，实际为 {found!r}")
+        pos += 1
+        return tokens[pos - 1][1]
+
+    def parse_or():
+        items = [parse_and()]
+        while peek() == "OR":
+            take("OR")
+            items.append(parse_and())
+        return items[0] if len(items) == 1 else ("or", items)
+
+    def parse_and():
+        items = [parse_not()]
+        while peek() == "AND":
+            take("AND")
+            items.append(parse_not())
+        return items[0] if len(items) == 1 else ("and", items)
+
+    def parse_not():
+        if peek() == "NOT":
+            take("NOT")
+            return ("not", parse_not())
+        if peek() == "(":
+            take("(")
+            node = parse_or()
+            take(")")
+            return node
+        term = take("TERM")
+        if not term.strip():
+            raise RuleSyntaxError("规则中存在空关键词")
+        if term.lower().startswith(SET_REFERENCE_PREFIX):
+            set_id = term[len(SET_REFERENCE_PREFIX):]
+            if not set_id.isdigit():
+                raise RuleSyntaxError(f"无效的关键词组引用 {term!r}，应为 set:<关键词组ID>")
+            return ("term", f"{SET_REFERENCE_PREFIX}{int(set_id)}")
+        if term.startswith(REGEX_PREFIX):
+            try:
+                re.compile(term[len(REGEX_PREFIX):])
+            except re.error as e:
+                raise RuleSyntaxError(f"无效的正则关键词 {term!r}: {e}")
+        return ("term", term)
+
+    if not tokens:
+        raise RuleSyntaxError("规则表达式不能为空")
+    tree = parse_or()
+    if pos != len(tokens):
+        raise RuleSyntaxError(f"规则表达式多余的内容: {tokens[pos][1]!r}")
+    return tree
+
+
+def _term_key(term: str) -> str:
+    """同一关键词的不同写法共用一位：字面量不区分大小写"""
+    return term if term.startswith(REGEX_PREFIX) else term.lower()
+
+
+def _set_reference(key: str) -> Optional[int]:
+    """项为关键词组引用时返回关键词组ID"""
+    return int(key[len(SET_REFERENCE_PREFIX):]) if key.startswith(SET_REFERENCE_PREFIX) else None
+
+
+def rule_set_references(expression: str) -> List[int]:
+    """规则引用的关键词组ID"""
+    def walk(node):
+        if node[0] == "term":
+            set_id = _set_reference(node[1])
+            return [set_id] if set_id is not None else []
+        if node[0] == "not":
+            return walk(node[1])
+        return [set_id for child in node[1] for set_id in walk(child)]
+    return list(dict.fromkeys(walk(parse_rule(expression))))
+
+
+def to_dnf(node, negate: bool = False) -> List[Tuple[frozenset, frozenset]]:
+    """化为析取范式：[(必须出现的项, 不得出现的项), ...]，去掉自相矛盾的子句"""
+    kind = node[0]
+    if kind == "term":
+        key = _term_key(node[1])
+        return [(frozenset(), frozenset([key]))] if negate else [(frozenset([key]), frozenset())]
+    if kind == "not":
+        return to_dnf(node[1], not negate)
+
+    children = [to_dnf(child, negate) for child in node[1]]
+    if (kind == "or") != negate:
+        # OR（或 NOT AND）：子句直接并列
+        return [clause for child in children for clause in child]
+
+    # AND（或 NOT OR）：子句两两组合
+    clauses = [(frozenset(), frozenset())]
+    for child in children:
+        clauses = [
+            (pos | child_pos, neg | child_neg)
+            for pos, neg in clauses
+            for child_pos, child_neg in child
+            if not (pos | child_pos) & (neg | child_neg)
+        ]
+        if len(clauses) > MAX_RULE_CLAUSES:
+            raise RuleSyntaxError(f"规则过于复杂（析取范式超过 {MAX_RULE_CLAUSES} 个子句）")
+    return clauses
+
+
+def validate_rule_expression(expression: str):
+    """校验规则表达式（语法、正则、复杂度）"""
+    to_dnf(parse_rule(expression))
+
+
+class CompiledRule:
+    def __init__(self, rule_id: int, name: str, expression: str, level: str, sections, term_bits: Dict[str, int]):
+        self.id = rule_id
+        self.name = name
+        self.level = level
+        self.prefixes = parse_scopes(sections)
+        self.clauses: List[Tuple[int, int]] = []
+        for pos, neg in to_dnf(parse_rule(expression)):
+            required = forbidden = 0
+            for key in pos:
+                required |= term_bits.setdefault(key, 1 << len(term_bits))
+            for key in neg:
+                forbidden |= term_bits.setdefault(key, 1 << len(term_bits))
+            self.clauses.append((required, forbidden))
+
+    def in_scope(self, section: str) -> bool:
+        return self.prefixes is None or section.startswith(self.prefixes)
+
+    def match(self, mask: int) -> Optional[Tuple[int, int]]:
+        """返回第一个成立的子句，都不成立返回 None"""
+        for required, forbidden in self.clauses:
+            if mask & required == required and not mask & forbidden:
+                return required, forbidden
+        return None
+
+
+class RuleEngine:
+    """多条规则共用一个自动机，逐文件求值"""
+
+    def __init__(self, rules, keyword_sets: Dict[int, List[str]] = None, max_line_masks: int = 200_000):
+        """
+        :param rules: 规则列表（models.KeywordRule，sections 为逗号分隔的区块作用域）
+        :param keyword_sets: 规则引用的关键词组：关键词组ID -> 关键词列表
+        :param max_line_masks: 行位图缓存的最大条目数（同 LineMatchMemo，达到上限后不再新增）
+        """
+        self.term_bits: Dict[str, int] = {}  # 项 -> 位
+        self.rules = [
+            CompiledRule(rule.id, rule.name, rule.expression, rule.level or "section", rule.sections, self.term_bits)
+            for rule in rules
+        ]
+        # 关键词（规范化写法）-> 位：直接出现在规则中的项占自己的位，被引用关键词组中的关键词同时置该组的位
+        self.keyword_masks: Dict[str, int] = {}
+        for key, bit in self.term_bits.items():
+            set_id = _set_reference(key)
+            if set_id is None:
+                self.keyword_masks[key] = self.keyword_masks.get(key, 0) | bit
+                continue
+            if keyword_sets is None or set_id not in keyword_sets:
+                raise ValueError(f"规则引用的关键词组 {set_id} 不存在")
+            for word in keyword_sets[set_id]:
+                if word.strip():
+                    word_key = _term_key(word)
+                    self.keyword_masks[word_key] = self.keyword_masks.get(word_key, 0) | bit
+        self.matcher = ConfigKeywordMatcher(list(self.keyword_masks))
+        self.bit_terms = {bit: key for key, bit in self.term_bits.items()}
+        self.max_line_masks = max_line_masks
+        self._line_masks: Dict[str, int] = {}
+
+    def line_mask(self, line: str) -> int:
+        mask = self._line_masks.get(line)
+        if mask is None:
+            mask = 0
+            for hit in self.matcher.match_line(line):
+                mask |= self.keyword_masks[_term_key(hit)]
+            # 达到上限后不再新增，已缓存的（通常是最常见的）行继续生效
+            if len(self._line_masks) < self.max_line_masks:
+                self._line_masks[line] = mask
+        return mask
+
+    def terms_of(self, mask: int) -> List[str]:
+        return [term for bit, term in self.bit_terms.items() if mask & bit]
+
+    def evaluate(self, raw_data: str, vendor: str = "unknown") -> dict:
+        """
+        返回 {"vendor", "findings": {规则ID: [...]}}
+        - 区块级规则：{"section", "line"(区块首行), "evidence": [{"line", "terms", "content"}]}
+        - 行级规则：{"section", "line", "terms", "content"}
+        """
+        sections = self.matcher.build_sections(raw_data)
+
+        # 一次扫描：只计算至少在一条规则作用域内的区块中的行
+        line_masks: Dict[int, int] = {}
+        for section, lines in sections.items():
+            if not any(rule.in_scope(section) for rule in self.rules):
+                continue
+            for line_content, line_num in lines:
+                if line_num not in line_masks:
+                    line_masks[line_num] = self.line_mask(line_content)
+
+        findings = {}
+        for rule in self.rules:
+            rule_findings = []
+            for section, lines in sections.items():
+                if not rule.in_scope(section):
+                    continue
+                if rule.level == "line":
+                    for line_content, line_num in lines:
+                        mask = line_masks[line_num]
+                        if rule.match(mask):
+                            rule_findings.append({"section": section, "line": line_num,
+                                                  "terms": self.terms_of(mask), "content": line_content.strip()})
+                    continue
+
+                section_mask = 0
+                for _, line_num in lines:
+                    section_mask |= line_masks[line_num]
+                clause = rule.match(section_mask)
+                if clause is None:
+                    continue
+                required = clause[0]
+                evidence = [
+                    {"line": line_num, "terms": self.terms_of(line_masks[line_num] & required),
+                     "content": line_content.strip()}
+                    for line_content, line_num in lines
+                    if line_masks[line_num] & required
+                ]
+                rule_findings.append({"section": section, "line": lines[0][1], "evidence": evidence})
+            if rule_findings:
+                findings[rule.id] = rule_findings
+
+        return {"vendor": vendor, "findings": findings}
+
+
+def perform_rule_evaluation(db: Session, batch_id: int, rule_ids: List[int] = None) -> List[dict]:
+    """对批次中的初次清洗文件求值规则（未指定规则时使用全部规则）"""
+    if rule_ids:
+        rules = crud.get_keyword_rules_by_ids(db, rule_ids)
+        missing = set(rule_ids) - {rule.id for rule in rules}
+        if missing:
+            raise ValueError(f"规则不存在: {sorted(missing)}")
+    else:
+        rules = crud.get_keyword_rules(db, limit=None)
+    if not rules:
+        raise ValueError("没有可用的规则")
+
+    cleaned_files = crud.get_cleaned_files_1_by_batch(db, batch_id=batch_id)
+    if not cleaned_files:
+        raise ValueError(f"批次 {batch_id} 没有初次清洗文件")
+
+    set_ids = {set_id for rule in rules for set_id in rule_set_references(rule.expression)}
+    keyword_sets = {}
+    for set_id in set_ids:
+        if crud.get_keyword_set(db, set_id) is None:
+            raise ValueError(f"规则引用的关键词组 {set_id} 不存在")
+        keyword_sets[set_id] = list(crud.iter_keyword_values(db, set_id))
+
+    engine = RuleEngine(rules, keyword_sets)
+    results = []
+    for file in cleaned_files:
+        try:
+            with open(file.file_path, 'r', encoding='utf-8') as f:
+                raw_data = f.read()
+            result = engine.evaluate(raw_data, vendor=detect_vendor(raw_data.splitlines()))
+        except Exception as e:
+            print(f"规则求值 {file.filename} 失败: {str(e)}")
+            continue
+        results.append({"file_id": file.id, "filename": file.filename, **result})
+    return results
@@ -0,0 +1,392 @@
+"""
+设备快照与增量处理
+
+同一设备（按主机名识别）的相邻两次配置通常只差几行。初次清洗后的文件按厂商的安全区块边界
+（见 clean_2.iter_block_boundaries）切分，每个区块记录内容哈希、二次清洗的解析结果和关键词命中。
+下一批次中哈希未变的区块直接继承上一次的结果，只重新处理变化的区块；
+同一份区块哈希序列也用于计算配置漂移（diff），无需额外扫描。
+"""
+import bisect
+import difflib
+import hashlib
+import json
+import os
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .. import crud, schemas
+from .clean_2 import detect_vendor, detect_hostname, iter_block_boundaries, parse_vendor_lines, merge_parsed_parts
+from .keyword_service import ConfigKeywordMatcher, LineMatchMemo, MultiSetMatcher, assemble_section_matches
+from .parallel_service import parse_blocks_parallel
+
+# 快照格式版本：区块划分或存储结构变化时递增，旧快照不再复用
+SNAPSHOT_FORMAT = 1
+# checkpoint / unknown 逐行无状态，按内容定义切分点（行哈希低 4 位为 0，平均约 16 行一块），
+# 插入或删除行只影响所在区块，不会使后续区块整体错位
+_CDC_MASK = 0xF
+_STATELESS_VENDORS = ("checkpoint", "unknown")
+_HUNK_HEADER = re.compile(r"^@@ -(\d+)(,\d+)? \+(\d+)(,\d+)? @@")
+
+
+def block_hash(lines: List[str]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for line in lines:
+        digest.update(line.encode("utf-8", "surrogatepass"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def split_snapshot_blocks(raw_lines: List[str], vendor: str) -> List[Tuple[int, int]]:
+    """按区块边界切分全部行，返回 [(起始下标, 结束下标), ...]"""
+    blocks = []
+    start = 0
+    for boundary in iter_block_boundaries(raw_lines, vendor):
+        if vendor in _STATELESS_VENDORS and \
+                zlib.crc32(raw_lines[boundary].encode("utf-8", "surrogatepass")) & _CDC_MASK:
+            continue
+        blocks.append((start, boundary))
+        start = boundary
+    blocks.append((start, len(raw_lines)))
+    return blocks
+
+
+def snapshot_path_for(cleaned1_path: str) -> str:
+    """快照文件与批次目录放在一起：batch_x/snapshot/<初次清洗文件名>.snapshot.json"""
+    batch_dir = os.path.dirname(os.path.dirname(cleaned1_path))
+    return os.path.join(batch_dir, "snapshot", os.path.basename(cleaned1_path) + ".snapshot.json")
+
+
+def load_snapshot(path: str) -> Optional[dict]:
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if snapshot.get("format") != SNAPSHOT_FORMAT:
+        return None
+    return snapshot
+
+
+def save_snapshot(path: str, snapshot: dict):
+    """先写临时文件再替换，避免中断时留下半个快照"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+def build_snapshot(raw_lines: List[str], vendor: str, content_hash: str = None,
+                   previous: dict = None, parallel: bool = False) -> Tuple[dict, dict, int]:
+    """
+    增量解析：哈希与上一快照相同的区块直接继承其解析结果和关键词命中，其余区块重新解析
+    :param raw_lines: 初次清洗后的全部行（不含换行符）
+    :return: (与 parse_config_lines 一致的解析结果, 新快照, 复用的区块数)
+    """
+    reusable = {}
+    if previous and previous.get("vendor") == vendor:
+        reusable = {block["hash"]: block for block in previous["blocks"]}
+
+    entries = []
+    pending = []
+    for start, end in split_snapshot_blocks(raw_lines, vendor):
+        block_lines = raw_lines[start:end]
+        entry = {"hash": block_hash(block_lines), "start": start, "length": end - start, "parsed": None, "hits": {}}
+        prev = reusable.get(entry["hash"])
+        if prev is not None:
+            entry["parsed"] = prev["parsed"]
+            entry["hits"] = dict(prev.get("hits", {}))
+        else:
+            pending.append((entry, [line.rstrip() for line in block_lines if line.strip()]))
+        entries.append(entry)
+
+    if parallel and len(pending) > 1:
+        parts = parse_blocks_parallel([lines for _, lines in pending], vendor)
+    else:
+        parts = [parse_vendor_lines(lines, vendor) for _, lines in pending]
+    for (entry, _), part in zip(pending, parts):
+        entry["parsed"] = part
+
+    parsed = merge_parsed_parts([entry["parsed"] for entry in entries], vendor)
+    snapshot = {
+        "format": SNAPSHOT_FORMAT,
+        "content_hash": content_hash,
+        "hostname": parsed.get("hostname"),
+        "vendor": vendor,
+        "line_count": len(raw_lines),
+        "blocks": entries,
+    }
+    return parsed, snapshot, len(entries) - len(pending)
+
+
+def snapshot_config_file(db: Session, cleaned_file, batch_id: int, parallel: bool = False) -> dict:
+    """
+    二次清洗的增量版本：按主机名找到该设备上一批次的快照，只解析变化的区块，
+    并保存本批次快照。返回解析结果（与 parse_config_file 一致）
+    """
+    with open(cleaned_file.file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        raw_lines = f.read().splitlines()
+    vendor = detect_vendor([line.rstrip() for line in raw_lines if line.strip()])
+
+    previous = None
+    hostname = detect_hostname(raw_lines, vendor)
+    if hostname:
+        previous_row = crud.get_previous_snapshot(db, hostname, batch_id)
+        if previous_row:
+            previous = load_snapshot(previous_row.snapshot_path)
+
+    parsed, snapshot, reused = build_snapshot(raw_lines, vendor, cleaned_file.content_hash, previous, parallel)
+    path = snapshot_path_for(cleaned_file.file_path)
+    save_snapshot(path, snapshot)
+    crud.save_device_snapshot(db, schemas.DeviceSnapshotCreate(
+        hostname=snapshot["hostname"],
+        vendor=vendor,
+        batch_id=batch_id,
+        cleaned_file_1_id=cleaned_file.id,
+        snapshot_path=path
+    ))
+    if previous:
+        print(f"[增量处理] {cleaned_file.filename}: 区块 {len(snapshot['blocks'])}，复用 {reused}")
+    return parsed
+
+
+def _set_block_hits(block: dict, hits_key: str, block_hits: Dict[str, list]):
+    """写入某关键词组的命中，同时丢弃该关键词组旧版本的命中"""
+    set_prefix = hits_key.split(":", 1)[0] + ":"
+    hits = {key: value for key, value in block["hits"].items() if not key.startswith(set_prefix)}
+    hits[hits_key] = block_hits
+    block["hits"] = hits
+
+
+def has_block_hits(snapshot: dict, hits_key: str) -> bool:
+    return any(hits_key in block["hits"] for block in snapshot["blocks"])
+
+
+def match_with_snapshot(matcher: ConfigKeywordMatcher, raw_data: str, snapshot: dict, hits_key: str,
+                        vendor: str = None, memo: LineMatchMemo = None) -> Tuple[dict, int]:
+    """
+    增量关键词匹配：快照中已有该关键词组命中的区块直接按偏移还原行号，其余区块逐行匹配并回写快照
+    设置了区块作用域时只匹配作用域内区块的行；只扫描了部分行的区块命中不完整，不回写快照
+    结果与 ConfigKeywordMatcher.search_config_data 一致
+    :return: (匹配结果, 复用的区块数)
+    """
+    sections = matcher.build_sections(raw_data)
+    scan_lines = None
+    if matcher.scoped:
+        scan_lines = {line_num for section, lines in sections.items() if matcher.scope.section_in_scope(section)
+                      for _, line_num in lines}
+        if not scan_lines:
+            # 没有作用域内的区块：整个文件无需扫描
+            return assemble_section_matches({}, {}, vendor or snapshot["vendor"]), 0
+
+    match_line = memo.match_line if memo is not None else matcher.match_line
+    raw_lines = raw_data.splitlines()
+    line_hits = {}
+    reused = 0
+    for block in snapshot["blocks"]:
+        start = block["start"]
+        cached = block["hits"].get(hits_key)
+        if cached is not None:
+            for offset, keywords in cached.items():
+                line_hits[start + int(offset) + 1] = tuple(keywords)
+            reused += 1
+            continue
+
+        offsets = range(block["length"])
+        if scan_lines is not None:
+            offsets = [offset for offset in offsets if start + offset + 1 in scan_lines]
+        block_hits = {}
+        for offset in offsets:
+            hits = match_line(raw_lines[start + offset])
+            if hits:
+                block_hits[str(offset)] = list(hits)
+                line_hits[start + offset + 1] = hits
+        if len(offsets) == block["length"]:
+            _set_block_hits(block, hits_key, block_hits)
+
+    return assemble_section_matches(sections, line_hits, vendor or snapshot["vendor"], scope=matcher.scope), reused
+
+
+def match_multi_with_snapshot(matcher: MultiSetMatcher, raw_data: str, snapshot: dict, hits_keys: Dict[int, str],
+                              vendor: str = None, memo: LineMatchMemo = None) -> Tuple[Dict[int, dict], int]:
+    """
+    多关键词组的增量匹配：区块中已有某组命中时直接还原，只有缺少命中的组需要扫描该区块，
+    每行仍只经过合并自动机一次；扫描完整的区块按组回写快照
+    结果与 MultiSetMatcher.search_config_data 中对应关键词组的结果一致
+    :param hits_keys: 需要计算的关键词组ID -> 快照命中键
+    :return: (关键词组ID -> 匹配结果, 完全复用的区块数)
+    """
+    sections = matcher.matcher.build_sections(raw_data)
+    scopes = [matcher.scopes[set_id] for set_id in hits_keys]
+    scan_lines = None
+    if all(scope.scoped for scope in scopes):
+        scan_lines = {line_num for section, lines in sections.items()
+                      if any(scope.section_in_scope(section) for scope in scopes) for _, line_num in lines}
+
+    match_line = memo.match_line if memo is not None else matcher.matcher.match_line
+    raw_lines = raw_data.splitlines()
+    line_hits = {set_id: {} for set_id in hits_keys}
+    reused = 0
+    for block in snapshot["blocks"]:
+        start = block["start"]
+        missing = []
+        for set_id, hits_key in hits_keys.items():
+            cached = block["hits"].get(hits_key)
+            if cached is None:
+                missing.append(set_id)
+                continue
+            for offset, keywords in cached.items():
+                line_hits[set_id][start + int(offset) + 1] = tuple(keywords)
+        if not missing:
+            reused += 1
+            continue
+
+        offsets = range(block["length"])
+        if scan_lines is not None:
+            offsets = [offset for offset in offsets if start + offset + 1 in scan_lines]
+        block_hits = {set_id: {} for set_id in missing}
+        for offset in offsets:
+            hits = match_line(raw_lines[start + offset])
+            if not hits:
+                continue
+            for set_id, words in matcher.split_hits(hits).items():
+                if set_id in block_hits:
+                    block_hits[set_id][str(offset)] = words
+                    line_hits[set_id][start + offset + 1] = tuple(words)
+        if len(offsets) == block["length"]:
+            for set_id in missing:
+                _set_block_hits(block, hits_keys[set_id], block_hits[set_id])
+
+    vendor = vendor or snapshot["vendor"]
+    return {
+        set_id: assemble_section_matches(sections, line_hits[set_id], vendor, scope=matcher.scopes[set_id])
+        for set_id in hits_keys
+    }, reused
+
+
+def record_match_hits(snapshot: dict, hits_key: str, match_result: dict):
+    """
+    由完整匹配结果反推逐行命中并写入快照（用于复用缓存或并行匹配的情况）
+    每一行都至少属于一个区块（未覆盖的行归入 global），同一行在每个区块中的命中都是完整的；
+    按区块作用域过滤过的结果不完整，不能用于反推
+    """
+    line_hits = {}
+    for matches in match_result["matches"].values():
+        seen = set()
+        for match in matches:
+            line_num = match["line"]
+            if line_num in line_hits and line_num not in seen:
+                continue
+            seen.add(line_num)
+            line_hits.setdefault(line_num, []).append(match["keyword"])
+
+    blocks = snapshot["blocks"]
+    starts = [block["start"] for block in blocks]
+    per_block = [{} for _ in blocks]
+    for line_num, keywords in line_hits.items():
+        idx = bisect.bisect_right(starts, line_num - 1) - 1
+        per_block[idx][str(line_num - 1 - blocks[idx]["start"])] = keywords
+    for block, block_hits in zip(blocks, per_block):
+        _set_block_hits(block, hits_key, block_hits)
+
+
+def _block_lines(lines: List[str], blocks: List[dict], first: int, last: int) -> Tuple[int, List[str]]:
+    """返回区块 [first, last) 覆盖的 (起始行下标, 行列表)"""
+    if first >= last:
+        start = blocks[first]["start"] if first < len(blocks) else len(lines)
+        return start, []
+    start = blocks[first]["start"]
+    end = blocks[last - 1]["start"] + blocks[last - 1]["length"]
+    return start, lines[start:end]
+
+
+def _rebase_hunk_header(line: str, old_offset: int, new_offset: int) -> str:
+    """把片段内 diff 的 @@ 行号换算为文件中的绝对行号"""
+    m = _HUNK_HEADER.match(line)
+    if not m:
+        return line
+    old_line = int(m.group(1)) + old_offset
+    new_line = int(m.group(3)) + new_offset
+    return f"@@ -{old_line}{m.group(2) or ''} +{new_line}{m.group(4) or ''} @@"
+
+
+def diff_snapshots(previous: dict, current: dict, previous_lines: List[str], current_lines: List[str],
+                   context: int = 3) -> dict:
+    """
+    先比较两份快照的区块哈希序列，只对变化的区块做逐行 diff
+    """
+    prev_blocks = previous["blocks"]
+    cur_blocks = current["blocks"]
+    matcher = difflib.SequenceMatcher(None, [b["hash"] for b in prev_blocks], [b["hash"] for b in cur_blocks],
+                                      autojunk=False)
+    changes = []
+    unchanged = 0
+    added = removed = 0
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            unchanged += i2 - i1
+            continue
+        old_start, old_lines = _block_lines(previous_lines, prev_blocks, i1, i2)
+        new_start, new_lines = _block_lines(current_lines, cur_blocks, j1, j2)
+        diff = [
+            _rebase_hunk_header(line, old_start, new_start)
+            for line in list(difflib.unified_diff(old_lines, new_lines, lineterm="", n=context))[2:]
+        ]
+        added += sum(1 for line in diff if line.startswith("+"))
+        removed += sum(1 for line in diff if line.startswith("-"))
+        changes.append({
+            "type": tag,
+            "section": (new_lines or old_lines or [""])[0].strip(),
+            "old_start": old_start + 1,
+            "old_lines": len(old_lines),
+            "new_start": new_start + 1,
+            "new_lines": len(new_lines),
+            "diff": diff,
+        })
+
+    return {
+        "unchanged_blocks": unchanged,
+        "changed_blocks": len(cur_blocks) - unchanged,
+        "added_lines": added,
+        "removed_lines": removed,
+        "changes": changes,
+    }
+
+
+def get_config_drift(db: Session, cleaned_file_1_id: int, context: int = 3) -> Optional[dict]:
+    """
+    初次清洗文件相对同一设备上一批次配置的漂移；没有快照时返回 None
+    """
+    current_row = crud.get_snapshot_by_cleaned_file_1(db, cleaned_file_1_id)
+    current = load_snapshot(current_row.snapshot_path) if current_row else None
+    if current is None:
+        return None
+
+    result = {
+        "hostname": current_row.hostname,
+        "batch_id": current_row.batch_id,
+        "cleaned_file_1_id": cleaned_file_1_id,
+        "previous": None,
+    }
+    previous_row = crud.get_previous_snapshot(db, current_row.hostname, current_row.batch_id) \
+        if current_row.hostname else None
+    previous = load_snapshot(previous_row.snapshot_path) if previous_row else None
+    if previous is None:
+        return result
+
+    with open(current_row.cleaned_file_1.file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        current_lines = f.read().splitlines()
+    with open(previous_row.cleaned_file_1.file_path, 'r', encoding='utf-8', errors='ignore') as f:
+        previous_lines = f.read().splitlines()
+
+    result["previous"] = {
+        "batch_id": previous_row.batch_id,
+        "cleaned_file_1_id": previous_row.cleaned_file_1_id,
+    }
+    result.update(diff_snapshots(previous, current, previous_lines, current_lines, context=context))
+    return result
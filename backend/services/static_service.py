@@ -0,0 +1,184 @@
+"""
+前端页面和静态资源的缓存与预压缩
+
+启动时读取静态目录下的资源（上传目录除外），文本类资源预先压缩为 gzip（安装了 brotli 时另压缩为 br），
+按请求的 Accept-Encoding 选择版本返回；每个版本有强 ETag，带 If-None-Match 的条件请求命中时返回 304。
+文件名带内容哈希或版本号（如 app.3f2a9c1d.js、tailwindcss3.4.17.js）或请求带 ?v= 的资源长期缓存（immutable），
+其余资源（包括页面）要求浏览器每次用 ETag 校验。每次请求只 stat 一次文件，修改时间或大小变化时重新加载。
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+
+try:
+    import brotli
+except ImportError:  # 可选依赖：未安装时只提供 gzip
+    brotli = None
+
+# 预压缩的扩展名（woff/woff2、图片等本身已压缩）
+COMPRESSIBLE_EXTENSIONS = {".html", ".htm", ".js", ".mjs", ".css", ".svg", ".json", ".map", ".txt", ".ttf", ".eot"}
+# 压缩后不小于原大小的该比例时不保留压缩版本
+MIN_COMPRESSION_RATIO = 0.9
+# 超过该大小的文件不进入缓存，由 StaticFiles 直接从磁盘返回（默认 8MB）
+STATIC_CACHE_MAX_FILE = int(os.environ.get("KY_STATIC_CACHE_MAX_FILE_MB", "8")) * 1024 * 1024
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+# 文件名中的内容哈希（至少 8 位十六进制）或版本号
+_VERSIONED_NAME = re.compile(r"(?:[.\-_][0-9a-f]{8,}|\d+\.\d+\.\d+)\.\w+$", re.IGNORECASE)
+
+
+def is_versioned_name(path: str) -> bool:
+    return bool(_VERSIONED_NAME.search(os.path.basename(path)))
+
+
+def _accepted_encodings(accept_encoding: str) -> set:
+    encodings = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match 使用弱比较"""
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class _Asset:
+    __slots__ = ("stat_key", "media_type", "bodies", "etags")
+
+    def __init__(self, stat_key, media_type: str, content: bytes, compress: bool):
+        self.stat_key = stat_key
+        self.media_type = media_type
+        digest = hashlib.sha256(content).hexdigest()[:32]
+        # 编码 -> 内容，按优先顺序（br、gzip、原文）；各编码的 ETag 不同
+        self.bodies = {}
+        if compress and brotli is not None:
+            self._add_compressed("br", brotli.compress(content), len(content))
+        if compress:
+            self._add_compressed("gzip", gzip.compress(content, compresslevel=9, mtime=0), len(content))
+        self.bodies["identity"] = content
+        self.etags = {encoding: f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+                      for encoding in self.bodies}
+
+    def _add_compressed(self, encoding: str, body: bytes, original_size: int):
+        if len(body) < original_size * MIN_COMPRESSION_RATIO:
+            self.bodies[encoding] = body
+
+    def response(self, request_headers: Headers, immutable: bool) -> Response:
+        accepted = _accepted_encodings(request_headers.get("accept-encoding", ""))
+        encoding = next((e for e in self.bodies if e == "identity" or e in accepted), "identity")
+        headers = {
+            "ETag": self.etags[encoding],
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+        }
+        if len(self.bodies) > 1:
+            headers["Vary"] = "Accept-Encoding"
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match and _etag_matches(if_none_match, self.etags[encoding]):
+            return Response(status_code=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(self.bodies[encoding], media_type=self.media_type, headers=headers)
+
+
+class AssetCache:
+    """目录下资源的内存缓存（键为相对路径），按 (修改时间, 大小) 失效"""
+
+    def __init__(self, directory: str, exclude=()):
+        self.directory = os.path.realpath(directory)
+        # 不缓存的子目录（相对路径），如上传目录
+        self.exclude = tuple(os.path.normpath(e) for e in exclude)
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def _full_path(self, path: str):
+        path = os.path.normpath(path.lstrip("/"))
+        if path == "." or any(path == e or path.startswith(e + os.sep) for e in self.exclude):
+            return None
+        full_path = os.path.realpath(os.path.join(self.directory, path))
+        if not full_path.startswith(self.directory + os.sep):
+            return None
+        return full_path
+
+    def get(self, path: str):
+        """返回缓存的资源；不存在、被排除或过大（应由磁盘直接返回）时返回 None"""
+        full_path = self._full_path(path)
+        if full_path is None:
+            return None
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            return None
+        if not os.path.isfile(full_path) or st.st_size > STATIC_CACHE_MAX_FILE:
+            return None
+        stat_key = (st.st_mtime_ns, st.st_size)
+        asset = self._assets.get(full_path)
+        if asset is not None and asset.stat_key == stat_key:
+            return asset
+
+        with open(full_path, "rb") as f:
+            content = f.read()
+        ext = os.path.splitext(full_path)[1].lower()
+        media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        if media_type.startswith("text/") or media_type in ("application/javascript", "application/json"):
+            media_type += "; charset=utf-8"
+        asset = _Asset(stat_key, media_type, content, compress=ext in COMPRESSIBLE_EXTENSIONS)
+        with self._lock:
+            self._assets[full_path] = asset
+        return asset
+
+    def preload(self) -> int:
+        """启动时加载并预压缩目录下的全部资源，返回加载的文件数"""
+        count = 0
+        for root, dirs, files in os.walk(self.directory):
+            rel_root = os.path.relpath(root, self.directory)
+            dirs[:] = [d for d in dirs if self._full_path(os.path.join(rel_root, d)) is not None]
+            for name in files:
+                if self.get(os.path.join(rel_root, name)) is not None:
+                    count += 1
+        return count
+
+    def response(self, path: str, request_headers: Headers, versioned: bool = False):
+        """返回资源的响应（200 或 304）；不在缓存范围内时返回 None"""
+        asset = self.get(path)
+        if asset is None:
+            return None
+        return asset.response(request_headers, immutable=versioned or is_versioned_name(path))
+
+
+class CachedStaticFiles(StaticFiles):
+    """先从 AssetCache 返回资源，缓存范围外的（目录、被排除的子目录、超大文件）交给 StaticFiles"""
+
+    def __init__(self, *, directory: str, exclude=(), **kwargs):
+        super().__init__(directory=directory, **kwargs)
+        self.cache = AssetCache(directory, exclude=exclude)
+        self.cache.preload()
+
+    async def get_response(self, path: str, scope) -> Response:
+        if scope["method"] in ("GET", "HEAD"):
+            if self.html and path == ".":
+                path = "index.html"
+            versioned = any(p.startswith(b"v=") for p in scope.get("query_string", b"").split(b"&"))
+            response = self.cache.response(path, Headers(scope=scope), versioned=versioned)
+            if response is not None:
+                return response
+        return await super().get_response(path, scope)
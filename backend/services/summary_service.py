@@ -0,0 +1,102 @@
+"""
+批次统计与设备趋势
+
+批次完成（任务执行完毕或重新执行关键词匹配）时一次性计算批次统计并写入 batch_summaries：
+各阶段文件数和字节数、厂商分布、各关键词和各设备的命中数。批次对设备趋势的贡献
+（按天、关键词组、主机名、关键词的命中数）同时累加到 fleet_rollups；重新计算时先扣除旧贡献，
+批次被清理时在同一事务中扣除，因此仪表盘接口只需一次按索引的查询。
+只统计每个文件、每个关键词组最新的匹配结果，内容以数据库为准（结果文件按文件名共用，会被其他关键词组的匹配覆盖）。
+"""
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy.orm import Session
+
+from .. import crud
+from .keyword_service import count_keyword_hits
+
+# 快照中没有厂商信息时的厂商名
+UNKNOWN_VENDOR = "unknown"
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
+
+def _device_name(filename: str) -> str:
+    """没有快照（未识别主机名）时按匹配结果文件名（<名称>_matches[_set<ID>].json）归入设备"""
+    name = os.path.basename(filename or "")
+    return name.split("_matches")[0] if "_matches" in name else os.path.splitext(name)[0]
+
+
+def build_batch_summary(db: Session, batch) -> tuple:
+    """计算批次统计，返回 (日期, 统计字段, 设备趋势贡献 [[关键词组ID, 主机名, 关键词, 命中数]])"""
+    counts = {"original": 0, "cleaned_1": 0, "cleaned_2": 0}
+    sizes = dict.fromkeys(counts, 0)
+    for stage, path in crud.get_batch_file_paths(db, batch.id):
+        if stage in counts:
+            counts[stage] += 1
+            sizes[stage] += _file_size(path)
+
+    # 一次清洗文件 -> 主机名 / 厂商（来自设备快照）
+    hostnames = {}
+    vendors = {}
+    for snapshot in crud.get_snapshots_by_batch(db, batch.id):
+        if snapshot.hostname:
+            hostnames[snapshot.cleaned_file_1_id] = snapshot.hostname
+        vendor = snapshot.vendor or UNKNOWN_VENDOR
+        vendors[vendor] = vendors.get(vendor, 0) + 1
+
+    results = crud.get_latest_match_results_by_batch(db, batch.id)
+    keyword_hits = {}
+    device_hits = {}
+    rollup = {}
+    for result in results:
+        # 匹配结果的 file_id 为一次清洗文件ID
+        hostname = hostnames.get(result.file_id) or _device_name(result.filename)
+        for keyword, hits in count_keyword_hits(json.loads(result.match_data or "{}")).items():
+            keyword_hits[keyword] = keyword_hits.get(keyword, 0) + hits
+            device_hits[hostname] = device_hits.get(hostname, 0) + hits
+            key = (result.keyword_set_id, hostname, keyword)
+            rollup[key] = rollup.get(key, 0) + hits
+
+    day = (batch.timestamp or datetime.utcnow()).strftime("%Y-%m-%d")
+    values = {
+        "original_files": counts["original"],
+        "cleaned_1_files": counts["cleaned_1"],
+        "cleaned_2_files": counts["cleaned_2"],
+        "match_results": len(results),
+        "original_bytes": sizes["original"],
+        "cleaned_1_bytes": sizes["cleaned_1"],
+        "cleaned_2_bytes": sizes["cleaned_2"],
+        "devices": len(set(hostnames.values()) | set(device_hits)),
+        "total_hits": sum(keyword_hits.values()),
+        "vendors": json.dumps(vendors, ensure_ascii=False),
+        "keyword_hits": json.dumps(keyword_hits, ensure_ascii=False),
+        "device_hits": json.dumps(device_hits, ensure_ascii=False),
+    }
+    contributions = [[set_id, hostname, keyword, hits] for (set_id, hostname, keyword), hits in sorted(rollup.items())]
+    return day, values, contributions
+
+
+def materialize_batch_summary(db: Session, batch_id: int):
+    """计算并保存批次统计（替换旧统计及其对设备趋势的贡献），批次不存在时返回 None"""
+    batch = crud.get_batch(db, batch_id)
+    if batch is None:
+        return None
+    day, values, contributions = build_batch_summary(db, batch)
+    return crud.save_batch_summary(db, batch_id, day, values, contributions)
+
+
+def refresh_batch_summary(db: Session, batch_id: int):
+    """批次完成后刷新统计；统计失败不影响批次处理结果"""
+    try:
+        return materialize_batch_summary(db, batch_id)
+    except Exception as e:
+        db.rollback()
+        print(f"批次 {batch_id} 统计失败: {str(e)}")
+        return None
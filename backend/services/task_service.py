@@ -0,0 +1,169 @@
+"""
+批次处理任务的执行：持久化任务队列 + 分阶段检查点
+
+批次任务保存在 batch_tasks 表中，工作进程（ky-match worker，或 API 进程内的线程）按租约领取，
+执行期间由心跳线程定期续约。每完成一个阶段记录检查点，各阶段均可重复执行：
+进程崩溃后租约过期，任务被其他工作进程领取，从最后完成的阶段之后继续。
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+
+from sqlalchemy.orm import Session
+
+from .. import crud
+from ..database import SessionLocal
+from .admission_service import admit_stage
+from .file_service import perform_first_cleaning, perform_second_cleaning
+from .keyword_service import perform_keyword_check
+from .summary_service import refresh_batch_summary
+
+# inline：上传请求所在进程直接执行自己的任务（进程内另有线程接管崩溃遗留的任务）
+# external：API 只入队，由独立的 ky-match worker 进程执行
+WORKER_MODE = os.environ.get("KY_MATCH_WORKER_MODE", "inline")
+# 租约时长（秒），心跳间隔为其三分之一；超过租约未续约的任务可被其他工作进程接管
+TASK_LEASE_SECONDS = int(os.environ.get("KY_TASK_LEASE_SECONDS", "60"))
+TASK_MAX_ATTEMPTS = int(os.environ.get("KY_TASK_MAX_ATTEMPTS", "3"))
+# 失败后重试的等待时间（秒），按已尝试次数线性增加
+TASK_RETRY_DELAY = int(os.environ.get("KY_TASK_RETRY_DELAY", "10"))
+# 队列为空时的轮询间隔（秒）
+WORKER_POLL_INTERVAL = float(os.environ.get("KY_WORKER_POLL_INTERVAL", "2"))
+
+
+class LeaseLost(Exception):
+    """租约已被其他工作进程接管，当前进程应停止处理该任务"""
+
+
+def _match_stage(db: Session, task):
+    if task.keyword_set_id is not None:
+        perform_keyword_check(db=db, batch_id=task.batch_id, keyword_set_id=task.keyword_set_id)
+
+
+# 按顺序执行的阶段：(名称, 函数)，函数需可重复执行，可返回被跳过的文件 ["文件名: 原因"]
+TASK_STAGES = (
+    ("clean_1", lambda db, task: perform_first_cleaning(task.batch_id, db)),
+    ("clean_2", lambda db, task: perform_second_cleaning(task.batch_id, db)),
+    ("match", _match_stage),
+)
+
+
+def worker_id() -> str:
+    """工作者标识：主机名:进程号:随机后缀（同一进程内的多个线程互不相同）"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def create_task(db: Session, batch_id: int, keyword_set_id: int = None, owner: str = None):
+    return crud.create_batch_task(db, batch_id, keyword_set_id, owner=owner,
+                                  lease_seconds=TASK_LEASE_SECONDS, max_attempts=TASK_MAX_ATTEMPTS)
+
+
+class _Heartbeat:
+    """任务执行期间在后台线程中定期续约（使用独立会话）"""
+
+    def __init__(self, task_id: int, owner: str):
+        self.task_id = task_id
+        self.owner = owner
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"task-heartbeat-{task_id}", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(TASK_LEASE_SECONDS / 3):
+            db = SessionLocal()
+            try:
+                if not crud.renew_task_lease(db, self.task_id, self.owner, TASK_LEASE_SECONDS):
+                    self.lost = True
+                    return
+            except Exception as e:
+                # 数据库暂时不可用时下次再试，租约到期前仍有两次机会
+                print(f"任务 {self.task_id} 续约失败: {str(e)}")
+            finally:
+                db.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_batch_task(db: Session, task, owner: str) -> str:
+    """执行已领取的任务，从最后完成的阶段之后继续；返回任务的最终状态"""
+    names = [name for name, _ in TASK_STAGES]
+    start = names.index(task.stage) + 1 if task.stage in names else 0
+    # 阶段中被跳过的文件（如无法解码），任务完成时记入 last_error
+    skipped = []
+    with _Heartbeat(task.id, owner) as heartbeat:
+        try:
+            for name, stage in TASK_STAGES[start:]:
+                if heartbeat.lost:
+                    raise LeaseLost()
+                # 按内存 / CPU 预算准入，预算不足时排队（排队期间心跳照常续约）
+                with admit_stage(db, task.batch_id, name):
+                    skipped += stage(db, task) or []
+                if not crud.checkpoint_batch_task(db, task.id, owner, name):
+                    raise LeaseLost()
+            crud.update_batch_status(db, batch_id=task.batch_id, status="completed")
+            crud.release_batch_task(db, task.id, owner, "done",
+                                    error=f"跳过的文件: {'；'.join(skipped)}" if skipped else None)
+            refresh_batch_summary(db, task.batch_id)
+            return "done"
+        except LeaseLost:
+            db.rollback()
+            print(f"任务 {task.id} 的租约已被接管，停止处理")
+            return "lost"
+        except Exception as e:
+            db.rollback()
+            if task.attempts < task.max_attempts:
+                crud.release_batch_task(db, task.id, owner, "pending", error=str(e),
+                                        retry_delay=TASK_RETRY_DELAY * task.attempts)
+                print(f"任务 {task.id}（批次 {task.batch_id}）第 {task.attempts} 次执行失败，稍后重试: {str(e)}")
+                return "pending"
+            crud.release_batch_task(db, task.id, owner, "failed", error=str(e))
+            crud.update_batch_status(db, batch_id=task.batch_id, status="failed")
+            print(f"任务 {task.id}（批次 {task.batch_id}）失败: {str(e)}")
+            return "failed"
+
+
+def run_worker(owner: str = None, poll_interval: float = WORKER_POLL_INTERVAL, once: bool = False,
+               stop_event: threading.Event = None) -> int:
+    """
+    工作循环：领取并执行任务，队列为空时轮询等待；返回处理的任务数
+    :param once: 处理完当前可领取的任务后退出
+    """
+    owner = owner or worker_id()
+    stop_event = stop_event or threading.Event()
+    processed = 0
+    while not stop_event.is_set():
+        db = SessionLocal()
+        try:
+            crud.fail_exhausted_tasks(db)
+            task = crud.claim_batch_task(db, owner, TASK_LEASE_SECONDS)
+            if task is not None:
+                print(f"[worker {owner}] 领取任务 {task.id}（批次 {task.batch_id}，"
+                      f"第 {task.attempts} 次，已完成阶段: {task.stage or '无'}）")
+                started = time.monotonic()
+                status = run_batch_task(db, task, owner)
+                processed += 1
+                print(f"[worker {owner}] 任务 {task.id}: {status}，耗时 {time.monotonic() - started:.1f}s")
+                continue
+        except Exception as e:
+            print(f"[worker {owner}] 领取任务失败: {str(e)}")
+        finally:
+            db.close()
+        if once:
+            break
+        stop_event.wait(poll_interval)
+    return processed
+
+
+def start_embedded_worker() -> threading.Event:
+    """在当前进程中启动工作线程（接管崩溃遗留的任务），返回用于停止该线程的事件"""
+    stop_event = threading.Event()
+    threading.Thread(target=run_worker, kwargs={"stop_event": stop_event},
+                     name="batch-task-worker", daemon=True).start()
+    return stop_event
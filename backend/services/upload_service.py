@@ -0,0 +1,192 @@
+"""
+可续传的分块上传
+
+1. 创建会话（声明文件名、大小，可选 sha256）：同时创建批次（状态 uploading）和批次目录，
+   各文件直接写入批次的 original 目录；
+2. 按偏移 PUT 分块（请求体为原始字节，不经过 multipart 解析和临时文件）：分块按顺序追加，
+   与已接收部分重叠的字节跳过，超出已接收位置的分块返回当前位置，由客户端从该位置续传；
+   连接中断时已写入的字节保留，查询会话即可得到已接收的范围；
+3. 完成：校验大小和 sha256，登记原始文件并创建批次任务（文件已在批次目录中，不再复制）。
+sha256 边接收边计算；进程重启后第一次续传时从磁盘重新计算已接收部分。
+接收分块的协程只负责读取请求体，重新计算哈希、写文件和更新记录都在线程池中执行，不阻塞事件循环。
+未完成的会话超过 KY_UPLOAD_SESSION_TTL_HOURS 小时没有写入时由清理任务删除（见 retention_service，后台清理需开启）。
+"""
+import hashlib
+import os
+import threading
+from typing import AsyncIterator, List
+
+import anyio
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from .. import crud, schemas
+from .file_service import check_processing_capacity, create_batch_dir, start_batch_processing
+
+UPLOADING_STATUS = "uploading"
+# 从磁盘重新计算哈希时每次读取的字节数
+REHASH_BLOCK_SIZE = 1024 * 1024
+
+# 文件ID -> (已计算到的位置, sha256 对象)
+_hashers = {}
+# 正在写入的文件ID（同一文件同时只允许一个请求写入）
+_writing = set()
+_lock = threading.Lock()
+
+
+class UploadError(ValueError):
+    """请求不合法（文件名、大小、校验失败等）"""
+
+
+class UploadConflict(Exception):
+    """分块偏移超出已接收位置，或该文件正在被另一个请求写入"""
+
+    def __init__(self, message: str, received: int):
+        super().__init__(message)
+        self.received = received
+
+
+def _check_filename(filename: str) -> str:
+    if not filename or filename in (".", "..") or os.path.basename(filename) != filename or "\\" in filename:
+        raise UploadError(f"文件名不合法: {filename!r}")
+    return filename
+
+
+def create_upload(db: Session, request: schemas.UploadSessionCreate):
+    """创建上传会话、批次和批次目录（各文件先创建为空文件）"""
+    names = [_check_filename(f.filename) for f in request.files]
+    if len(set(names)) != len(names):
+        raise UploadError("文件名重复")
+
+    batch = crud.create_batch(db, schemas.BatchCreate(description=request.description))
+    crud.update_batch_status(db, batch_id=batch.id, status=UPLOADING_STATUS)
+    original_dir = os.path.join(create_batch_dir(batch.id), "original")
+    os.makedirs(original_dir, exist_ok=True)
+    files = []
+    for spec in request.files:
+        file_path = os.path.join(original_dir, spec.filename)
+        open(file_path, "wb").close()
+        files.append((spec.filename, file_path, spec.size, spec.sha256.lower() if spec.sha256 else None))
+    return crud.create_upload_session(db, batch.id, request.keyword_set_id, files)
+
+
+def _hasher_at(upload_file, position: int):
+    """位置 position 处的 sha256 状态：内存中没有（如进程重启）或位置不符时从磁盘重新计算"""
+    cached = _hashers.get(upload_file.id)
+    if cached is not None and cached[0] == position:
+        return cached[1]
+    hasher = hashlib.sha256()
+    remaining = position
+    with open(upload_file.file_path, "rb") as f:
+        while remaining > 0:
+            block = f.read(min(REHASH_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+
+def _open_at(upload_file, received: int):
+    """打开文件并定位到已接收位置，返回 (文件, 该位置的 sha256 状态)"""
+    hasher = _hasher_at(upload_file, received)
+    f = open(upload_file.file_path, "r+b")
+    try:
+        # 丢弃上次中断时写入但未记录的字节
+        f.truncate(received)
+        f.seek(received)
+    except OSError:
+        f.close()
+        raise
+    return f, hasher
+
+
+def _append(f, hasher, chunk: bytes):
+    f.write(chunk)
+    hasher.update(chunk)
+
+
+async def write_chunk(db: Session, upload_file, offset: int, chunks: AsyncIterator[bytes]) -> int:
+    """
+    从 offset 起写入分块，返回写入后已接收的字节数
+    中途出错（如客户端断开）时已写入的部分同样记录，异常继续向上抛出
+    :raises UploadConflict: offset 超出已接收位置，或该文件正在写入
+    :raises UploadError: 超出声明的文件大小
+    """
+    received = upload_file.received or 0
+    if offset > received:
+        raise UploadConflict(f"偏移 {offset} 超出已接收位置 {received}", received)
+    with _lock:
+        if upload_file.id in _writing:
+            raise UploadConflict("该文件正在被另一个请求写入", received)
+        _writing.add(upload_file.id)
+
+    position = received
+    skip = received - offset  # 与已接收部分重叠的字节
+    f = hasher = None
+    try:
+        f, hasher = await run_in_threadpool(_open_at, upload_file, received)
+        async for chunk in chunks:
+            if skip:
+                dropped = min(skip, len(chunk))
+                chunk = chunk[dropped:]
+                skip -= dropped
+            if not chunk:
+                continue
+            if position + len(chunk) > upload_file.size:
+                raise UploadError(f"超出声明的文件大小 {upload_file.size}")
+            await run_in_threadpool(_append, f, hasher, chunk)
+            position += len(chunk)
+    finally:
+        # 请求被取消时同样关闭文件并记录已写入的字节
+        with anyio.CancelScope(shield=True):
+            if f is not None:
+                await run_in_threadpool(f.close)
+            with _lock:
+                if hasher is not None:
+                    _hashers[upload_file.id] = (position, hasher)
+                _writing.discard(upload_file.id)
+            if position != received:
+                await run_in_threadpool(crud.set_upload_received, db, upload_file, position)
+    return position
+
+
+def _verify_file(db: Session, upload_file) -> List[str]:
+    problems = []
+    if (upload_file.received or 0) != upload_file.size:
+        problems.append(f"{upload_file.filename}: 已接收 {upload_file.received or 0}/{upload_file.size} 字节")
+    elif upload_file.sha256:
+        digest = _hasher_at(upload_file, upload_file.size).hexdigest()
+        if digest != upload_file.sha256:
+            # 内容损坏：清空该文件，由客户端从头重传
+            problems.append(f"{upload_file.filename}: sha256 不一致，需从头重新上传")
+            with _lock:
+                _hashers.pop(upload_file.id, None)
+            open(upload_file.file_path, "wb").close()
+            crud.set_upload_received(db, upload_file, 0)
+    return problems
+
+
+def finalize_upload(db: Session, session):
+    """
+    完成上传：校验后登记原始文件并创建批次任务（inline 模式下执行完毕后返回），返回批次
+    已完成的会话重复调用时直接返回批次（任务创建前中断的补建任务）
+    :raises UploadError: 文件未接收完整或校验失败
+    :raises AdmissionRejected: 处理队列已满（会话保持未完成，可稍后重试）
+    """
+    batch = crud.get_batch(db, session.batch_id)
+    if session.status == "finalized":
+        if crud.get_batch_tasks_by_batch(db, batch.id):
+            return batch
+        return start_batch_processing(db, batch, session.keyword_set_id)
+
+    problems = [problem for upload_file in session.files for problem in _verify_file(db, upload_file)]
+    if problems:
+        raise UploadError("；".join(problems))
+    check_processing_capacity(db)
+    crud.finalize_upload_session(db, session)
+    with _lock:
+        for upload_file in session.files:
+            _hashers.pop(upload_file.id, None)
+    crud.update_batch_status(db, batch_id=batch.id, status="processing")
+    return start_batch_processing(db, batch, session.keyword_set_id)
@@ -0,0 +1,163 @@
+"""
+监视目录导入
+
+定期扫描配置的本地目录（如每晚的配置备份目录），把新增或变化的文件分批导入处理流程：
+- 大小和修改时间与上次导入时相同的文件直接跳过（只 stat，不读内容）；
+- 大小或修改时间变化的再比较内容哈希，内容未变时只更新记录；
+- 最近 WATCH_SETTLE_SECONDS 秒内仍在修改的文件（可能正在写入）留到下次扫描。
+导入时不复制文件：原始文件记录直接指向监视目录中的文件，清洗结果写入批次目录，
+之后由批次任务队列执行清洗和匹配（与上传的批次相同）。清理批次时只删除批次目录，不会删除监视目录中的文件。
+"""
+import os
+import threading
+import time
+from typing import Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from .. import crud, schemas
+from ..database import SessionLocal
+from .file_service import create_batch_dir
+from .keyword_service import hash_file_content
+
+# 监视的目录，多个用 os.pathsep（Linux 为 :）分隔
+WATCH_DIRS = [d for d in os.environ.get("KY_WATCH_DIRS", "").split(os.pathsep) if d]
+# 扫描间隔（秒），0 表示 API 进程不扫描（可用 ky-match watch 单独运行）
+WATCH_INTERVAL = int(os.environ.get("KY_WATCH_INTERVAL", "0"))
+# 导入文件的扩展名（逗号分隔），为空时不过滤
+WATCH_EXTENSIONS = tuple(e for e in os.environ.get("KY_WATCH_EXTENSIONS", ".cfg,.conf,.txt").split(",") if e)
+# 每个批次最多包含的文件数
+WATCH_BATCH_FILES = int(os.environ.get("KY_WATCH_BATCH_FILES", "500"))
+# 导入时执行关键词匹配的关键词组（为空时只清洗）
+WATCH_KEYWORD_SET_ID = int(os.environ.get("KY_WATCH_KEYWORD_SET_ID", "0")) or None
+# 修改时间距今不足该秒数的文件视为仍在写入
+WATCH_SETTLE_SECONDS = 5
+
+
+def _iter_files(root: str, extensions: Iterable[str]):
+    """遍历目录树（跳过隐藏文件和目录），产出 (相对路径, stat 结果)"""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as e:
+            print(f"[watch] 无法读取目录 {directory}: {str(e)}")
+            continue
+        for entry in sorted(entries, key=lambda e: e.name, reverse=True):
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.is_file() and (not extensions or entry.name.endswith(tuple(extensions))):
+                try:
+                    yield os.path.relpath(entry.path, root), entry.stat()
+                except OSError:
+                    continue
+
+
+def _flat_name(rel_path: str) -> str:
+    """相对路径 -> 批次内的文件名（不同子目录下的同名文件不冲突）"""
+    return rel_path.replace(os.sep, "__")
+
+
+def scan_directory(db: Session, root: str, extensions: Iterable[str] = None) -> dict:
+    """
+    扫描一个监视目录，返回 {"changed": [(相对路径, 大小, 修改时间, 哈希, 已有记录)], 各类计数}
+    内容未变（只是修改时间变化）的文件在此更新记录
+    """
+    root = os.path.abspath(root)
+    extensions = WATCH_EXTENSIONS if extensions is None else tuple(extensions)
+    known = crud.get_watched_files(db, root)
+    settle_before = time.time_ns() - WATCH_SETTLE_SECONDS * 1_000_000_000
+    stats = {"root": root, "files": 0, "unchanged": 0, "touched": 0, "unsettled": 0, "changed": []}
+
+    for rel_path, st in _iter_files(root, extensions):
+        stats["files"] += 1
+        existing = known.get(rel_path)
+        if existing is not None and existing.size == st.st_size and existing.mtime_ns == st.st_mtime_ns:
+            stats["unchanged"] += 1
+            continue
+        if st.st_mtime_ns > settle_before:
+            stats["unsettled"] += 1
+            continue
+        try:
+            content_hash = hash_file_content(os.path.join(root, rel_path))
+        except OSError:
+            continue
+        if existing is not None and existing.content_hash == content_hash:
+            crud.upsert_watched_file(db, root, rel_path, st.st_size, st.st_mtime_ns, content_hash, existing=existing)
+            stats["touched"] += 1
+            continue
+        stats["changed"].append((rel_path, st.st_size, st.st_mtime_ns, content_hash, existing))
+    db.commit()
+    return stats
+
+
+def ingest_changed(db: Session, root: str, changed: list, keyword_set_id: Optional[int] = None,
+                   batch_files: int = None) -> List[int]:
+    """把变化的文件按 batch_files 个一批创建批次和任务（不复制文件），返回创建的批次ID"""
+    from .task_service import create_task
+
+    batch_files = batch_files or WATCH_BATCH_FILES
+    batch_ids = []
+    for start in range(0, len(changed), batch_files):
+        chunk = changed[start:start + batch_files]
+        batch = crud.create_batch(db, schemas.BatchCreate(description=f"watch: {root}"))
+        create_batch_dir(batch.id)
+        for rel_path, _, _, _, _ in chunk:
+            crud.create_original_file(db, schemas.OriginalFileCreate(
+                filename=_flat_name(rel_path),
+                file_path=os.path.join(root, rel_path),
+                batch_id=batch.id
+            ))
+        create_task(db, batch.id, keyword_set_id)
+        # 任务入队后才记录文件状态：之前中断时，下次扫描会重新导入这些文件；
+        # 清洗失败（如无法解码）的文件由任务单独跳过并记入 last_error，文件变化后重新导入
+        for rel_path, size, mtime_ns, content_hash, existing in chunk:
+            crud.upsert_watched_file(db, root, rel_path, size, mtime_ns, content_hash,
+                                     batch_id=batch.id, existing=existing)
+        db.commit()
+        batch_ids.append(batch.id)
+    return batch_ids
+
+
+def run_watch_scan(roots: Iterable[str] = None, keyword_set_id: Optional[int] = None,
+                   extensions: Iterable[str] = None, batch_files: int = None) -> list:
+    """扫描所有监视目录并导入变化的文件，返回各目录的统计"""
+    results = []
+    db = SessionLocal()
+    try:
+        for root in roots or WATCH_DIRS:
+            if not os.path.isdir(root):
+                results.append({"root": root, "error": "not a directory"})
+                continue
+            stats = scan_directory(db, root, extensions)
+            changed = stats.pop("changed")
+            stats["changed"] = len(changed)
+            stats["batches"] = ingest_changed(db, stats["root"], changed,
+                                              keyword_set_id or WATCH_KEYWORD_SET_ID, batch_files)
+            results.append(stats)
+    finally:
+        db.close()
+    return results
+
+
+def _watch_loop(stop_event: threading.Event, interval: int):
+    while not stop_event.is_set():
+        try:
+            for stats in run_watch_scan():
+                if stats.get("changed"):
+                    print(f"[watch] {stats['root']}: 文件 {stats['files']}，变化 {stats['changed']}，"
+                          f"批次 {stats['batches']}")
+        except Exception as e:
+            print(f"[watch] 扫描失败: {str(e)}")
+        stop_event.wait(interval)
+
+
+def start_watch_worker(interval: int = None) -> threading.Event:
+    """启动后台扫描线程（启动后立即扫描一次），返回用于停止该线程的事件"""
+    stop_event = threading.Event()
+    threading.Thread(target=_watch_loop, args=(stop_event, interval or WATCH_INTERVAL),
+                     name="watch-folder", daemon=True).start()
+    return stop_event
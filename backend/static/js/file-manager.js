@@ -52,9 +52,6 @@ document.addEventListener('DOMContentLoaded', () => {
 
         batches.forEach(batch => {
             // 确保必要字段存在（防止undefined错误）
-            batch.original_files = batch.original_files || [];
-            batch.cleaned_files_1 = batch.cleaned_files_1 || [];
-            batch.cleaned_files_2 = batch.cleaned_files_2 || [];
             batch.id = batch.id || Date.now(); // 临时ID避免undefined
             batch.timestamp = batch.timestamp || new Date().toISOString();
 
@@ -86,6 +83,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     <h3 class="font-medium text-gray-900">批次 #${batch.id}</h3>
                     <p class="text-sm text-gray-500">创建时间: ${formattedDate}</p>
                     ${batch.description ? `<p class="text-sm text-gray-600 mt-1">描述: ${batch.description}</p>` : ''}
+                    ${batch.summary ? `<p class="text-sm text-gray-500 mt-1">原始文件 ${batch.summary.original_files}，命中 ${batch.summary.total_hits}</p>` : ''}
                 </div>
                 <button class="viewBatchDetails px-3 py-1 bg-blue-600 text-white rounded text-sm hover:bg-blue-700"
                         data-batch-id="${batch.id}">
@@ -93,6 +91,40 @@ document.addEventListener('DOMContentLoaded', () => {
                 </button>
             </div>
             <div class="batchDetails hidden p-4">
+                <p class="text-sm text-gray-500">加载中...</p>
+            </div>
+        `;
+
+        // 绑定"查看详情"按钮事件：文件列表在第一次展开时从批次详情接口加载（列表接口只返回统计）
+        batchDiv.querySelector('.viewBatchDetails').addEventListener('click', async function () {
+            const detailsDiv = batchDiv.querySelector('.batchDetails');
+            detailsDiv.classList.toggle('hidden');
+            if (batchDiv.dataset.detailsLoaded) {
+                return;
+            }
+            try {
+                const response = await fetch(`/api/batches/${batch.id}`);
+                if (!response.ok) {
+                    throw new Error(`HTTP错误: ${response.status}`);
+                }
+                renderBatchDetails(await response.json(), detailsDiv);
+                batchDiv.dataset.detailsLoaded = '1';
+            } catch (error) {
+                console.error('加载批次详情错误:', error);
+                detailsDiv.innerHTML = `<p class="text-sm text-red-600">加载文件列表失败: ${error.message}</p>`;
+            }
+        });
+
+        return batchDiv;
+    }
+
+    // 渲染批次详情（各阶段文件列表）并绑定按钮事件
+    function renderBatchDetails(batch, detailsDiv) {
+        batch.original_files = batch.original_files || [];
+        batch.cleaned_files_1 = batch.cleaned_files_1 || [];
+        batch.cleaned_files_2 = batch.cleaned_files_2 || [];
+
+        detailsDiv.innerHTML = `
                 <!-- 原始文件区域 -->
                 <div class="mb-6">
                     <h4 class="font-medium text-gray-800 mb-2">原始文件 (${batch.original_files.length})</h4>
@@ -134,17 +166,10 @@ document.addEventListener('DOMContentLoaded', () => {
                         </button>
                     </div>
                 ` : ''}
-            </div>
         `;
 
-        // 绑定"查看详情"按钮事件
-        batchDiv.querySelector('.viewBatchDetails').addEventListener('click', function () {
-            const detailsDiv = batchDiv.querySelector('.batchDetails');
-            detailsDiv.classList.toggle('hidden');
-        });
-
         // 绑定"执行二次清洗"按钮事件
-        const clean2Btn = batchDiv.querySelector('.performClean2');
+        const clean2Btn = detailsDiv.querySelector('.performClean2');
         if (clean2Btn) {
             clean2Btn.addEventListener('click', async function () {
                 const batchId = this.dataset.batchId;
@@ -153,15 +178,13 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         // 绑定"执行关键词检查"按钮事件
-        const keywordCheckBtn = batchDiv.querySelector('.performKeywordCheck');
+        const keywordCheckBtn = detailsDiv.querySelector('.performKeywordCheck');
         if (keywordCheckBtn) {
             keywordCheckBtn.addEventListener('click', async function () {
                 const batchId = this.dataset.batchId;
-                await performKeywordCheck(batchId, batchDiv);
+                await performKeywordCheck(batchId, detailsDiv.parentElement);
             });
         }
-
-        return batchDiv;
     }
 
     // 创建单个文件的DOM元素
@@ -206,7 +229,7 @@ document.addEventListener('DOMContentLoaded', () => {
             modalTitle.textContent = `文件内容: ${fileName}`;
 
             // 处理不同类型文件的展示
-            if (fileType === 'cleaned2' && fileName.endsWith('.json')) {
+            if (fileType === 'cleaned2' && /\.jsonl?$/.test(fileName)) {
                 try {
                     // 二次清洗的JSON文件特殊格式化展示
                     const jsonData = await response.json();
@@ -309,7 +332,7 @@ document.addEventListener('DOMContentLoaded', () => {
                     <p class="mb-3 text-sm text-gray-600">请选择用于检查的关键词组：</p>
                     <select id="keywordSetSelect" class="w-full px-3 py-2 border border-gray-300 rounded-md">
                         ${keywordSets.map(set => `
-                            <option value="${set.id}">${set.name} (${set.keywords.length}个关键词)</option>
+                            <option value="${set.id}">${set.name} (${set.keyword_count}个关键词)</option>
                         `).join('')}
                     </select>
                 </div>
@@ -372,15 +395,12 @@ document.addEventListener('DOMContentLoaded', () => {
     // 查看关键词匹配结果
     async function viewKeywordMatches(batchId, fileId) {
         try {
-            // 获取该批次的所有匹配结果
-            const resultsResponse = await fetch(`/api/keywords/match/batch/${batchId}`);
+            // 只获取当前文件最新的一条匹配结果（服务端过滤）
+            const resultsResponse = await fetch(`/api/keywords/match/batch/${batchId}/results?file_id=${parseInt(fileId)}&limit=1&view=legacy`);
             if (!resultsResponse.ok) {
                 throw new Error('获取匹配结果失败');
             }
-            const results = await resultsResponse.json();
-
-            // 筛选当前文件的结果
-            const fileResults = results.filter(res => res.file_id === parseInt(fileId));
+            const fileResults = (await resultsResponse.json()).items;
             if (fileResults.length === 0) {
                 alert('没有找到该文件的关键词匹配结果');
                 return;
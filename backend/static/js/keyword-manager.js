@@ -1,6 +1,8 @@
 document.addEventListener('DOMContentLoaded', () => {
     const keywordSetForm = document.getElementById('keywordSetForm');
     const keywordSetsList = document.getElementById('keywordSetsList');
+    // 查看关键词时每次获取的数量
+    const KEYWORD_PAGE_SIZE = 1000;
 
     // 加载关键词组列表
     loadKeywordSets();
@@ -19,7 +21,11 @@ document.addEventListener('DOMContentLoaded', () => {
         const formData = {
             name: document.getElementById('setName').value,
             description: document.getElementById('setDescription').value,
-            keywords: keywords  // 确保是字符串数组
+            keywords: keywords,  // 确保是字符串数组
+            scopes: document.getElementById('setScopes').value
+                .split(',')
+                .map(s => s.trim())
+                .filter(s => s !== '')
         };
 
         try {
@@ -79,7 +85,7 @@ document.addEventListener('DOMContentLoaded', () => {
                         <h3 class="font-medium text-lg text-gray-900">${set.name}</h3>
                         ${set.description ? `<p class="text-sm text-gray-600 mt-1">${set.description}</p>` : ''}
                         <p class="text-sm text-gray-500 mt-2">
-                            <i class="fa fa-tag mr-1"></i> 关键词数量: ${set.keywords.length}
+                            <i class="fa fa-tag mr-1"></i> 关键词数量: ${set.keyword_count}
                         </p>
                         <p class="text-xs text-gray-400 mt-1">
                             创建时间: ${new Date(set.created_at).toLocaleString()}
@@ -89,7 +95,7 @@ document.addEventListener('DOMContentLoaded', () => {
                             data-set-id="${set.id}"
                             data-set-name="${set.name}"
                             data-description="${set.description || ''}"
-                            data-keywords='${JSON.stringify(set.keywords)}'>
+                            data-keyword-count="${set.keyword_count}">
                         查看关键词
                     </button>
                 </div>
@@ -98,15 +104,26 @@ document.addEventListener('DOMContentLoaded', () => {
 
         // 添加查看关键词事件
         document.querySelectorAll('.viewKeywordsBtn').forEach(btn => {
-            btn.addEventListener('click', function () {
+            btn.addEventListener('click', async function () {
+                const setId = this.dataset.setId;
                 const setName = this.dataset.setName;
                 const description = this.dataset.description;
-                const keywords = JSON.parse(this.dataset.keywords);
+                const keywordCount = this.dataset.keywordCount;
+
+                // 关键词分页获取，只展示第一页
+                const response = await fetch(`/api/keywords/sets/${setId}/keywords?limit=${KEYWORD_PAGE_SIZE}`);
+                if (!response.ok) {
+                    alert('获取关键词失败');
+                    return;
+                }
+                const keywords = (await response.json()).items.map(item => item.value);
 
                 // 填充模态框内容
                 document.getElementById('modalSetTitle').textContent = `关键词组: ${setName}`;
                 document.getElementById('modalSetDescription').textContent = description || '无描述';
-                document.getElementById('keywordCount').textContent = `(${keywords.length}个关键词)`;
+                document.getElementById('keywordCount').textContent = keywords.length < keywordCount
+                    ? `(${keywordCount}个关键词，显示前${keywords.length}个)`
+                    : `(${keywordCount}个关键词)`;
 
                 // 生成关键词列表（按列展示）
                 const keywordsList = document.getElementById('modalKeywordsList');
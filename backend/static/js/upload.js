@@ -169,7 +169,7 @@ document.addEventListener('DOMContentLoaded', () => {
             keywordSets.forEach(set => {
                 const option = document.createElement('option');
                 option.value = set.id;
-                option.textContent = `${set.name}（${set.keywords.length}个关键词）`;
+                option.textContent = `${set.name}（${set.keyword_count}个关键词）`;
                 keywordSetSelect.appendChild(option);
             });
 
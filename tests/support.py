@@ -0,0 +1,57 @@
+"""测试用的临时数据库和批次目录"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from backend import crud, schemas
+from backend.database import Base
+from backend.services import keyword_service
+
+
+class TempDatabaseTestCase(unittest.TestCase):
+    """每个用例使用独立的 SQLite 文件和目录；后台编译关键词匹配器时使用的会话同样指向该数据库"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="ky-test-")
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.tmp_dir, 'test.db')}",
+                                    connect_args={"check_same_thread": False})
+        self.addCleanup(self.engine.dispose)
+        Base.metadata.create_all(bind=self.engine)
+        self.Session = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.db = self.Session()
+        self.addCleanup(self.db.close)
+
+        patcher = mock.patch.object(keyword_service, "SessionLocal", self.Session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 匹配器按 (关键词组ID, 版本) 缓存，不同用例的数据库中 ID 会重复
+        keyword_service._matcher_cache.clear()
+        self.addCleanup(keyword_service._matcher_cache.clear)
+
+    def create_keyword_set(self, keywords, name="test", **kwargs):
+        return crud.create_keyword_set(self.db, schemas.KeywordSetCreate(name=name, keywords=keywords, **kwargs))
+
+    def create_batch(self, files: dict):
+        """创建批次及其初次清洗文件（文件名 -> 内容），返回 (批次, [初次清洗文件])"""
+        batch = crud.create_batch(self.db, schemas.BatchCreate(description="test"))
+        batch_dir = os.path.join(self.tmp_dir, f"batch_{batch.id}")
+        for stage in ("original", "cleaned_1", "match"):
+            os.makedirs(os.path.join(batch_dir, stage), exist_ok=True)
+        cleaned = []
+        for filename, content in files.items():
+            original_path = os.path.join(batch_dir, "original", filename)
+            cleaned_path = os.path.join(batch_dir, "cleaned_1", filename)
+            for path in (original_path, cleaned_path):
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(content)
+            original = crud.create_original_file(self.db, schemas.OriginalFileCreate(
+                filename=filename, file_path=original_path, batch_id=batch.id))
+            cleaned.append(crud.create_cleaned_file_1(self.db, schemas.CleanedFile1Create(
+                filename=filename, file_path=cleaned_path, original_file_id=original.id, batch_id=batch.id)))
+        return batch, cleaned
@@ -0,0 +1,60 @@
+"""准入预算：通过台账计入同一台机器上其他进程的占用"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from backend.services.admission_service import AdmissionController, AdmissionLedger, fcntl
+
+
+@unittest.skipIf(fcntl is None, "fcntl 不可用")
+class AdmissionLedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "ledger.json")
+        # 父进程（pytest 的启动进程）一定存活，用作"其他进程"
+        self.other_pid = os.getppid()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _write(self, entries: dict):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({str(pid): usage for pid, usage in entries.items()}, f)
+
+    def _read(self) -> dict:
+        with open(self.path, encoding="utf-8") as f:
+            return {int(pid): usage for pid, usage in json.load(f).items()}
+
+    def test_other_process_usage_counts_against_budget(self):
+        self._write({self.other_pid: [80, 1]})
+        controller = AdmissionController(100, 2, 4, ledger=AdmissionLedger(self.path))
+        self.assertFalse(controller._reserve(30, 1))
+        self.assertTrue(controller._reserve(20, 1))
+        self.assertEqual(self._read()[os.getpid()], [20, 1])
+
+    def test_admit_records_and_releases_usage(self):
+        controller = AdmissionController(100, 2, 4, ledger=AdmissionLedger(self.path))
+        with controller.admit(40, 1):
+            self.assertEqual(self._read()[os.getpid()], [40, 1])
+            self.assertEqual(controller.snapshot()["memory_in_use"], 40)
+        self.assertEqual(self._read().get(os.getpid()), [0, 0])
+
+    def test_dead_process_entries_are_pruned(self):
+        dead_pid = 2 ** 22 + 12345
+        self._write({dead_pid: [90, 2], self.other_pid: [10, 1]})
+        ledger = AdmissionLedger(self.path)
+        self.assertEqual(ledger.others(), (10, 1))
+        self.assertNotIn(dead_pid, self._read())
+
+    def test_idle_fleet_admits_oversized_work(self):
+        controller = AdmissionController(100, 2, 4, ledger=AdmissionLedger(self.path))
+        # 所有进程都空闲时超出预算的工作也准入；其他进程占用时不准入
+        self.assertTrue(controller._reserve(500, 1))
+        self._write({self.other_pid: [100, 1]})
+        self.assertFalse(AdmissionController(100, 2, 4, ledger=AdmissionLedger(self.path))._reserve(10, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
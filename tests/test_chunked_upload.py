@@ -0,0 +1,54 @@
+"""分块上传：续传时从磁盘重新计算哈希，哈希和写文件在线程池中执行"""
+import asyncio
+import hashlib
+import threading
+from unittest import mock
+
+from backend import schemas
+from backend.services import file_service, upload_service
+from backend.services.upload_service import create_upload, write_chunk
+
+from .support import TempDatabaseTestCase
+
+CONTENT = b"hostname R1\n" + b"interface Gi0/1\n description uplink\n" * 200
+
+
+async def _chunks(data: bytes, size: int = 1000):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+class ChunkedUploadTest(TempDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(file_service, "UPLOAD_BASE_DIR", self.tmp_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        session = create_upload(self.db, schemas.UploadSessionCreate(files=[schemas.UploadFileSpec(
+            filename="r1.cfg", size=len(CONTENT), sha256=hashlib.sha256(CONTENT).hexdigest())]))
+        self.upload_file = session.files[0]
+        self.addCleanup(upload_service._hashers.pop, self.upload_file.id, None)
+
+    def test_resume_after_restart_rehashes_off_the_event_loop(self):
+        half = len(CONTENT) // 2
+        self.assertEqual(asyncio.run(write_chunk(self.db, self.upload_file, 0, _chunks(CONTENT[:half]))), half)
+
+        # 进程重启：内存中的哈希状态丢失，续传时从磁盘重新计算
+        upload_service._hashers.clear()
+        threads = []
+        real_hasher_at = upload_service._hasher_at
+
+        def hasher_at(upload_file, position):
+            threads.append(threading.current_thread())
+            return real_hasher_at(upload_file, position)
+
+        with mock.patch.object(upload_service, "_hasher_at", hasher_at):
+            # 与已接收部分重叠的字节被跳过
+            received = asyncio.run(write_chunk(self.db, self.upload_file, half - 100, _chunks(CONTENT[half - 100:])))
+
+        self.assertEqual(received, len(CONTENT))
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+        with open(self.upload_file.file_path, "rb") as f:
+            self.assertEqual(f.read(), CONTENT)
+        self.assertEqual(upload_service._verify_file(self.db, self.upload_file), [])
@@ -0,0 +1,64 @@
+"""二次清洗结果的 sections 格式：非 ASCII 区块名和内容按字节偏移读取的结果与完整文档一致"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from backend.services import cleaned2_service
+from backend.services.cleaned2_service import (
+    is_sections_file,
+    list_sections,
+    read_document_bytes,
+    read_section_bytes,
+    write_cleaned2,
+)
+
+PARSED = {
+    "global": ["hostname 核心交换机-01", "banner motd ^欢迎 — 仅限授权访问^", "snmp-server location 机房 B·3F"],
+    "interfaces": ["interface GigabitEthernet0/1\n description 上联-汇聚 «主»\n ip address 10.0.0.1 255.255.255.0",
+                   "interface Vlan10\n description 办公网 ☎"],
+    "路由_bgp": ["router bgp 65000\n neighbor 10.0.0.2 description 对端 ✓"],
+    "空区块": [],
+    "hostname": "核心交换机-01",
+    "vendor": "cisco",
+}
+
+
+class Cleaned2SectionsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="ky-cleaned2-")
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+
+    def _write(self, fmt: str) -> str:
+        path = os.path.join(self.tmp_dir, f"r1_cleaned2.{fmt}")
+        with mock.patch.object(cleaned2_service, "CLEANED2_FORMAT", fmt):
+            write_cleaned2(path, PARSED)
+        return path
+
+    def test_sections_round_trip(self):
+        path = self._write("sections")
+        self.assertTrue(is_sections_file(path))
+        self.assertEqual(list(list_sections(path)), list(PARSED))
+        for name, value in PARSED.items():
+            with self.subTest(section=name):
+                expected = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+                self.assertEqual(read_section_bytes(path, name), expected)
+                self.assertEqual(list_sections(path)[name], len(expected))
+        self.assertIsNone(read_section_bytes(path, "不存在"))
+        document = read_document_bytes(path)
+        self.assertEqual(json.loads(document), PARSED)
+        self.assertEqual(list(json.loads(document)), list(PARSED))
+
+    def test_legacy_json_round_trip(self):
+        path = self._write("json")
+        self.assertFalse(is_sections_file(path))
+        for name, value in PARSED.items():
+            with self.subTest(section=name):
+                self.assertEqual(read_section_bytes(path, name), json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        self.assertEqual(json.loads(read_document_bytes(path)), PARSED)
+
+
+if __name__ == "__main__":
+    unittest.main()
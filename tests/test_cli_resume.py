@@ -0,0 +1,71 @@
+"""ky-match 续跑：截断中断时残留的半行，只处理尚未完成的文件；批量解析时同名文件只写出一次"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from backend.cli import load_progress, run_match
+from backend.services.clean_2 import parse_multiple_configs
+
+CONFIG = "hostname {name}\ninterface GigabitEthernet0/1\n description uplink\n shutdown\n!\n"
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="ky-cli-")
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+        self.root = os.path.join(self.tmp_dir, "configs")
+        os.makedirs(os.path.join(self.root, "site"))
+        for rel_path in ("a.cfg", "b.cfg", os.path.join("site", "c.cfg")):
+            with open(os.path.join(self.root, rel_path), "w", encoding="utf-8") as f:
+                f.write(CONFIG.format(name=os.path.basename(rel_path)[0].upper()))
+        self.output = os.path.join(self.tmp_dir, "results.jsonl")
+
+    def _lines(self):
+        with open(self.output, "r", encoding="utf-8") as f:
+            return f.read().splitlines()
+
+    def test_truncates_partial_line_and_processes_remaining_files(self):
+        finished = json.dumps({"path": "a.cfg", "match_count": 0, "matches": {}}) + "\n"
+        with open(self.output, "w", encoding="utf-8") as f:
+            f.write(finished + '{"path": "b.cfg", "vendor": "cis')
+
+        self.assertEqual(load_progress(self.output), {"a.cfg"})
+        self.assertEqual(os.path.getsize(self.output), len(finished.encode("utf-8")))
+
+        processed = run_match(self.root, ["shutdown"], self.output, progress_every=0)
+
+        self.assertEqual(processed, 2)
+        lines = self._lines()
+        # 已完成的行原样保留，未完成的文件各追加一行
+        self.assertEqual(lines[0], finished.rstrip("\n"))
+        records = [json.loads(line) for line in lines[1:]]
+        self.assertEqual([r["path"] for r in records], ["b.cfg", os.path.join("site", "c.cfg")])
+        self.assertTrue(all(r["match_count"] == 1 for r in records))
+
+        # 全部完成后再次续跑不处理任何文件
+        self.assertEqual(run_match(self.root, ["shutdown"], self.output, progress_every=0), 0)
+        self.assertEqual(len(self._lines()), 3)
+
+    def test_unparseable_line_stops_progress(self):
+        with open(self.output, "w", encoding="utf-8") as f:
+            f.write('{"path": "a.cfg"}\nnot json\n{"path": "b.cfg"}\n')
+        self.assertEqual(load_progress(self.output), {"a.cfg"})
+        self.assertEqual(self._lines(), ['{"path": "a.cfg"}'])
+
+    def test_parse_multiple_configs_writes_duplicate_names_once(self):
+        with open(os.path.join(self.root, "site", "a.cfg"), "w", encoding="utf-8") as f:
+            f.write(CONFIG.format(name="DUP"))
+        summary = os.path.join(self.tmp_dir, "summary.json")
+
+        parse_multiple_configs(self.root, summary)
+
+        with open(summary, "r", encoding="utf-8") as f:
+            pairs = json.load(f, object_pairs_hook=lambda items: items)
+        names = [name for name, _ in pairs]
+        self.assertEqual(sorted(names), ["a.cfg", "b.cfg", "c.cfg"])
+
+
+if __name__ == "__main__":
+    unittest.main()
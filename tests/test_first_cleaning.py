@@ -0,0 +1,68 @@
+"""清洗阶段：单个文件失败时跳过该文件，批次中的其他文件照常处理，跳过的文件记入任务的 last_error"""
+import os
+from unittest import mock
+
+from backend import crud, schemas
+from backend.services import admission_service, file_service, task_service
+from backend.services.admission_service import AdmissionController
+from backend.services.file_service import perform_first_cleaning
+from backend.services.task_service import create_task, run_batch_task
+
+from .support import TempDatabaseTestCase
+
+
+class FirstCleaningTest(TempDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(file_service, "UPLOAD_BASE_DIR", self.tmp_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _add_original(self, batch_id: int, filename: str, content: bytes):
+        path = os.path.join(self.tmp_dir, filename)
+        with open(path, "wb") as f:
+            f.write(content)
+        crud.create_original_file(self.db, schemas.OriginalFileCreate(filename=filename, file_path=path,
+                                                                      batch_id=batch_id))
+
+    def test_bad_file_is_skipped_and_reported(self):
+        batch = crud.create_batch(self.db, schemas.BatchCreate(description="test"))
+        self._add_original(batch.id, "good.cfg", b"hostname R1\ninterface Gi0/1\n description uplink\n")
+        self._add_original(batch.id, "bad.cfg", b"hostname R2\n\xff\xfe\xfa broken\n")
+
+        skipped = perform_first_cleaning(batch.id, self.db)
+
+        self.assertEqual(len(skipped), 1)
+        self.assertTrue(skipped[0].startswith("bad.cfg: "))
+        cleaned = crud.get_cleaned_files_1_by_batch(self.db, batch.id)
+        self.assertEqual([f.filename for f in cleaned], ["good.cfg_cleaned.cfg"])
+        # 重复执行时只重试失败的文件
+        self.assertEqual(perform_first_cleaning(batch.id, self.db), skipped)
+
+    def test_second_cleaning_failures_are_recorded_on_the_task(self):
+        for target, name, value in (
+            (admission_service, "admission", AdmissionController(1 << 40, 4, 4)),
+            (task_service, "SessionLocal", self.Session),
+        ):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        batch = crud.create_batch(self.db, schemas.BatchCreate(description="test"))
+        self._add_original(batch.id, "r1.cfg", b"hostname R1\ninterface Gi0/1\n description uplink\n!\n")
+        self._add_original(batch.id, "r2.cfg", b"hostname R2\ninterface Gi0/2\n description core\n!\n")
+        real_snapshot = file_service.snapshot_config_file
+
+        def snapshot(db, file, batch_id, parallel=False):
+            if file.filename.startswith("r2"):
+                raise ValueError("解析失败")
+            return real_snapshot(db, file, batch_id, parallel=parallel)
+
+        task = create_task(self.db, batch.id, owner="worker-a")
+        with mock.patch.object(file_service, "snapshot_config_file", snapshot):
+            self.assertEqual(run_batch_task(self.db, task, "worker-a"), "done")
+
+        self.db.expire_all()
+        self.assertEqual([f.filename for f in crud.get_cleaned_files_2_by_batch(self.db, batch.id)],
+                         ["r1.cfg_cleaned_cleaned2" + file_service.cleaned2_extension()])
+        self.assertEqual(crud.get_batch_task(self.db, task.id).last_error,
+                         "跳过的文件: r2.cfg_cleaned.cfg: 解析失败")
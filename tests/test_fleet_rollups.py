@@ -0,0 +1,44 @@
+"""设备趋势增量汇总：重新统计批次时先扣除旧贡献再累加新贡献，删除批次后扣除，命中数归零的行被删除"""
+from backend import crud, schemas
+
+from .support import TempDatabaseTestCase
+
+DAY = "2026-01-01"
+NEXT_DAY = "2026-01-02"
+
+
+class FleetRollupTest(TempDatabaseTestCase):
+    def _batch(self) -> int:
+        return crud.create_batch(self.db, schemas.BatchCreate(description="test")).id
+
+    def _rollup(self) -> dict:
+        return {(r.day, r.keyword_set_id, r.hostname, r.keyword): r.hits for r in crud.query_fleet_rollups(self.db)}
+
+    def test_resummarize_then_delete(self):
+        first = self._batch()
+        second = self._batch()
+        crud.save_batch_summary(self.db, first, DAY, {}, [[1, "R1", "uplink", 3], [1, "R1", "bgp", 1],
+                                                          [2, "R2", "uplink", 4]])
+        crud.save_batch_summary(self.db, second, DAY, {}, [[1, "R1", "uplink", 2]])
+        self.assertEqual(self._rollup(), {
+            (DAY, 1, "R1", "uplink"): 5, (DAY, 1, "R1", "bgp"): 1, (DAY, 2, "R2", "uplink"): 4,
+        })
+
+        # 重新统计：uplink 减少，bgp 不再命中，R2 的命中归零，新增 R3
+        crud.save_batch_summary(self.db, first, DAY, {}, [[1, "R1", "uplink", 1], [2, "R2", "uplink", 0],
+                                                          [1, "R3", "vlan", 2]])
+        self.assertEqual(self._rollup(), {(DAY, 1, "R1", "uplink"): 3, (DAY, 1, "R3", "vlan"): 2})
+
+        # 重新统计到另一天：旧日期的贡献全部扣除
+        crud.save_batch_summary(self.db, first, NEXT_DAY, {}, [[1, "R1", "uplink", 1]])
+        self.assertEqual(self._rollup(), {(DAY, 1, "R1", "uplink"): 2, (NEXT_DAY, 1, "R1", "uplink"): 1})
+
+        # 相同内容重复统计不改变结果
+        crud.save_batch_summary(self.db, first, NEXT_DAY, {}, [[1, "R1", "uplink", 1]])
+        self.assertEqual(self._rollup(), {(DAY, 1, "R1", "uplink"): 2, (NEXT_DAY, 1, "R1", "uplink"): 1})
+
+        crud.delete_batches(self.db, [first])
+        self.assertEqual(self._rollup(), {(DAY, 1, "R1", "uplink"): 2})
+        crud.delete_batches(self.db, [second])
+        self.assertEqual(self._rollup(), {})
+        self.assertEqual(crud.query_fleet_rollups(self.db).count(), 0)
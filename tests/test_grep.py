@@ -0,0 +1,52 @@
+"""临时正则搜索：工作进程池在搜索之间复用，超时后终止仍在扫描的进程"""
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from backend.services import grep_service
+from backend.services.grep_service import stream_grep
+
+
+def _collect(files, pattern, **kwargs) -> list:
+    async def run():
+        return [record async for record in stream_grep(files, pattern, **kwargs)]
+    return asyncio.run(run())
+
+
+class GrepTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix="ky-grep-")
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+        self.addCleanup(grep_service.shutdown_grep_pools)
+
+    def _write(self, name: str, content: str) -> str:
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+        return path
+
+    def test_matches_and_pool_reuse(self):
+        path = self._write("r1.cfg", "hostname R1\ninterface Gi0/1\n description uplink\n")
+        records = _collect([("cleaned_1", path)], r"uplink")
+        self.assertEqual([(r["file"], r["line"]) for r in records if r["type"] == "match"], [("r1.cfg", 3)])
+        self.assertFalse(records[-1]["timed_out"])
+        self.assertEqual(len(grep_service._idle_pools), 1)
+        pool = grep_service._idle_pools[0]
+        _collect([("cleaned_1", path)], r"hostname")
+        self.assertEqual(grep_service._idle_pools, [pool])
+
+    def test_timeout_terminates_runaway_worker(self):
+        # 灾难性回溯：单行内不会返回，工作进程无法自行检查超时
+        path = self._write("evil.cfg", "a" * 40 + "!\n")
+        started = time.monotonic()
+        records = _collect([("cleaned_1", path)], r"(a+)+$", timeout=1)
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertTrue(records[-1]["timed_out"])
+        self.assertEqual(grep_service._idle_pools, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
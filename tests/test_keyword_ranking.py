@@ -0,0 +1,98 @@
+"""按严重程度匹配：top-K 与全部命中排序后取前 K 条一致，堆满后提前结束；exists 模式按最低严重程度过滤"""
+from backend.services.keyword_service import (
+    ConfigKeywordMatcher,
+    _severity_key,
+    find_first_match,
+    perform_keyword_ranking,
+    rank_config_matches,
+)
+
+from .support import TempDatabaseTestCase
+
+SEVERITIES = {"shutdown": 3, "vlan": 3, "uplink": 2, "description": 1, "re:remote-as \\d+": 2}
+
+CONFIG = "\n".join([
+    "hostname R1",
+    "vlan 10",
+    "interface GigabitEthernet0/1",
+    " description uplink shutdown",  # 同一行多个命中（同行号时按命中顺序）
+    " shutdown vlan 99",  # 同一行、同等严重程度的两个命中
+    "!",
+    "interface GigabitEthernet0/2",
+    " description uplink to core",
+    " no shutdown",
+    "!",
+    "router bgp 65000",
+    " neighbor 10.0.0.2 remote-as 65001",
+    "vlan 20",
+    "!",
+]) + "\n"
+
+
+def _severity_of(severities: dict) -> dict:
+    return {_severity_key(word): severity for word, severity in severities.items()}
+
+
+def _all_hits_sorted(matcher, raw_data, severity_of) -> list:
+    """参照实现：逐行收集全部命中后按 (严重程度降序, 行号, 命中顺序) 排序"""
+    hits = []
+    for line_num, line in enumerate(raw_data.splitlines(), start=1):
+        for keyword in matcher.match_line(line):
+            severity = severity_of.get(_severity_key(keyword), 0)
+            hits.append((-severity, line_num, len(hits), {
+                "line": line_num, "keyword": keyword, "severity": severity,
+                "section": None, "content": line.strip()
+            }))
+    return [hit[3] for hit in sorted(hits, key=lambda hit: hit[:3])]
+
+
+class RankingTest(TempDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.matcher = ConfigKeywordMatcher(list(SEVERITIES))
+        self.severity_of = _severity_of(SEVERITIES)
+
+    def test_top_k_equals_full_sort(self):
+        expected = _all_hits_sorted(self.matcher, CONFIG, self.severity_of)
+        self.assertGreater(len(expected), 8)
+        # 同等严重程度且同一行的命中
+        self.assertEqual([hit["severity"] for hit in expected if hit["line"] == 5], [3, 3])
+        for k in range(1, len(expected) + 2):
+            with self.subTest(k=k):
+                result = rank_config_matches(self.matcher, CONFIG, self.severity_of, k)
+                self.assertEqual(result["findings"], expected[:k])
+
+    def test_stops_once_heap_is_full_of_top_severity(self):
+        config = CONFIG + "".join(f"interface Loopback{i}\n description spare\n!\n" for i in range(200))
+        total_lines = len(config.splitlines())
+
+        early = rank_config_matches(self.matcher, config, self.severity_of, 2)
+        self.assertFalse(early["complete"])
+        # 第 2 条最高严重程度的命中在第 4 行
+        self.assertEqual(early["scanned_lines"], 4)
+        self.assertEqual([(f["line"], f["keyword"]) for f in early["findings"]], [(2, "vlan"), (4, "shutdown")])
+
+        # 最高严重程度的命中不足 k 条时扫描到文件末尾
+        full = rank_config_matches(self.matcher, config, self.severity_of, 10)
+        self.assertTrue(full["complete"])
+        self.assertEqual(full["scanned_lines"], total_lines)
+        self.assertEqual(full["findings"], _all_hits_sorted(self.matcher, config, self.severity_of)[:10])
+
+    def test_exists_stops_at_first_hit(self):
+        result = find_first_match(self.matcher, CONFIG, self.severity_of)
+        self.assertEqual((result["found"], result["scanned_lines"], result["match"]["keyword"]), (True, 2, "vlan"))
+
+    def test_exists_mode_filters_by_min_severity(self):
+        keyword_set = self.create_keyword_set(["description", "remote-as", "vlan 20"], name="severity",
+                                              keyword_severities={"description": 1, "remote-as": 2, "vlan 20": 3})
+        batch, _ = self.create_batch({"r1.cfg": CONFIG})
+
+        def first(min_severity):
+            result = perform_keyword_ranking(self.db, batch.id, keyword_set.id, mode="exists",
+                                             min_severity=min_severity)[0]
+            return result["found"], result["match"] and (result["match"]["line"], result["match"]["keyword"])
+
+        self.assertEqual(first(None), (True, (4, "description")))
+        self.assertEqual(first(2), (True, (12, "remote-as")))
+        self.assertEqual(first(3), (True, (13, "vlan 20")))
+        self.assertEqual(first(4), (False, None))
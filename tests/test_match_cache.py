@@ -0,0 +1,101 @@
+"""关键词匹配结果缓存：按 (内容哈希, 关键词组, 关键词组版本) 复用，重复执行幂等"""
+import json
+from unittest import mock
+
+from backend import crud, models, schemas
+from backend.services import keyword_service
+from backend.services.keyword_service import expand_match_data, perform_keyword_check
+
+from .support import TempDatabaseTestCase
+
+CONFIG = """hostname R1
+interface GigabitEthernet0/1
+ description uplink
+ shutdown
+router bgp 65000
+ neighbor 10.0.0.2 remote-as 65001
+"""
+
+
+def _keywords(result) -> set:
+    match_data = expand_match_data(json.loads(result.match_data))
+    return {m["keyword"] for matches in match_data["matches"].values() for m in matches}
+
+
+class MatchCacheTest(TempDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.keyword_set = self.create_keyword_set(["shutdown", "uplink"])
+        compile_patcher = mock.patch.object(keyword_service, "get_keyword_matcher",
+                                            wraps=keyword_service.get_keyword_matcher)
+        self.get_matcher = compile_patcher.start()
+        self.addCleanup(compile_patcher.stop)
+
+    def _check(self, batch_id):
+        return perform_keyword_check(self.db, batch_id, self.keyword_set.id)
+
+    def _result_count(self):
+        return self.db.query(models.KeywordMatchResult).count()
+
+    def test_repeat_run_is_idempotent(self):
+        batch, _ = self.create_batch({"r1.cfg": CONFIG})
+        first = self._check(batch.id)
+        self.assertEqual(self.get_matcher.call_count, 1)
+        self.assertEqual(_keywords(first[0]), {"shutdown", "uplink"})
+
+        second = self._check(batch.id)
+        self.assertEqual(self.get_matcher.call_count, 1)  # 命中缓存，不构建匹配器、不扫描
+        self.assertEqual([r.id for r in second], [r.id for r in first])
+        self.assertEqual(self._result_count(), 1)
+
+    def test_same_content_in_another_batch_hits_cache(self):
+        batch_a, _ = self.create_batch({"r1.cfg": CONFIG})
+        batch_b, _ = self.create_batch({"r1-copy.cfg": CONFIG})
+        first = self._check(batch_a.id)
+        second = self._check(batch_b.id)
+        self.assertEqual(self.get_matcher.call_count, 1)
+        self.assertEqual(second[0].batch_id, batch_b.id)
+        self.assertEqual(second[0].cache_key, first[0].cache_key)
+        self.assertEqual(_keywords(second[0]), _keywords(first[0]))
+
+    def test_new_keyword_set_version_misses_cache(self):
+        batch, _ = self.create_batch({"r1.cfg": CONFIG})
+        first = self._check(batch.id)
+        first_id, first_key = first[0].id, first[0].cache_key
+
+        self.keyword_set = crud.update_keyword_set(self.db, self.keyword_set.id, schemas.KeywordSetCreate(
+            name="test", keywords=["shutdown", "neighbor"]))
+        self.assertEqual(self.keyword_set.version, 2)
+        second = self._check(batch.id)
+        self.assertEqual(self.get_matcher.call_count, 2)
+        self.assertEqual(second[0].id, first_id)  # 原地更新，不堆积旧结果
+        self.assertNotEqual(second[0].cache_key, first_key)
+        self.assertEqual(_keywords(crud.get_match_result_by_id(self.db, first_id)), {"shutdown", "neighbor"})
+        self.assertEqual(self._result_count(), 1)
+
+    def test_changed_content_misses_cache(self):
+        batch, _ = self.create_batch({"r1.cfg": CONFIG})
+        self._check(batch.id)
+        batch_b, _ = self.create_batch({"r1.cfg": CONFIG.replace(" shutdown\n", " no shutdown\n")})
+        self._check(batch_b.id)
+        self.assertEqual(self.get_matcher.call_count, 2)
+
+
+class MatcherCacheTest(TempDatabaseTestCase):
+    def test_late_compile_of_old_version_keeps_current_matcher(self):
+        keyword_set = self.create_keyword_set(["shutdown"])
+        crud.update_keyword_set(self.db, keyword_set.id, schemas.KeywordSetCreate(name="test", keywords=["uplink"]))
+        current = keyword_service.get_keyword_matcher(keyword_set.id, 2)
+
+        # 版本 1 的编译（如更新前调度的后台编译）晚于版本 2 完成
+        keyword_service._compile_matcher(keyword_set.id, 1)
+        self.assertIs(keyword_service.get_keyword_matcher(keyword_set.id, 2), current)
+        self.assertNotIn((keyword_set.id, 1), keyword_service._matcher_cache)
+
+    def test_new_version_evicts_older_matchers(self):
+        keyword_set = self.create_keyword_set(["shutdown"])
+        keyword_service.get_keyword_matcher(keyword_set.id, 1)
+        crud.update_keyword_set(self.db, keyword_set.id, schemas.KeywordSetCreate(name="test", keywords=["uplink"]))
+        matcher = keyword_service.get_keyword_matcher(keyword_set.id, 2)
+        self.assertEqual(matcher.keywords, ["uplink"])
+        self.assertEqual([k for k in keyword_service._matcher_cache if k[0] == keyword_set.id], [(keyword_set.id, 2)])
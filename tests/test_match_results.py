@@ -0,0 +1,52 @@
+"""同一批次用不同关键词组匹配：各组的结果和统计互不覆盖（结果文件按文件名共用，以数据库为准）"""
+import json
+
+from backend.api.endpoints.batches import read_batches
+from backend.api.endpoints.keywords import get_match_result
+from backend.services.keyword_service import perform_keyword_check
+from backend.services.summary_service import materialize_batch_summary
+
+from .support import TempDatabaseTestCase
+
+CONFIG = "\n".join([
+    "hostname R1",
+    "interface GigabitEthernet0/1",
+    " description uplink",
+    "!",
+    "router bgp 65000",
+    " neighbor 10.0.0.2 remote-as 65001",
+    "!",
+]) + "\n"
+
+
+def _keywords(view) -> set:
+    return {m["keyword"] for matches in view.match_data["matches"].values() for m in matches}
+
+
+class MatchResultSourceTest(TempDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.batch, _ = self.create_batch({"r1.cfg": CONFIG})
+        self.set_a = self.create_keyword_set(["uplink"], name="a")
+        self.set_b = self.create_keyword_set(["neighbor"], name="b")
+        self.result_a = perform_keyword_check(self.db, self.batch.id, self.set_a.id)[0]
+        self.result_b = perform_keyword_check(self.db, self.batch.id, self.set_b.id)[0]
+
+    def test_result_view_uses_its_own_keyword_set(self):
+        self.assertEqual(_keywords(get_match_result(self.result_a.id, view="legacy", db=self.db)), {"uplink"})
+        self.assertEqual(_keywords(get_match_result(self.result_b.id, view="legacy", db=self.db)), {"neighbor"})
+
+    def test_summary_counts_each_keyword_set(self):
+        summary = materialize_batch_summary(self.db, self.batch.id)
+        self.assertEqual(json.loads(summary.keyword_hits), {"uplink": 1, "neighbor": 1})
+        rollups = {(set_id, keyword): hits for set_id, _, keyword, hits in
+                   json.loads(summary.rollup)}
+        self.assertEqual(rollups, {(self.set_a.id, "uplink"): 1, (self.set_b.id, "neighbor"): 1})
+
+    def test_batch_list_reads_materialized_summary(self):
+        unsummarized, _ = self.create_batch({"r2.cfg": CONFIG})
+        materialize_batch_summary(self.db, self.batch.id)
+        items = {item.id: item for item in read_batches(db=self.db, skip=0, limit=10)}
+        self.assertEqual(items[self.batch.id].summary.total_hits, 2)
+        self.assertEqual(items[self.batch.id].summary.original_files, 1)
+        self.assertIsNone(items[unsummarized.id].summary)
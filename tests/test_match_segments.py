@@ -0,0 +1,55 @@
+"""匹配结果分段：命中行由 SQLite 按行号排序读取，两种存储格式结果一致"""
+import json
+
+from backend import crud, models
+from backend.services.keyword_service import compact_match_data, iter_text_segments
+
+from .support import TempDatabaseTestCase
+
+LEGACY = {
+    "vendor": "cisco",
+    "matches": {
+        "interface gigabitethernet0/1": [
+            {"line": 3, "keyword": "shutdown", "content": "shutdown"},
+            {"line": 3, "keyword": "down", "content": "shutdown"},
+            {"line": 5, "keyword": "网管", "content": "description 网管"},
+        ],
+        "global": [
+            {"line": 1, "keyword": "hostname", "content": "hostname R1"},
+            {"line": 4, "keyword": "vlan", "content": "vlan 10"},
+            {"line": 9, "keyword": "end", "content": "end"},
+        ],
+        "router bgp 65000": [
+            {"line": 7, "keyword": "neighbor", "content": "neighbor 10.0.0.2 remote-as 65001"},
+        ],
+    },
+}
+EXPECTED = ["hostname R1", "shutdown", "vlan 10", "description 网管", "neighbor 10.0.0.2 remote-as 65001", "end"]
+
+
+class MatchSegmentsTest(TempDatabaseTestCase):
+    def _save(self, match_data) -> int:
+        row = models.KeywordMatchResult(batch_id=1, file_id=1, keyword_set_id=1, filename="r1_matches.json",
+                                        file_path="", match_data=json.dumps(match_data, ensure_ascii=False))
+        self.db.add(row)
+        self.db.commit()
+        return row.id
+
+    def test_lines_in_order_for_both_formats(self):
+        for match_data in (LEGACY, compact_match_data(LEGACY)):
+            with self.subTest(format=match_data.get("format", "legacy")):
+                result_id = self._save(match_data)
+                self.assertEqual(list(crud.iter_match_result_lines(self.db, result_id)), EXPECTED)
+
+    def test_segments_by_bytes(self):
+        result_id = self._save(compact_match_data(LEGACY))
+        lines = (content + "\n" for content in crud.iter_match_result_lines(self.db, result_id))
+        segments = list(iter_text_segments(lines, max_bytes=40))
+        self.assertEqual("".join(segments), "".join(line + "\n" for line in EXPECTED))
+        self.assertTrue(all(len(segment.encode("utf-8")) <= 40 for segment in segments[:-1]))
+
+    def test_result_without_matches(self):
+        result_id = self._save({"error": "JSON解析失败"})
+        self.assertEqual(list(crud.iter_match_result_lines(self.db, result_id)), [])
+        self.assertTrue(crud.match_result_exists(self.db, result_id))
+        self.assertFalse(crud.match_result_exists(self.db, result_id + 1))
@@ -0,0 +1,74 @@
+"""多关键词组一次匹配：结果与逐组匹配一致，增量匹配复用快照中的区块命中"""
+import unittest
+
+from backend.services.clean_2 import detect_vendor
+from backend.services.keyword_service import ConfigKeywordMatcher, MultiSetMatcher
+from backend.services.snapshot_service import build_snapshot, match_multi_with_snapshot
+
+from .test_section_scopes import CONFIG, CountingMemo
+
+KEYWORD_SETS = {
+    1: (["shutdown", "Neighbor"], None, {}),
+    2: (["deny", "permit", "SHUTDOWN"], ["access-list"], {}),
+    3: ([r"re:remote-as \d+", "neighbor", r"re:eq \d+"], None, {"neighbor": ["router"]}),
+}
+HITS_KEYS = {set_id: f"{set_id}:1:test" for set_id in KEYWORD_SETS}
+
+
+def _expected(set_id):
+    keywords, scopes, keyword_scopes = KEYWORD_SETS[set_id]
+    return ConfigKeywordMatcher(keywords, scopes=scopes, keyword_scopes=keyword_scopes).search_config_data(
+        CONFIG, vendor="cisco")
+
+
+class MultiSetMatchTest(unittest.TestCase):
+    def setUp(self):
+        self.matcher = MultiSetMatcher(KEYWORD_SETS)
+        lines = CONFIG.splitlines()
+        _, self.snapshot, _ = build_snapshot(lines, detect_vendor(lines))
+
+    def test_single_pass_matches_each_set(self):
+        per_set = self.matcher.search_config_data(CONFIG, vendor="cisco")
+        for set_id in KEYWORD_SETS:
+            with self.subTest(set_id=set_id):
+                self.assertEqual(per_set[set_id], _expected(set_id))
+
+    def test_snapshot_match_matches_each_set(self):
+        per_set, reused = match_multi_with_snapshot(self.matcher, CONFIG, self.snapshot, HITS_KEYS, vendor="cisco")
+        self.assertEqual(reused, 0)
+        for set_id in KEYWORD_SETS:
+            with self.subTest(set_id=set_id):
+                self.assertEqual(per_set[set_id], _expected(set_id))
+
+    def test_unchanged_blocks_are_reused(self):
+        first, _ = match_multi_with_snapshot(self.matcher, CONFIG, self.snapshot, HITS_KEYS, vendor="cisco")
+        memo = CountingMemo(self.matcher.matcher)
+        second, reused = match_multi_with_snapshot(self.matcher, CONFIG, self.snapshot, HITS_KEYS,
+                                                   vendor="cisco", memo=memo)
+        self.assertEqual(reused, len(self.snapshot["blocks"]))
+        self.assertEqual(memo.lines, [])
+        self.assertEqual(second, first)
+
+    def test_only_sets_missing_hits_trigger_scan(self):
+        match_multi_with_snapshot(self.matcher, CONFIG, self.snapshot, {1: HITS_KEYS[1]}, vendor="cisco")
+        memo = CountingMemo(self.matcher.matcher)
+        per_set, reused = match_multi_with_snapshot(self.matcher, CONFIG, self.snapshot, HITS_KEYS,
+                                                    vendor="cisco", memo=memo)
+        self.assertEqual(reused, 0)
+        self.assertEqual(len(memo.lines), len(CONFIG.splitlines()))
+        for set_id in KEYWORD_SETS:
+            self.assertEqual(per_set[set_id], _expected(set_id))
+
+    def test_scoped_sets_scan_only_in_scope_lines(self):
+        hits_keys = {2: HITS_KEYS[2]}
+        memo = CountingMemo(self.matcher.matcher)
+        per_set, _ = match_multi_with_snapshot(self.matcher, CONFIG, self.snapshot, hits_keys, vendor="cisco",
+                                               memo=memo)
+        self.assertEqual(per_set[2], _expected(2))
+        sections = self.matcher.matcher.build_sections(CONFIG)
+        self.assertEqual(sorted(memo.lines), sorted(line for name, lines in sections.items()
+                                                    if name.startswith("access-list") for line, _ in lines))
+
+
+if __name__ == "__main__":
+    unittest.main()
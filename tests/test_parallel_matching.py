@@ -0,0 +1,94 @@
+"""块内并行处理：解析和匹配结果与串行处理逐字节一致"""
+import json
+import unittest
+
+from backend.services import parallel_service
+from backend.services.clean_2 import (
+    detect_vendor,
+    merge_parsed_parts,
+    parse_cisco,
+    parse_config_lines,
+    parse_vendor_lines,
+    split_config_chunks,
+)
+from backend.services.keyword_service import ConfigKeywordMatcher
+from backend.services.parallel_service import (
+    parse_blocks_parallel,
+    parse_config_lines_parallel,
+    search_config_data_parallel,
+)
+
+KEYWORDS = ["shutdown", "description", "网管", r"re:ip address 10\.\d+\.\d+\.\d+", "bgp"]
+
+
+def _cisco_config(interfaces: int = 120) -> str:
+    lines = ["hostname R1", "!"]
+    for i in range(interfaces):
+        lines += [
+            f"interface GigabitEthernet0/{i}",
+            f" description 上联-{i} 网管" if i % 3 == 0 else f" description uplink-{i}",
+            f" ip address 10.{i % 250}.0.1 255.255.255.0",
+            " shutdown" if i % 4 == 0 else " no shutdown",
+            "!",
+        ]
+    lines += ["router bgp 65000", " neighbor 10.0.0.2 remote-as 65001", "!",
+              "line vty 0 4", " transport input ssh", "!", "end"]
+    return "\n".join(lines) + "\n"
+
+
+def _dump(data) -> bytes:
+    return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+class ParallelMatchingTest(unittest.TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        parallel_service.shutdown_process_pool()
+
+    def test_search_matches_serial(self):
+        raw_data = _cisco_config()
+        self.assertGreater(len(split_config_chunks(raw_data.splitlines(), "cisco", 4)), 1)
+        matcher = ConfigKeywordMatcher(KEYWORDS)
+        serial = matcher.search_config_data(raw_data, vendor="cisco")
+        parallel = search_config_data_parallel(matcher, raw_data, vendor="cisco", workers=2)
+        self.assertTrue(serial["matches"])
+        self.assertEqual(_dump(parallel), _dump(serial))
+
+    def test_pool_reused_across_keyword_sets(self):
+        raw_data = _cisco_config(40)
+        for keywords in (KEYWORDS, ["bgp", "transport"], KEYWORDS):
+            matcher = ConfigKeywordMatcher(keywords)
+            pool = parallel_service.get_process_pool(2)
+            self.assertEqual(_dump(search_config_data_parallel(matcher, raw_data, vendor="cisco", workers=2)),
+                             _dump(matcher.search_config_data(raw_data, vendor="cisco")))
+            self.assertIs(parallel_service.get_process_pool(2), pool)
+
+    def test_parse_matches_serial(self):
+        raw_lines = _cisco_config().splitlines(keepends=True)
+        self.assertEqual(_dump(parse_config_lines_parallel(raw_lines, workers=2)),
+                         _dump(parse_config_lines(raw_lines)))
+
+    def test_parse_blocks_matches_serial(self):
+        lines = [line for line in _cisco_config(20).splitlines() if line.strip()]
+        vendor = detect_vendor(lines)
+        blocks = [lines[i:i + 5] for i in range(0, len(lines), 5)]
+        self.assertEqual(_dump(parse_blocks_parallel(blocks, vendor, workers=2)),
+                         _dump([parse_vendor_lines(block, vendor) for block in blocks]))
+
+    def test_mixed_case_block_keywords_match_serial(self):
+        # parse_cisco 对 interface / mpls 区分大小写：vrf 区块内的 "Interface"/"MPLS" 行不是区块起始
+        lines = ["hostname R1", "ip vrf CUST", " rd 65000:1", "Interface Loopback0", " route-target 65000:1",
+                 "MPLS label range 100 200", " description vrf-tail", "!"]
+        for i in range(12):
+            lines += [f"interface GigabitEthernet0/{i}", f" description port-{i}",
+                      f"Router BGP 6500{i % 3}" if i % 4 == 0 else " no shutdown", "!"]
+        lines.append("end")
+        chunks = [lines[start:end] for start, end in split_config_chunks(lines, "cisco", 36)]
+        self.assertGreater(len(chunks), 1)
+        self.assertNotIn("Interface Loopback0", [chunk[0] for chunk in chunks])
+        merged = merge_parsed_parts([parse_cisco(chunk) for chunk in chunks], "cisco")
+        self.assertEqual(_dump(merged), _dump({**parse_cisco(lines), "vendor": "cisco"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
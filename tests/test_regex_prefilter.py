@@ -0,0 +1,63 @@
+"""正则关键词预过滤：必需字面量的提取结果，以及关闭预过滤后匹配结果不变"""
+import unittest
+from unittest import mock
+
+from backend.services import keyword_service
+from backend.services.keyword_service import ConfigKeywordMatcher, extract_required_literals
+
+CONFIG = """hostname R1
+interface GigabitEthernet0/1
+ description uplink
+ ip address 10.0.0.1 255.255.255.0
+ shutdown
+snmp-server community public RW
+username admin privilege 15 secret 5 x
+"""
+
+
+class ExtractRequiredLiteralsTest(unittest.TestCase):
+    def test_literal_runs(self):
+        cases = {
+            r"snmp-server community \S+ RW": ["snmp-server community ", " rw"],
+            r"^\s*username \S+ privilege 15\b": ["username ", " privilege 15"],
+            r"ip address \d+\.\d+": ["ip address ", "."],
+            r"(abc)+def": ["abc", "def"],
+            r"(?>atomic)x": ["atomic", "x"],
+            "MiXeD": ["mixed"],
+        }
+        for pattern, literals in cases.items():
+            with self.subTest(pattern=pattern):
+                self.assertEqual(extract_required_literals(pattern), literals)
+
+    def test_optional_parts_are_not_required(self):
+        self.assertEqual(extract_required_literals(r"^interface (Gi|Te)\d+"), ["interface "])
+        self.assertEqual(extract_required_literals(r"(?:shut)?down"), ["down"])
+        self.assertEqual(extract_required_literals(r"a|b"), [])
+
+    def test_invalid_pattern_disables_prefilter(self):
+        self.assertEqual(extract_required_literals("("), [])
+
+    def test_parser_unavailable_disables_prefilter(self):
+        with mock.patch.object(keyword_service, "sre_parser", None):
+            self.assertEqual(extract_required_literals(r"snmp-server community \S+ RW"), [])
+
+    def test_parse_error_disables_prefilter(self):
+        with mock.patch.object(keyword_service.sre_parser, "parse", side_effect=RuntimeError("changed")):
+            self.assertEqual(extract_required_literals("shutdown"), [])
+
+
+class PrefilterFallbackTest(unittest.TestCase):
+    KEYWORDS = ["shutdown", r"re:snmp-server community \S+ RW", r"re:^\s*username \S+ privilege 15\b", r"re:\d+\.\d+\.\d+\.\d+"]
+
+    def test_results_unchanged_without_prefilter(self):
+        expected = ConfigKeywordMatcher(self.KEYWORDS).search_config_data(CONFIG)
+        with mock.patch.object(keyword_service, "sre_parser", None):
+            matcher = ConfigKeywordMatcher(self.KEYWORDS)
+            self.assertEqual(matcher.unfiltered_regexes, (0, 1, 2))
+            self.assertEqual(matcher.search_config_data(CONFIG), expected)
+        hits = {m["keyword"] for matches in expected["matches"].values() for m in matches}
+        self.assertEqual(hits, set(self.KEYWORDS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+"""保留策略：排除规则、按设备/按天数保留、dry_run 不删除、删除批次时扣除设备趋势贡献"""
+import os
+from datetime import datetime, timedelta
+from unittest import mock
+
+from sqlalchemy.exc import ArgumentError
+
+from backend import crud, models, schemas
+from backend.services import retention_service
+from backend.services.retention_service import plan_retention, run_gc
+
+from .support import TempDatabaseTestCase
+
+DAY = "2026-01-01"
+
+
+class _Unmapped:
+    """不是映射类：查询时抛出异常，用于在删除过程中途制造失败"""
+    __tablename__ = "unmapped"
+    batch_id = None
+
+
+class RetentionTest(TempDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        for name, value in (("SessionLocal", self.Session), ("UPLOAD_BASE_DIR", self.tmp_dir)):
+            patcher = mock.patch.object(retention_service, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _batch(self, days_ago: int, hostname: str = None, pinned: bool = False) -> int:
+        batch = crud.create_batch(self.db, schemas.BatchCreate(description="test"))
+        batch.timestamp = datetime.utcnow() - timedelta(days=days_ago)
+        batch.pinned = 1 if pinned else 0
+        if hostname:
+            self.db.add(models.DeviceSnapshot(hostname=hostname, vendor="cisco", batch_id=batch.id,
+                                              cleaned_file_1_id=batch.id, snapshot_path=""))
+        self.db.commit()
+        return batch.id
+
+    def _task(self, batch_id: int, status: str):
+        task = crud.create_batch_task(self.db, batch_id)
+        task.status = status
+        self.db.commit()
+
+    def _rollup(self) -> dict:
+        return {(r.hostname, r.keyword): r.hits for r in crud.query_fleet_rollups(self.db)}
+
+    def test_excludes_pinned_active_and_uploading_batches(self):
+        pinned = self._batch(60, pinned=True)
+        pending = self._batch(60)
+        self._task(pending, "pending")
+        running = self._batch(60)
+        self._task(running, "running")
+        uploading = self._batch(60)
+        crud.create_upload_session(self.db, uploading, None, [])
+        finished = self._batch(60)
+        self._task(finished, "done")
+        plain = self._batch(60)
+
+        planned = plan_retention(self.db, keep_per_device=0, keep_days=30)
+
+        self.assertEqual(planned, [finished, plain])
+        self.assertFalse({pinned, pending, running, uploading} & set(planned))
+
+    def test_per_device_and_age_rules(self):
+        r1_oldest = self._batch(100, "R1")
+        r1_old = self._batch(90, "R1")
+        r1_kept = self._batch(80, "R1")
+        r2_only = self._batch(100, "R2")
+        no_device_old = self._batch(100)
+        self._batch(1)
+        self._batch(1, "R1")
+
+        # 每台设备保留最近 2 个（按批次ID），其余超过 30 天的删除；没有设备信息的只按天数判断
+        self.assertEqual(plan_retention(self.db, keep_per_device=2, keep_days=30),
+                         [r1_oldest, r1_old, no_device_old])
+        self.assertNotIn(r1_kept, plan_retention(self.db, keep_per_device=2, keep_days=30))
+        self.assertNotIn(r2_only, plan_retention(self.db, keep_per_device=2, keep_days=30))
+        # 只按设备保留：没有设备信息的批次不删除
+        self.assertEqual(plan_retention(self.db, keep_per_device=2, keep_days=0), [r1_oldest, r1_old])
+        # 两条规则都未启用时不删除
+        self.assertEqual(plan_retention(self.db, keep_per_device=0, keep_days=0), [])
+
+    def test_dry_run_deletes_nothing(self):
+        old = self._batch(60)
+        batch_dir = os.path.join(self.tmp_dir, f"batch_{old}_20260101000000")
+        os.makedirs(batch_dir)
+
+        stats = run_gc(keep_per_device=0, keep_days=30, dry_run=True, vacuum=False)
+
+        self.assertEqual(stats["batches"], [old])
+        self.assertIsNotNone(crud.get_batch(self.db, old))
+        self.assertTrue(os.path.isdir(batch_dir))
+
+        stats = run_gc(keep_per_device=0, keep_days=30, vacuum=False)
+        self.assertEqual(stats["batches"], 1)
+        self.db.expire_all()
+        self.assertIsNone(crud.get_batch(self.db, old))
+        self.assertFalse(os.path.exists(batch_dir))
+
+    def test_delete_batches_subtracts_rollups_in_the_same_transaction(self):
+        first = self._batch(60)
+        second = self._batch(60)
+        crud.save_batch_summary(self.db, first, DAY, {}, [[1, "R1", "uplink", 3], [1, "R1", "bgp", 1]])
+        crud.save_batch_summary(self.db, second, DAY, {}, [[1, "R1", "uplink", 2]])
+        self.assertEqual(self._rollup(), {("R1", "uplink"): 5, ("R1", "bgp"): 1})
+
+        # 删除中途失败：回滚后设备趋势不变
+        with mock.patch.object(crud, "BATCH_CHILD_MODELS", (models.BatchSummary, _Unmapped)):
+            with self.assertRaises(ArgumentError):
+                crud.delete_batches(self.db, [first])
+        self.db.rollback()
+        self.assertEqual(self._rollup(), {("R1", "uplink"): 5, ("R1", "bgp"): 1})
+        self.assertIsNotNone(crud.get_batch_summary(self.db, first))
+
+        crud.delete_batches(self.db, [first])
+        self.assertEqual(self._rollup(), {("R1", "uplink"): 2})
+        crud.delete_batches(self.db, [second])
+        self.assertEqual(self._rollup(), {})
+        self.assertEqual(crud.query_fleet_rollups(self.db).count(), 0)
+
+    def test_superseded_match_results_keep_latest(self):
+        batch_id = self._batch(1)
+        ids = []
+        for file_id, keyword_set_id in ((1, 1), (1, 1), (1, 2), (2, 1), (1, 1)):
+            row = models.KeywordMatchResult(batch_id=batch_id, file_id=file_id, keyword_set_id=keyword_set_id,
+                                            filename="r1_matches.json", file_path="", match_data="{}")
+            self.db.add(row)
+            self.db.commit()
+            ids.append(row.id)
+
+        self.assertEqual(crud.delete_superseded_match_results(self.db, limit=1), 1)
+        self.assertEqual(crud.delete_superseded_match_results(self.db, limit=10), 1)
+        self.assertEqual(crud.delete_superseded_match_results(self.db, limit=10), 0)
+        remaining = sorted(row.id for row in self.db.query(models.KeywordMatchResult.id))
+        self.assertEqual(remaining, [ids[2], ids[3], ids[4]])
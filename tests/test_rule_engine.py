@@ -0,0 +1,67 @@
+"""关键词规则：区块/行级求值、关键词组引用、行位图缓存上限"""
+import unittest
+from types import SimpleNamespace
+
+from backend.services.rule_service import RuleEngine, RuleSyntaxError, parse_rule, rule_set_references
+
+CONFIG = """interface GigabitEthernet0/1
+ switchport mode trunk
+ switchport trunk allowed vlan 10,20
+!
+interface GigabitEthernet0/2
+ switchport mode trunk
+!
+router bgp 65000
+ neighbor 10.0.0.2 remote-as 65001
+ neighbor 10.0.0.2 password 7 xxx
+ neighbor 10.0.0.3 remote-as 65002
+!
+"""
+
+
+def _rule(rule_id, expression, level="section", sections=None):
+    return SimpleNamespace(id=rule_id, name=f"rule-{rule_id}", expression=expression, level=level, sections=sections)
+
+
+def _sections(result, rule_id):
+    return [finding["section"] for finding in result["findings"].get(rule_id, [])]
+
+
+class RuleEngineTest(unittest.TestCase):
+    def test_section_and_line_rules(self):
+        engine = RuleEngine([
+            _rule(1, '"switchport mode trunk" AND NOT "switchport trunk allowed vlan"', sections="interface"),
+            _rule(2, "neighbor AND NOT password", level="line"),
+        ])
+        result = engine.evaluate(CONFIG)
+        self.assertEqual(_sections(result, 1), ["interface gigabitethernet0/2"])
+        self.assertEqual([f["line"] for f in result["findings"][2]], [9, 11])
+
+    def test_keyword_set_reference(self):
+        engine = RuleEngine([_rule(1, "neighbor AND NOT set:7"), _rule(2, "set:7", level="line")],
+                            keyword_sets={7: ["Password", "re:authentication-key \\S+"]})
+        result = engine.evaluate(CONFIG)
+        self.assertNotIn(1, result["findings"])
+        self.assertEqual([f["line"] for f in result["findings"][2]], [10])
+        self.assertIn("set:7", result["findings"][2][0]["terms"])
+
+    def test_keyword_shared_by_term_and_set(self):
+        engine = RuleEngine([_rule(1, "password AND set:3", level="line")], keyword_sets={3: ["PASSWORD"]})
+        self.assertEqual([f["line"] for f in engine.evaluate(CONFIG)["findings"][1]], [10])
+
+    def test_set_references(self):
+        self.assertEqual(rule_set_references("set:3 AND (NOT SET:4 OR set:3) AND neighbor"), [3, 4])
+        with self.assertRaises(RuleSyntaxError):
+            parse_rule("set:abc")
+        with self.assertRaises(ValueError):
+            RuleEngine([_rule(1, "set:9")], keyword_sets={})
+
+    def test_line_mask_cache_is_bounded(self):
+        engine = RuleEngine([_rule(1, "neighbor", level="line")], max_line_masks=3)
+        result = engine.evaluate(CONFIG)
+        self.assertEqual(len(engine._line_masks), 3)
+        self.assertEqual([f["line"] for f in result["findings"][1]], [9, 10, 11])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""区块作用域：ACL 区块识别，以及增量匹配只扫描作用域内区块的行"""
+import unittest
+
+from backend.services.clean_2 import detect_vendor
+from backend.services.keyword_service import ConfigKeywordMatcher, LineMatchMemo
+from backend.services.snapshot_service import build_snapshot, match_with_snapshot
+
+CONFIG = """hostname R1
+!
+interface GigabitEthernet0/1
+ description uplink
+ ip access-group 101 in
+ shutdown
+!
+router bgp 65000
+ neighbor 10.0.0.2 remote-as 65001
+ neighbor 10.0.0.2 shutdown
+!
+access-list 101 permit tcp any host 10.0.0.1 eq 80
+access-list 101 deny ip any any
+ip access-list extended MGMT
+ permit tcp 10.0.0.0 0.0.0.255 any eq 22
+ deny ip any any
+!
+access-list 101 permit icmp any any
+line vty 0 4
+ shutdown
+!
+end
+"""
+KEYWORDS = ["shutdown", "deny", "permit", "neighbor"]
+
+
+class CountingMemo(LineMatchMemo):
+    def __init__(self, matcher):
+        super().__init__(matcher)
+        self.lines = []
+
+    def match_line(self, line):
+        self.lines.append(line)
+        return super().match_line(line)
+
+
+class AccessListSectionTest(unittest.TestCase):
+    def test_acl_lines_form_access_list_sections(self):
+        sections = ConfigKeywordMatcher.build_sections(CONFIG)
+        self.assertEqual([n for _, n in sections["access-list 101"]], [12, 13, 18])
+        self.assertEqual([n for _, n in sections["access-list extended mgmt"]], [14, 15, 16, 17])
+        self.assertNotIn(12, [n for _, n in sections.get("global", [])])
+        # 接口下的 ip access-group 引用不切断接口区块
+        self.assertIn(5, [n for _, n in sections["interface gigabitethernet0/1"]])
+
+    def test_access_list_scope(self):
+        matcher = ConfigKeywordMatcher(KEYWORDS, scopes=["access-list"])
+        result = matcher.search_config_data(CONFIG)
+        self.assertEqual(sorted(result["matches"]), ["access-list 101", "access-list extended mgmt"])
+        self.assertEqual(sorted(m["line"] for ms in result["matches"].values() for m in ms), [12, 13, 15, 16, 18])
+
+
+class ScopedSnapshotMatchTest(unittest.TestCase):
+    def _snapshot(self):
+        lines = CONFIG.splitlines()
+        _, snapshot, _ = build_snapshot(lines, detect_vendor(lines))
+        return snapshot
+
+    def test_scoped_match_scans_only_in_scope_lines(self):
+        matcher = ConfigKeywordMatcher(KEYWORDS, scopes=["router_bgp"], keyword_scopes={"deny": ["access-list"]})
+        memo = CountingMemo(matcher)
+        snapshot = self._snapshot()
+        result, _ = match_with_snapshot(matcher, CONFIG, snapshot, "1:1:test", vendor="cisco", memo=memo)
+
+        self.assertEqual(result, matcher.search_config_data(CONFIG, vendor="cisco"))
+        sections = matcher.build_sections(CONFIG)
+        in_scope = [(line, num) for name in ("router bgp 65000", "access-list 101", "access-list extended mgmt")
+                    for line, num in sections[name]]
+        self.assertEqual(sorted(memo.lines), sorted(line for line, _ in in_scope))
+        # 只扫描了部分行的区块不写入快照
+        in_scope_nums = {num for _, num in in_scope}
+        for block in snapshot["blocks"]:
+            if "1:1:test" in block["hits"]:
+                block_nums = range(block["start"] + 1, block["start"] + block["length"] + 1)
+                self.assertTrue(in_scope_nums.issuperset(block_nums))
+
+    def test_unscoped_match_records_every_block(self):
+        matcher = ConfigKeywordMatcher(KEYWORDS)
+        snapshot = self._snapshot()
+        result, reused = match_with_snapshot(matcher, CONFIG, snapshot, "1:1:test", vendor="cisco")
+        self.assertEqual(reused, 0)
+        self.assertEqual(result, matcher.search_config_data(CONFIG, vendor="cisco"))
+        self.assertTrue(all("1:1:test" in block["hits"] for block in snapshot["blocks"]))
+        again, reused = match_with_snapshot(matcher, CONFIG, snapshot, "1:1:test", vendor="cisco")
+        self.assertEqual(reused, len(snapshot["blocks"]))
+        self.assertEqual(again, result)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+"""批次任务队列：租约领取、过期接管后从检查点继续、重试用完标记失败、租约丢失时停止"""
+from datetime import datetime, timedelta
+from unittest import mock
+
+from backend import crud, models, schemas
+from backend.services import admission_service, task_service
+from backend.services.admission_service import AdmissionController
+from backend.services.task_service import run_batch_task
+
+from .support import TempDatabaseTestCase
+
+
+class TaskQueueTest(TempDatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        # 准入不使用共享台账；心跳线程的会话指向临时数据库
+        for target, name, value in (
+            (admission_service, "admission", AdmissionController(1 << 40, 4, 4)),
+            (task_service, "SessionLocal", self.Session),
+        ):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.batch = crud.create_batch(self.db, schemas.BatchCreate(description="test"))
+        self.calls = []
+
+    def _stages(self, on_run=None):
+        """记录执行顺序的假阶段；on_run(名称) 可在执行时抛出异常或修改任务"""
+        def stage(name):
+            def run(db, task):
+                self.calls.append(name)
+                if on_run is not None:
+                    on_run(name)
+            return name, run
+        return tuple(stage(name) for name in ("clean_1", "clean_2", "match"))
+
+    def _expire_lease(self, task_id: int):
+        self.db.query(models.BatchTask).filter(models.BatchTask.id == task_id).update(
+            {"lease_expires_at": datetime.utcnow() - timedelta(seconds=1)})
+        self.db.commit()
+
+    def test_leased_task_cannot_be_claimed_twice(self):
+        task = crud.create_batch_task(self.db, self.batch.id)
+        claimed = crud.claim_batch_task(self.db, "worker-a", lease_seconds=60)
+        self.assertEqual((claimed.id, claimed.lease_owner, claimed.attempts), (task.id, "worker-a", 1))
+        self.assertIsNone(crud.claim_batch_task(self.db, "worker-b", lease_seconds=60))
+        self.assertTrue(crud.renew_task_lease(self.db, task.id, "worker-a", 60))
+        self.assertFalse(crud.renew_task_lease(self.db, task.id, "worker-b", 60))
+
+    def test_expired_lease_is_taken_over_and_resumes_after_checkpoint(self):
+        task = crud.create_batch_task(self.db, self.batch.id)
+        crud.claim_batch_task(self.db, "worker-a", lease_seconds=60)
+        # worker-a 完成 clean_1 后崩溃
+        self.assertTrue(crud.checkpoint_batch_task(self.db, task.id, "worker-a", "clean_1"))
+        self._expire_lease(task.id)
+
+        taken = crud.claim_batch_task(self.db, "worker-b", lease_seconds=60)
+        self.assertEqual((taken.id, taken.stage, taken.attempts), (task.id, "clean_1", 2))
+        self.assertFalse(crud.checkpoint_batch_task(self.db, task.id, "worker-a", "clean_2"))
+
+        with mock.patch.object(task_service, "TASK_STAGES", self._stages()):
+            self.assertEqual(run_batch_task(self.db, taken, "worker-b"), "done")
+        self.assertEqual(self.calls, ["clean_2", "match"])
+        self.db.expire_all()
+        self.assertEqual(crud.get_batch_task(self.db, task.id).status, "done")
+        self.assertEqual(crud.get_batch(self.db, self.batch.id).status, "completed")
+
+    def test_exhausted_task_and_batch_are_marked_failed(self):
+        task = crud.create_batch_task(self.db, self.batch.id, max_attempts=1)
+        crud.claim_batch_task(self.db, "worker-a", lease_seconds=60)
+        self._expire_lease(task.id)
+        self.assertIsNone(crud.claim_batch_task(self.db, "worker-b", lease_seconds=60))
+
+        self.assertEqual(crud.fail_exhausted_tasks(self.db), 1)
+        self.db.expire_all()
+        failed = crud.get_batch_task(self.db, task.id)
+        self.assertEqual(failed.status, "failed")
+        self.assertIsNone(failed.lease_owner)
+        self.assertTrue(failed.last_error)
+        self.assertEqual(crud.get_batch(self.db, self.batch.id).status, "failed")
+
+    def test_lost_lease_stops_the_task(self):
+        task = crud.create_batch_task(self.db, self.batch.id)
+        claimed = crud.claim_batch_task(self.db, "worker-a", lease_seconds=60)
+
+        def taken_over(name):
+            # 执行 clean_1 期间租约过期并被 worker-b 接管
+            self._expire_lease(task.id)
+            crud.claim_batch_task(self.db, "worker-b", lease_seconds=60)
+
+        with mock.patch.object(task_service, "TASK_STAGES", self._stages(taken_over)):
+            self.assertEqual(run_batch_task(self.db, claimed, "worker-a"), "lost")
+        self.assertEqual(self.calls, ["clean_1"])
+        self.db.expire_all()
+        current = crud.get_batch_task(self.db, task.id)
+        self.assertEqual((current.lease_owner, current.stage, current.status), ("worker-b", None, "running"))